@@ -46,7 +46,11 @@ setup(
             'calmjs.rjs',
         ],
         'sanic': [
-            'sanic>=0.4',
+            'sanic>=0.7',
+        ],
+        'compression': [
+            'brotli',
+            'zstandard',
         ],
         'dev': [
             'aiohttp',
@@ -0,0 +1,221 @@
+# -*- coding: utf-8 -*-
+"""
+Admission control and per-client rate limiting of the submitted jobs
+"""
+
+from collections import OrderedDict
+from collections import deque
+from collections import namedtuple
+from math import ceil
+from threading import Lock
+from time import monotonic
+
+from .manager import QUEUED
+from .manager import RUNNING
+from .manager import EVICTED
+
+Rejection = namedtuple('Rejection', ['status', 'retry_after', 'message'])
+
+
+class TokenBucket(object):
+    """
+    A bucket of up to burst tokens, refilled at rate tokens a second.
+    """
+
+    def __init__(self, rate, burst, now):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = now
+
+    def refill(self, now):
+        self.tokens = min(
+            self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def take(self, count, now):
+        """
+        Take count tokens; return 0 if they were taken, otherwise the
+        seconds until that many will be available.
+        """
+
+        self.refill(now)
+        if self.tokens >= count:
+            self.tokens -= count
+            return 0
+        return (count - self.tokens) / self.rate
+
+
+class AdmissionControl(object):
+    """
+    Decide whether the jobs submitted by a client may be admitted,
+    before anything is done for them.  An instance is to be subscribed
+    to the JobManager, such that the jobs in flight (queued, waiting or
+    running) are tracked by their client and the rate the finished jobs
+    drain from the manager is estimated.
+
+    If rate is provided, the submissions of each client are limited by
+    a token bucket refilled at that many jobs a second and holding up
+    to burst (default is rate, but at least 1) jobs.  Exceeding it is
+    rejected with 429.
+
+    If max_inflight is provided, the jobs submitted while that many are
+    in flight are rejected with 503.  A client with jobs in flight that
+    take up more than its fair share of max_inflight, split evenly
+    between the clients with jobs in flight, is rejected with 429, such
+    that a client flooding the manager cannot keep the others out as
+    its jobs drain.
+
+    The rejections carry the seconds the client should retry after,
+    computed from the rate the jobs were drained at recently.
+
+    The clients are identified by a key, the remote address unless a
+    key_header (e.g. one set by a trusted proxy to the API key) is
+    provided, see JobServer.
+    """
+
+    # the number of the most recently finished jobs the drain rate is
+    # estimated from.
+    drain_window = 64
+    # the bounds of the seconds to retry after.
+    min_retry_after = 1
+    max_retry_after = 300
+    # the most token buckets kept; the least recently used ones are
+    # dropped, which only forgives the tokens taken from them.
+    max_clients = 65536
+
+    def __init__(
+            self, rate=None, burst=None, max_inflight=None,
+            key_header=None, clock=monotonic):
+        self.rate = rate
+        self.burst = max(rate or 0, 1) if burst is None else burst
+        self.max_inflight = max_inflight
+        self.key_header = key_header
+        self.clock = clock
+        self.lock = Lock()
+        # client key to its TokenBucket, in the order of use.
+        self.buckets = OrderedDict()
+        # client key to the count of its jobs in flight, including the
+        # ones admitted but not yet submitted, and the working_dir of
+        # the jobs in flight to their client key.
+        self.clients = {}
+        self.owners = {}
+        # the count of the jobs admitted but not yet submitted.
+        self.reserved = 0
+        # the times of the most recently finished jobs.
+        self.drained = deque(maxlen=self.drain_window)
+        # status to the count of the rejections.
+        self.rejected = {}
+
+    def __call__(self, working_dir, status):
+        if status.state in (QUEUED, RUNNING):
+            return
+        with self.lock:
+            if status.state != EVICTED:
+                self.drained.append(self.clock())
+            key = self.owners.pop(working_dir, None)
+            if key is not None:
+                self._decrement(key, 1)
+
+    def _decrement(self, key, count):
+        remaining = self.clients[key] - count
+        if remaining > 0:
+            self.clients[key] = remaining
+        else:
+            self.clients.pop(key)
+
+    def drain_rate(self, now=None):
+        """
+        Return the jobs finished a second recently, or None if too few
+        have finished to tell.
+        """
+
+        now = self.clock() if now is None else now
+        with self.lock:
+            if len(self.drained) < 2:
+                return None
+            span = now - self.drained[0]
+            return len(self.drained) / span if span > 0 else None
+
+    def _retry_after(self, seconds):
+        return int(min(max(
+            ceil(seconds), self.min_retry_after), self.max_retry_after))
+
+    def _reject(self, status, seconds, message):
+        self.rejected[status] = self.rejected.get(status, 0) + 1
+        return Rejection(status, self._retry_after(seconds), message)
+
+    def admit(self, key, inflight, count=1):
+        """
+        Admit count jobs from the client, with inflight jobs already in
+        flight with the manager.  Return None if admitted, after which
+        each of the jobs must either be bound or released; otherwise
+        return the Rejection.
+        """
+
+        now = self.clock()
+        rate = self.drain_rate(now)
+        with self.lock:
+            if self.max_inflight is not None:
+                if count > self.max_inflight:
+                    return Rejection(400, None, 'too many jobs submitted')
+                excess = inflight + self.reserved + count - self.max_inflight
+                if excess > 0:
+                    return self._reject(
+                        503, excess / rate if rate else 0,
+                        'server is over capacity')
+                active = len(self.clients) + (key not in self.clients)
+                share = -(-self.max_inflight // active)
+                excess = self.clients.get(key, 0) + count - share
+                if excess > 0:
+                    # the client's share of the drain rate.
+                    return self._reject(
+                        429, excess * active / rate if rate else 0,
+                        'too many jobs in flight for client')
+
+            if self.rate is not None:
+                if count > self.burst:
+                    return Rejection(400, None, 'too many jobs submitted')
+                bucket = self.buckets.get(key)
+                if bucket is None:
+                    bucket = self.buckets[key] = TokenBucket(
+                        self.rate, self.burst, now)
+                    while len(self.buckets) > self.max_clients:
+                        self.buckets.popitem(last=False)
+                else:
+                    self.buckets.move_to_end(key)
+                wait = bucket.take(count, now)
+                if wait:
+                    return self._reject(429, wait, 'rate limit exceeded')
+
+            self.clients[key] = self.clients.get(key, 0) + count
+            self.reserved += count
+        return None
+
+    def bind(self, key, working_dir, status):
+        """
+        Bind one of the jobs admitted for the client to the working_dir
+        it was submitted as, with its JobStatus, such that it is counted
+        as in flight until it is finished.
+        """
+
+        with self.lock:
+            self.reserved -= 1
+            if working_dir in self.owners or status.state not in (
+                    QUEUED, RUNNING):
+                # memoized, or finished already.
+                self._decrement(key, 1)
+            else:
+                self.owners[working_dir] = key
+
+    def release(self, key, count=1):
+        """
+        Release count of the jobs admitted for the client that were not
+        submitted.
+        """
+
+        if count <= 0:
+            return
+        with self.lock:
+            self.reserved -= count
+            self._decrement(key, count)
@@ -0,0 +1,303 @@
+# -*- coding: utf-8 -*-
+"""
+Executor agent that runs the jobs of a remote manager
+
+Run with ``python -m repodono.jobs.agent package.module:Manager``; the
+agent runs the jobs submitted by a RemoteJobManager with an instance of
+the named JobManager class in its own working directories, and serves
+their status and results over HTTP.
+"""
+
+import argparse
+import json
+import logging
+import os
+import re
+import signal
+import sys
+
+from http.server import BaseHTTPRequestHandler
+from http.server import HTTPServer
+from importlib import import_module
+from mimetypes import guess_type
+from os.path import join
+from shutil import copyfileobj
+from socketserver import ThreadingMixIn
+from threading import Thread
+from urllib.parse import parse_qs
+from urllib.parse import unquote
+from urllib.parse import urlsplit
+
+from .archive import FORMATS
+from .manager import EVICTED
+from .manager import QUEUED
+from .manager import RUNNING
+
+logger = logging.getLogger(__name__)
+
+# the job ids are the names of the working directories.
+JOB_ID = r'(?P<job_id>[^/.][^/]*)'
+
+ROUTES = (
+    ('GET', re.compile(r'^/capacity$'), 'capacity'),
+    ('POST', re.compile(r'^/jobs$'), 'submit'),
+    ('POST', re.compile(r'^/poll$'), 'poll'),
+    ('GET', re.compile(r'^/jobs/%s$' % JOB_ID), 'describe'),
+    ('DELETE', re.compile(r'^/jobs/%s$' % JOB_ID), 'cancel'),
+    ('GET', re.compile(r'^/jobs/%s/index$' % JOB_ID), 'index'),
+    ('GET', re.compile(r'^/jobs/%s/results/(?P<key>.+)$' % JOB_ID),
+        'result'),
+    ('GET', re.compile(r'^/jobs/%s/archive$' % JOB_ID), 'archive'),
+)
+
+
+class AgentHandler(BaseHTTPRequestHandler):
+    """
+    The handler for the requests to the agent; the responses without a
+    Content-Length are delimited by closing the connection.
+    """
+
+    def log_message(self, format, *args):
+        logger.debug(format, *args)
+
+    def _dispatch(self):
+        parts = urlsplit(self.path)
+        for method, pattern, name in ROUTES:
+            match = pattern.match(parts.path)
+            if match and method == self.command:
+                kw = {k: unquote(v) for k, v in match.groupdict().items()}
+                query = {
+                    k: v[0] for k, v in parse_qs(parts.query).items()}
+                try:
+                    getattr(self, 'route_' + name)(query=query, **kw)
+                except KeyError:
+                    self._json({'error': 'no such job_id or key'}, 404)
+                except ValueError as e:
+                    self._json({'error': str(e)}, 400)
+                return
+        self._json({'error': 'not found'}, 404)
+
+    do_GET = do_POST = do_DELETE = _dispatch
+
+    def _load(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        try:
+            return json.loads(self.rfile.read(length).decode('utf8'))
+        except ValueError:
+            raise ValueError('request body must be JSON')
+
+    def _json(self, obj, status=200):
+        body = json.dumps(obj).encode('utf8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    @property
+    def agent(self):
+        return self.server.agent
+
+    def route_capacity(self, query):
+        self._json(self.agent.capacity())
+
+    def route_submit(self, query):
+        kw = self._load()
+        if not isinstance(kw, dict):
+            raise ValueError('request body must be a JSON object')
+        self._json({'job_id': self.agent.submit(kw)}, 201)
+
+    def route_poll(self, query):
+        job_ids = self._load()
+        if not isinstance(job_ids, list):
+            raise ValueError('request body must be a JSON array')
+        result = self.agent.capacity()
+        result['jobs'] = self.agent.poll(job_ids)
+        self._json(result)
+
+    def route_describe(self, query, job_id):
+        self._json(self.agent.describe(job_id))
+
+    def route_cancel(self, query, job_id):
+        self._json({'cancelled': self.agent.cancel(job_id)})
+
+    def route_index(self, query, job_id):
+        self._json(self.agent.index(job_id))
+
+    def route_result(self, query, job_id, key):
+        manager = self.agent.manager
+        with manager.open_result(self.agent.lookup(job_id), key) as fd:
+            self.send_response(200)
+            self.send_header(
+                'Content-Type',
+                guess_type(key)[0] or 'application/octet-stream')
+            self.send_header(
+                'Content-Length', str(os.fstat(fd.fileno()).st_size))
+            self.end_headers()
+            copyfileobj(fd, self.wfile)
+
+    def route_archive(self, query, job_id):
+        fmt = query.get('format', 'tar.gz')
+        if fmt not in FORMATS:
+            raise ValueError('unsupported archive format')
+        entries = self.agent.manager.list_result_files(
+            self.agent.lookup(job_id), query.get('glob'))
+        generate, extension, content_type = FORMATS[fmt]
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.send_header(
+            'Content-Disposition', 'attachment; filename="%s%s"' % (
+                job_id, extension))
+        self.end_headers()
+        for chunk in generate(entries):
+            self.wfile.write(chunk)
+
+
+class AgentServer(ThreadingMixIn, HTTPServer):
+    """
+    Serves each request from its own thread.
+    """
+
+    # the requests in progress do not hold up the exit.
+    daemon_threads = True
+
+
+class Agent(object):
+    """
+    Serve the jobs run by the manager over HTTP on host and port (an
+    ephemeral port by default, see url), for a RemoteJobManager.
+    """
+
+    # seconds between the checks for shutdown by the server thread.
+    shutdown_interval = 0.1
+
+    def __init__(self, manager, host='127.0.0.1', port=0):
+        self.manager = manager
+        self.host = host
+        self.port = port
+        self.server = None
+        self.thread = None
+
+    @property
+    def url(self):
+        host, port = self.server.server_address[:2]
+        return 'http://%s:%d' % (host, port)
+
+    def start(self):
+        """
+        Start the manager and serve from a background thread.
+        """
+
+        self.manager.start()
+        self.server = AgentServer((self.host, self.port), AgentHandler)
+        self.server.agent = self
+        self.thread = Thread(
+            target=self.server.serve_forever, args=(self.shutdown_interval,),
+            name='Agent')
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self):
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+            self.thread.join()
+            self.server = None
+            self.thread = None
+        self.manager.stop()
+
+    def lookup(self, job_id):
+        """
+        Return the working_dir of the job, or raise KeyError.
+        """
+
+        working_dir = join(self.manager.root, job_id)
+        if '/' in job_id or working_dir not in self.manager.status:
+            raise KeyError('no such job_id')
+        return working_dir
+
+    def capacity(self):
+        manager = self.manager
+        return {
+            'running': len(manager.running),
+            'queued': len(manager.queued) + len(manager.waiting),
+            'capacity': manager.max_concurrent or os.cpu_count() or 1,
+        }
+
+    def submit(self, kw):
+        return os.path.basename(self.manager.run(**kw))
+
+    def _state(self, job_id):
+        try:
+            status = self.manager.status[self.lookup(job_id)]
+        except KeyError:
+            return {'state': EVICTED, 'returncode': None}
+        return {'state': status.state, 'returncode': status.returncode}
+
+    def poll(self, job_ids):
+        return {job_id: self._state(job_id) for job_id in job_ids}
+
+    def describe(self, job_id):
+        working_dir = self.lookup(job_id)
+        result = self._state(job_id)
+        if result['state'] not in (QUEUED, RUNNING):
+            result['keys'] = self.manager.list_result_keys(working_dir)
+        return result
+
+    def cancel(self, job_id):
+        return self.manager.cancel(self.lookup(job_id))
+
+    def index(self, job_id):
+        index = self.manager.get_index(self.lookup(job_id))
+        if index is None:
+            raise ValueError('job has not finished')
+        return [
+            [key, entry.size, entry.mtime_ns, entry.inode]
+            for key, entry in index.items()
+        ]
+
+
+def load_manager(name, **kw):
+    """
+    Instantiate the JobManager class named as module:attribute.
+    """
+
+    module, _, attr = name.partition(':')
+    if not attr:
+        raise ValueError('manager must be named as module:attribute')
+    return getattr(import_module(module), attr)(**kw)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog='python -m repodono.jobs.agent', description=__doc__.strip())
+    parser.add_argument(
+        'manager', help='the JobManager class, as module:attribute')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=0)
+    parser.add_argument('--max-concurrent', type=int, default=None)
+    parser.add_argument(
+        '--root', default=None,
+        help='the persistent root for the working directories')
+    args = parser.parse_args(argv)
+
+    agent = Agent(load_manager(
+        args.manager, max_concurrent=args.max_concurrent, root=args.root),
+        host=args.host, port=args.port)
+    agent.start()
+    # terminated through the finally clause, such that the jobs are
+    # stopped and their working directories removed.
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    # the url is reported such that an ephemeral port may be found.
+    print(agent.url)
+    sys.stdout.flush()
+    try:
+        agent.thread.join()
+    except KeyboardInterrupt:  # pragma: no cover
+        pass
+    finally:
+        agent.stop()
+
+
+if __name__ == '__main__':  # pragma: no cover
+    main()
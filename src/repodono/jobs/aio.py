@@ -0,0 +1,261 @@
+# -*- coding: utf-8 -*-
+"""
+Asyncio based managers
+"""
+
+import asyncio
+import logging
+import signal
+
+from functools import partial
+from shutil import rmtree
+
+from .exc import ManagerRuntimeError
+from .manager import EVICTED
+from .manager import JobManager
+from .manager import QUEUED
+from .manager import RUNNING
+from .manager import WDManager
+from .spawn import POPEN
+
+logger = logging.getLogger(__name__)
+
+
+class AsyncJobManager(JobManager):
+    """
+    Job manager that spawns its subprocesses through the asyncio event
+    loop, such that none of its operations would block the loop.
+
+    The run, run_after, run_batch, execute, wait, terminate, cancel and stop
+    methods are coroutines and must be awaited.  The subscribed
+    callbacks are invoked from the event loop, and the output of the
+    subprocesses is collected by tasks on the loop.  As the subprocesses are
+    reaped by asyncio, their resource usage is not accounted for, and
+    only the default spawn_strategy is accepted.
+    """
+
+    def __init__(self, terminate_timeout=1.0, **kw):
+        if kw.get('spawn_strategy', POPEN) != POPEN:
+            raise ValueError(
+                'the subprocesses of the AsyncJobManager are always '
+                'spawned through asyncio')
+        super(AsyncJobManager, self).__init__(**kw)
+        self.terminate_timeout = terminate_timeout
+        # working_dir to the asyncio.Event that is set on completion.
+        self.events = {}
+
+    async def run(self, **kw):
+        if self.root is NotImplemented:
+            raise ManagerRuntimeError('manager not started')
+        key = self.get_cache_key(**kw) if self.memoize else None
+        if key is not None:
+            working_dir = self.find_memoized(key)
+            if working_dir is not None:
+                return working_dir
+        working_dir = self.create_working_dir()
+        if key is not None:
+            # remembered before yielding such that concurrent identical
+            # submissions are coalesced into this one.
+            self.remember(key, working_dir)
+        await self.execute(working_dir=working_dir, **kw)
+        return working_dir
+
+    async def execute(self, working_dir, **kw):
+        self.enqueue(working_dir, **kw)
+        await self.schedule()
+
+    async def run_after(self, upstream, **kw):
+        if self.root is NotImplemented:
+            raise ManagerRuntimeError('manager not started')
+        working_dir = self.create_working_dir()
+        try:
+            await self.execute_after(working_dir, upstream, **kw)
+        except KeyError:
+            rmtree(working_dir, ignore_errors=True)
+            raise
+        return working_dir
+
+    async def execute_after(self, working_dir, upstream, **kw):
+        finished = self._enqueue_waiting(working_dir, upstream, kw)
+        blocked = await asyncio.get_event_loop().run_in_executor(
+            None, self._link_finished, working_dir, finished)
+        self._release(working_dir, blocked)
+        await self.schedule()
+
+    async def run_batch(self, batch):
+        working_dirs = self.enqueue_batch(batch)
+        await self.schedule()
+        return working_dirs
+
+    def enqueue(self, working_dir, **kw):
+        self.events[working_dir] = asyncio.Event()
+        super(AsyncJobManager, self).enqueue(working_dir, **kw)
+
+    async def spawn(self, working_dir, **kw):
+        args = self.get_args(working_dir=working_dir, **kw)
+        limits = self.prepare_limits(working_dir, **kw)
+        output = asyncio.subprocess.PIPE if self.capture_output else None
+        process = await asyncio.create_subprocess_exec(
+            *args, preexec_fn=self.get_preexec(working_dir),
+            start_new_session=True, stdout=output, stderr=output)
+        self.mapping[working_dir] = process
+        self.status[working_dir].pid = process.pid
+        for name in self.log_names:
+            stream = getattr(process, name)
+            if stream is not None:
+                asyncio.ensure_future(self._collect(
+                    stream, self.create_log(working_dir, name)))
+        asyncio.ensure_future(self._watch(working_dir, process))
+        if self.status[working_dir].cancelled:
+            # cancelled while it was being spawned.
+            self.kill_process(working_dir, process, self.cancel_timeout)
+        elif limits is not None:
+            self.enforce(working_dir, process, limits)
+
+    def call_later(self, delay, callback):
+        asyncio.get_event_loop().call_later(delay, callback)
+
+    def kill_process(self, working_dir, process, timeout):
+        asyncio.ensure_future(self._kill(process, timeout))
+
+    async def _kill(self, process, timeout):
+        if process.returncode is not None:
+            return
+        self.signal_process(process, signal.SIGTERM)
+        try:
+            await asyncio.wait_for(process.wait(), timeout)
+        except asyncio.TimeoutError:
+            logger.warning(
+                'subprocess %d did not terminate; killing' % process.pid)
+            self.signal_process(process, signal.SIGKILL)
+            await process.wait()
+
+    async def cancel(self, working_dir):
+        cancelled = self._cancel(working_dir)
+        await self.schedule()
+        return cancelled
+
+    def discard(self, working_dir):
+        asyncio.ensure_future(self._discard(working_dir))
+
+    async def _discard(self, working_dir):
+        status = self._untrack(working_dir)
+        if status is None:
+            return
+        # the removal of the working directory must not block the loop.
+        await asyncio.get_event_loop().run_in_executor(
+            None, partial(rmtree, working_dir, ignore_errors=True))
+        status.state = EVICTED
+        self.notify(working_dir, status)
+
+    async def _collect(self, stream, log):
+        try:
+            while True:
+                data = await stream.read(self.output_collector.chunk_size)
+                if not data:
+                    break
+                log.write(data)
+        except OSError:
+            logger.debug('failed to write %s', log.path)
+        finally:
+            try:
+                log.close()
+            except OSError:
+                pass
+
+    async def _watch(self, working_dir, process):
+        await self._finish(working_dir, await process.wait())
+
+    def finish(self, working_dir, returncode, rusage=None):
+        asyncio.ensure_future(self._finish(working_dir, returncode, rusage))
+
+    async def _finish(self, working_dir, returncode, rusage=None):
+        # the results are scanned and linked downstream in the executor,
+        # with the status only recorded once they are indexed.
+        loop = asyncio.get_event_loop()
+        index, size = await loop.run_in_executor(
+            None, self._measure, working_dir)
+        status, downstream = self._record(
+            working_dir, returncode, rusage, index, size)
+        # set before the job may be evicted.
+        event = self.events.get(working_dir)
+        if event is not None:
+            event.set()
+        if downstream:
+            linked = await loop.run_in_executor(
+                None, self._link_downstream, working_dir, status, downstream)
+            self._resolve(working_dir, downstream, linked)
+        self._finished(working_dir, status)
+        await self.schedule()
+
+    async def schedule(self):
+        while True:
+            job = self.dequeue()
+            if job is None:
+                break
+            working_dir, kw = job
+            self.notify(working_dir, self.status[working_dir])
+            try:
+                await self.spawn(working_dir, **kw)
+            except Exception:
+                self.finish(working_dir, None)
+                raise
+
+    async def wait(self, working_dir):
+        """
+        Wait for the job at working_dir to finish, return its returncode.
+        """
+
+        # looked up first as the job may be evicted once finished.
+        event = self.events[working_dir]
+        status = self.status[working_dir]
+        await event.wait()
+        return status.returncode
+
+    async def terminate(self, working_dir, timeout=None):
+        """
+        Cancel the job at working_dir as cancel does, escalating to kill
+        should the subprocess not exit within the timeout, and wait for
+        it to finish.  Returns the returncode, which is None for a job
+        that had yet to be started; a job that has already finished is
+        left as is.
+        """
+
+        # looked up first as the job is evicted once cancelled.
+        event = self.events[working_dir]
+        status = self.status[working_dir]
+        if status.state in (QUEUED, RUNNING):
+            self._cancel(working_dir, (
+                self.terminate_timeout if timeout is None else timeout))
+            await self.schedule()
+        await event.wait()
+        return status.returncode
+
+    def _untrack(self, working_dir):
+        status = super(AsyncJobManager, self)._untrack(working_dir)
+        if status is not None:
+            self.events.pop(working_dir, None)
+        return status
+
+    async def stop(self):
+        self._stop_collector()
+        queued = len(self.queued) + len(self.waiting)
+        if queued:
+            logger.warning('discarding %d queued job(s)' % queued)
+        self.queued.clear()
+        self.pending.clear()
+        self.waiting.clear()
+        self.downstream.clear()
+        running = [
+            wd for wd, p in self.mapping.items() if p.returncode is None]
+        for wd in running:
+            logger.warning(
+                'subprocess %d is still running' % self.mapping[wd].pid)
+        if running:
+            await asyncio.gather(*(
+                self._kill(self.mapping[wd], self.terminate_timeout)
+                for wd in running))
+        self.running.clear()
+        for wd in list(self.dir_fds):
+            self.invalidate(wd)
+        WDManager.stop(self)
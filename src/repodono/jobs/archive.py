@@ -0,0 +1,142 @@
+# -*- coding: utf-8 -*-
+"""
+Streamed archives of the results
+"""
+
+import io
+import os
+import stat
+import sys
+import tarfile
+import time
+import zlib
+import zipfile
+
+CHUNK_SIZE = 65536
+
+
+class _Buffer(io.RawIOBase):
+    """
+    Unseekable stream that accumulates what was written until drained.
+    """
+
+    def __init__(self):
+        self.chunks = []
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def drain(self):
+        data = b''.join(self.chunks)
+        self.chunks = []
+        return data
+
+
+def _read_exactly(fd, size, chunk_size):
+    # yield exactly size bytes from fd, padding with nulls should the
+    # file have been truncated since it was measured.
+    remaining = size
+    while remaining > 0:
+        chunk = fd.read(min(chunk_size, remaining))
+        if not chunk:
+            chunk = bytes(min(chunk_size, remaining))
+        remaining -= len(chunk)
+        yield chunk
+
+
+def iter_tar(entries, chunk_size=CHUNK_SIZE):
+    """
+    Yield the chunks of an uncompressed tar archive of the entries, an
+    iterable of (name, path) of regular files.
+    """
+
+    for name, path in entries:
+        try:
+            fd = open(path, 'rb')
+        except OSError:
+            # vanished since being listed.
+            continue
+        with fd:
+            st = os.fstat(fd.fileno())
+            info = tarfile.TarInfo(name)
+            info.size = st.st_size
+            info.mtime = int(st.st_mtime)
+            info.mode = stat.S_IMODE(st.st_mode)
+            yield info.tobuf(format=tarfile.PAX_FORMAT)
+            for chunk in _read_exactly(fd, info.size, chunk_size):
+                yield chunk
+        remainder = info.size % tarfile.BLOCKSIZE
+        if remainder:
+            yield bytes(tarfile.BLOCKSIZE - remainder)
+    # the end of archive marker, padded to the record size.
+    yield bytes(tarfile.RECORDSIZE)
+
+
+def iter_tar_gz(entries, chunk_size=CHUNK_SIZE):
+    """
+    Yield the chunks of a gzip compressed tar archive of the entries.
+    """
+
+    compressor = zlib.compressobj(wbits=31)
+    for chunk in iter_tar(entries, chunk_size):
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def _zip_info(name, st):
+    # as ZipInfo.from_file (which requires Python 3.6) but for the file
+    # already opened; zip timestamps cannot predate 1980.
+    date_time = time.localtime(st.st_mtime)[:6]
+    if date_time[0] < 1980:
+        date_time = (1980, 1, 1, 0, 0, 0)
+    info = zipfile.ZipInfo(name, date_time)
+    info.external_attr = (st.st_mode & 0xFFFF) << 16
+    info.file_size = st.st_size
+    info.compress_type = zipfile.ZIP_DEFLATED
+    return info
+
+
+def iter_zip(entries, chunk_size=CHUNK_SIZE):
+    """
+    Yield the chunks of a zip archive of the entries; requires Python
+    3.6.
+    """
+
+    buf = _Buffer()
+    with zipfile.ZipFile(buf, 'w', zipfile.ZIP_DEFLATED) as archive:
+        for name, path in entries:
+            try:
+                fd = open(path, 'rb')
+            except OSError:
+                continue
+            with fd:
+                info = _zip_info(name, os.fstat(fd.fileno()))
+                force_zip64 = info.file_size > zipfile.ZIP64_LIMIT
+                with archive.open(info, 'w', force_zip64=force_zip64) as dst:
+                    for chunk in iter(lambda: fd.read(chunk_size), b''):
+                        dst.write(chunk)
+                        data = buf.drain()
+                        if data:
+                            yield data
+            data = buf.drain()
+            if data:
+                yield data
+    yield buf.drain()
+
+
+# format to the generator, the file extension and the content type.
+FORMATS = {
+    'tar': (iter_tar, '.tar', 'application/x-tar'),
+    'tar.gz': (iter_tar_gz, '.tar.gz', 'application/gzip'),
+}
+
+if sys.version_info >= (3, 6):
+    # writing the entries of a zip archive as a stream requires the
+    # ZipFile.open of Python 3.6.
+    FORMATS['zip'] = (iter_zip, '.zip', 'application/zip')
@@ -0,0 +1,410 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmarks for the job managers and server
+
+Run with ``python -m repodono.jobs.bench``; the results are written as
+JSON for comparison between releases.  The server benchmarks require
+sanic and drive an actual server process over HTTP.  The spawn
+benchmarks report the latency of spawning with each of the spawn
+strategies as the memory of the process grows.
+"""
+
+import argparse
+import gc
+import http.client
+import json
+import math
+import os
+import sys
+import threading
+import time
+import tracemalloc
+
+from concurrent.futures import ThreadPoolExecutor
+from multiprocessing import Process
+from os.path import isdir
+from os.path import join
+from urllib.parse import urlencode
+
+from .limits import ResourceLimits
+from .manager import JobManager
+from .manager import QUEUED
+from .manager import RUNNING
+from .spawn import STRATEGIES
+
+
+class NoopManager(JobManager):
+    """
+    Jobs that do nothing.
+    """
+
+    def get_args(self, working_dir, **kw):
+        return (sys.executable, '-c', 'pass')
+
+    def verify_run_kwargs(self, **kw):
+        return {}
+
+
+class SleepManager(JobManager):
+    """
+    Jobs that sleep for the duration.
+    """
+
+    duration = 0.1
+
+    def get_args(self, working_dir, **kw):
+        return (
+            sys.executable, '-c', 'import time; time.sleep(%f)' %
+            self.duration)
+
+    def verify_run_kwargs(self, **kw):
+        return {}
+
+
+class LargeOutputManager(JobManager):
+    """
+    Jobs that write a file of the size into the working directory.
+    """
+
+    size = 16 << 20
+
+    def get_args(self, working_dir, **kw):
+        return (sys.executable, '-c', (
+            'with open(%r, "wb") as fd:\n'
+            '    fd.truncate(%d)\n') % (join(working_dir, 'out'), self.size))
+
+    def verify_run_kwargs(self, **kw):
+        return {}
+
+
+MANAGERS = {
+    'noop': NoopManager,
+    'sleep': SleepManager,
+    'large': LargeOutputManager,
+}
+
+
+def percentile(values, p):
+    """
+    Return the p-th percentile of the values, by the nearest rank.
+    """
+
+    if not values:
+        return None
+    values = sorted(values)
+    rank = max(int(math.ceil(p / 100.0 * len(values))) - 1, 0)
+    return values[min(rank, len(values) - 1)]
+
+
+def summarize(values):
+    return {
+        'count': len(values),
+        'p50': percentile(values, 50),
+        'p99': percentile(values, 99),
+        'max': max(values) if values else None,
+    }
+
+
+def count_fds():
+    if isdir('/proc/self/fd'):
+        return len(os.listdir('/proc/self/fd'))
+    return None
+
+
+def count_children():
+    """
+    Return the number of live child processes, where it can be known.
+    """
+
+    if not isdir('/proc'):
+        return None
+    pid = str(os.getpid())
+    total = 0
+    for entry in os.listdir('/proc'):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(join('/proc', entry, 'stat')) as fd:
+                # the ppid is the 4th field after the parenthesized name
+                fields = fd.read().rsplit(')', 1)[1].split()
+        except (OSError, IndexError):
+            continue
+        if fields[1] == pid:
+            total += 1
+    return total
+
+
+def current_rss():
+    """
+    Return the resident set size of this process in bytes, where it can
+    be known.
+    """
+
+    try:
+        with open('/proc/self/statm') as fd:
+            return int(fd.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError):
+        return None
+
+
+def wait_all(manager, working_dirs, timeout=60):
+    deadline = time.time() + timeout
+    pending = set(working_dirs)
+    while pending and time.time() < deadline:
+        pending = {
+            wd for wd in pending
+            if manager.poll(wd) in (QUEUED, RUNNING)
+        }
+        if pending:
+            time.sleep(0.005)
+    return not pending
+
+
+def bench_manager(manager, jobs=100):
+    """
+    Run the jobs through the started manager directly, report the run
+    (spawn) latency, the job throughput and the resources in use.
+    """
+
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    run_latency = []
+    start = time.perf_counter()
+    working_dirs = []
+    peak_fds = count_fds()
+    peak_children = 0
+    for x in range(jobs):
+        t = time.perf_counter()
+        working_dirs.append(manager.run())
+        run_latency.append(time.perf_counter() - t)
+        if x % 10 == 0:
+            peak_fds = max(peak_fds or 0, count_fds() or 0)
+            peak_children = max(peak_children, count_children() or 0)
+    completed = wait_all(manager, working_dirs)
+    elapsed = time.perf_counter() - start
+
+    gc.collect()
+    after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+    tracked = sum(
+        stat.size_diff for stat in after.compare_to(before, 'filename'))
+
+    turnaround = [
+        status.finished - status.submitted
+        for status in (manager.status[wd] for wd in working_dirs)
+        if status.finished is not None
+    ]
+    return {
+        'jobs': jobs,
+        'completed': completed,
+        'elapsed': elapsed,
+        'jobs_per_sec': jobs / elapsed,
+        'run_latency': summarize(run_latency),
+        'turnaround': summarize(turnaround),
+        'memory_per_job': tracked / jobs,
+        'peak_fds': peak_fds,
+        'peak_children': peak_children,
+    }
+
+
+def bench_spawn(strategy, ballast=(0,), jobs=50, limits=None):
+    """
+    Report the latency of creating the subprocesses with the spawn
+    strategy while this process holds each of the ballast sizes (in
+    bytes) of memory, written to such that it is resident.  If limits
+    are provided, they are applied to the subprocesses, which requires
+    a preexec_fn for Popen.
+    """
+
+    manager = NoopManager(
+        spawn_strategy=strategy, limits=limits, capture_output=False)
+    manager.start()
+    reports = []
+    try:
+        args = manager.get_args(manager.root)
+        for size in ballast:
+            held = bytearray(b'\1') * size
+            latency = []
+            for x in range(jobs):
+                working_dir = manager.create_working_dir()
+                manager.prepare_limits(working_dir)
+                t = time.perf_counter()
+                process = manager.create_process(args, working_dir)
+                latency.append(time.perf_counter() - t)
+                process.wait()
+                manager.job_limits.pop(working_dir, None)
+            report = summarize(latency)
+            report['ballast'] = size
+            report['rss'] = current_rss()
+            reports.append(report)
+            del held
+    finally:
+        manager.stop()
+    return reports
+
+
+def _serve(manager_name, host, port, manager_kw):
+    from sanic import Sanic
+    from .sanic import JobServer
+
+    app = Sanic(__name__)
+    JobServer(MANAGERS[manager_name](**manager_kw)).register(app)
+    app.run(host=host, port=port)
+
+
+class Client(object):
+    """
+    Minimal HTTP client over a single persistent connection.
+    """
+
+    def __init__(self, host, port):
+        self.host = host
+        self.port = port
+        self.conn = http.client.HTTPConnection(host, port, timeout=60)
+
+    def request(self, method, path, body=None, headers=None):
+        t = time.perf_counter()
+        self.conn.request(method, path, body=body, headers=headers or {})
+        response = self.conn.getresponse()
+        data = response.read()
+        return response.status, data, time.perf_counter() - t
+
+
+def _drive(local, host, port, timings, wait):
+    client = getattr(local, 'client', None)
+    if client is None:
+        client = local.client = Client(host, port)
+
+    status, data, elapsed = client.request(
+        'POST', '/execute', body=urlencode({'x': '1'}),
+        headers={'Content-Type': 'application/x-www-form-urlencoded'})
+    timings['execute'].append(elapsed)
+    location = json.loads(data.decode('utf8'))['location']
+
+    while True:
+        status, data, elapsed = client.request(
+            'GET', location + ('?wait=%d' % wait if wait else ''))
+        timings['poll'].append(elapsed)
+        result = json.loads(data.decode('utf8'))
+        if result.get('status') not in (QUEUED, RUNNING):
+            break
+        if not wait:
+            time.sleep(0.01)
+
+    for key in result.get('keys', []):
+        status, data, elapsed = client.request(
+            'GET', '%s/%s' % (location, key))
+        timings['results'].append(elapsed)
+
+
+def bench_server(
+        manager_name, jobs=100, concurrency=8, host='127.0.0.1',
+        port=8765, wait=30, manager_kw=None):
+    """
+    Start a server process with the named manager and drive it with
+    concurrent clients, each submitting a job, polling it until it is
+    finished and fetching all its results.
+    """
+
+    server = Process(
+        target=_serve, args=(manager_name, host, port, manager_kw or {}))
+    server.daemon = True
+    server.start()
+    try:
+        deadline = time.time() + 30
+        while True:
+            try:
+                Client(host, port).request('GET', '/poll/ready')
+                break
+            except OSError:
+                if time.time() > deadline:
+                    raise
+                time.sleep(0.05)
+
+        timings = {'execute': [], 'poll': [], 'results': []}
+        local = threading.local()
+        start = time.perf_counter()
+        with ThreadPoolExecutor(concurrency) as executor:
+            for future in [
+                    executor.submit(_drive, local, host, port, timings, wait)
+                    for x in range(jobs)]:
+                future.result()
+        elapsed = time.perf_counter() - start
+    finally:
+        server.terminate()
+        server.join()
+
+    report = {
+        'jobs': jobs,
+        'concurrency': concurrency,
+        'elapsed': elapsed,
+        'jobs_per_sec': jobs / elapsed,
+    }
+    report.update({key: summarize(value) for key, value in timings.items()})
+    return report
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog='python -m repodono.jobs.bench', description=__doc__.strip())
+    parser.add_argument(
+        '--manager', choices=sorted(MANAGERS), action='append',
+        help='the synthetic managers to benchmark (default: all)')
+    parser.add_argument('--jobs', type=int, default=100)
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--max-concurrent', type=int, default=None)
+    parser.add_argument(
+        '--server', action='store_true',
+        help='benchmark through a sanic server rather than directly')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument(
+        '--spawn', choices=STRATEGIES, action='append',
+        help='benchmark the spawn latency of the strategies instead')
+    parser.add_argument(
+        '--ballast', type=int, action='append',
+        help='the MiB of memory held while spawning (default: 0, 1024)')
+    parser.add_argument(
+        '--spawn-limits', action='store_true',
+        help='apply resource limits to the spawned subprocesses')
+    parser.add_argument(
+        '--output', default=None,
+        help='write the JSON results to this file instead of stdout')
+    args = parser.parse_args(argv)
+
+    results = {
+        'python': sys.version.split()[0],
+        'platform': sys.platform,
+        'benchmarks': {},
+    }
+    manager_kw = {'max_concurrent': args.max_concurrent}
+    ballast = [size << 20 for size in (args.ballast or (0, 1024))]
+    limits = ResourceLimits(open_files=1024) if args.spawn_limits else None
+    for strategy in args.spawn or ():
+        results.setdefault('spawn', {})[strategy] = bench_spawn(
+            strategy, ballast=ballast, jobs=args.jobs, limits=limits)
+    for name in () if args.spawn else args.manager or sorted(MANAGERS):
+        if args.server:
+            results['benchmarks'][name] = bench_server(
+                name, jobs=args.jobs, concurrency=args.concurrency,
+                port=args.port, manager_kw=manager_kw)
+            continue
+        manager = MANAGERS[name](**manager_kw)
+        manager.start()
+        try:
+            results['benchmarks'][name] = bench_manager(
+                manager, jobs=args.jobs)
+        finally:
+            manager.stop()
+
+    output = json.dumps(results, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, 'w') as fd:
+            fd.write(output + '\n')
+    else:
+        print(output)
+    return results
+
+
+if __name__ == '__main__':  # pragma: no cover
+    main()
@@ -3,6 +3,7 @@
 var default_kwargs = {
     'base_url': '/',
     'poll_timeout': 100,
+    'poll_wait': 0,
     'route_execute': 'execute',
     'route_poll': 'poll',
 };
@@ -75,8 +76,14 @@ Client.prototype.poll = function(poll_url) {
 
     var self = this;
 
+    var request_url = poll_url;
+    if (self.poll_wait) {
+        // make use of the long-poll on the server.
+        request_url += '?wait=' + self.poll_wait;
+    }
+
     var before = function(xhr) {
-        xhr.open('GET', poll_url, true);
+        xhr.open('GET', request_url, true);
     };
 
     var after = function(obj) {
@@ -84,6 +91,10 @@ Client.prototype.poll = function(poll_url) {
             self.set_status_msg('error', obj.error);
             return false;
         }
+        else if (obj.status == 'queued') {
+            _poll();
+            self.set_status_msg('status', 'job queued');
+        }
         else if (obj.status == 'running') {
             _poll();
             self.set_status_msg('status', 'job running');
@@ -0,0 +1,101 @@
+# -*- coding: utf-8 -*-
+"""
+Content encodings for the results
+"""
+
+import gzip
+import os
+
+from collections import OrderedDict
+from os.path import basename
+from os.path import dirname
+from shutil import copyfileobj
+from tempfile import mkstemp
+
+try:
+    import brotli
+except ImportError:  # pragma: no cover
+    brotli = None
+
+try:
+    import zstandard
+except ImportError:  # pragma: no cover
+    zstandard = None
+
+CHUNK_SIZE = 65536
+
+
+def _gzip(src, dst):
+    # mtime is fixed such that the output is reproducible.
+    with gzip.GzipFile(fileobj=dst, mode='wb', mtime=0) as fd:
+        copyfileobj(src, fd, CHUNK_SIZE)
+
+
+def _brotli(src, dst):
+    compressor = brotli.Compressor()
+    for chunk in iter(lambda: src.read(CHUNK_SIZE), b''):
+        dst.write(compressor.process(chunk))
+    dst.write(compressor.finish())
+
+
+def _zstd(src, dst):
+    zstandard.ZstdCompressor().copy_stream(src, dst)
+
+
+# the content encodings available to the suffix of the compressed file
+# and the function to compress with, in the order of preference.
+ENCODERS = OrderedDict()
+if brotli is not None:
+    ENCODERS['br'] = ('.br', _brotli)
+if zstandard is not None:
+    ENCODERS['zstd'] = ('.zst', _zstd)
+ENCODERS['gzip'] = ('.gz', _gzip)
+
+
+def negotiate(accept_encoding, encodings=None):
+    """
+    Return the encoding out of encodings (default is all available)
+    that is most acceptable according to the Accept-Encoding header,
+    or None if none of them are acceptable.
+    """
+
+    encodings = list(ENCODERS) if encodings is None else encodings
+    accepted = {}
+    for item in (accept_encoding or '').split(','):
+        name, _, params = item.partition(';')
+        name = name.strip().lower()
+        if not name:
+            continue
+        quality = 1.0
+        key, _, value = params.partition('=')
+        if key.strip() == 'q':
+            try:
+                quality = float(value)
+            except ValueError:
+                quality = 0.0
+        accepted[name] = quality
+
+    best, best_quality = None, 0.0
+    for encoding in encodings:
+        quality = accepted.get(encoding, accepted.get('*', 0.0))
+        if quality > best_quality:
+            best, best_quality = encoding, quality
+    return best
+
+
+def compress_file(source, target, encoding):
+    """
+    Write the source file compressed with the encoding to target.  The
+    target is replaced atomically, such that concurrent readers never
+    observe a partial file.
+    """
+
+    suffix, compress = ENCODERS[encoding]
+    fd, tmp = mkstemp(prefix='.' + basename(target), dir=dirname(target))
+    try:
+        with open(source, 'rb') as src, os.fdopen(fd, 'wb') as dst:
+            compress(src, dst)
+        os.replace(tmp, target)
+    except BaseException:
+        os.unlink(tmp)
+        raise
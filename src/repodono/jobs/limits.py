@@ -0,0 +1,231 @@
+# -*- coding: utf-8 -*-
+"""
+Resource limits for the job subprocesses
+"""
+
+import heapq
+import logging
+import os
+import signal
+
+from itertools import count
+from os.path import exists
+from os.path import join
+from threading import Condition
+from threading import Thread
+from time import time
+
+try:
+    import resource
+except ImportError:  # pragma: no cover
+    resource = None
+
+logger = logging.getLogger(__name__)
+
+# the negated signals that the kernel sends on exceeding the limits.
+LIMIT_SIGNALS = frozenset(
+    -getattr(signal, name) for name in ('SIGXCPU', 'SIGXFSZ', 'SIGKILL')
+    if hasattr(signal, name)
+)
+
+
+def apply_limits(rlimits, cgroup=None):
+    """
+    Apply the list of (resource, (soft, hard)) and join the cgroup, for
+    the current process.  This is done in the subprocess before exec.
+    """
+
+    if cgroup is not None:
+        with open(join(cgroup, 'cgroup.procs'), 'w') as fd:
+            fd.write('0')
+    for rlimit, value in rlimits:
+        resource.setrlimit(rlimit, value)
+
+
+def cgroup_available(path):
+    """
+    Return whether path is a cgroup v2 directory that may be managed.
+    """
+
+    return (
+        path is not None
+        and exists(join(path, 'cgroup.subtree_control'))
+        and os.access(path, os.W_OK)
+    )
+
+
+class ResourceLimits(object):
+    """
+    The limits imposed on the subprocess of a job.
+
+    cpu_time
+        seconds of CPU time, after which the subprocess is sent SIGXCPU
+        and then SIGKILL a second later (RLIMIT_CPU).
+    address_space
+        bytes of virtual memory (RLIMIT_AS).
+    open_files
+        number of open file descriptors (RLIMIT_NOFILE).
+    output_size
+        bytes for the working directory; every file written is also
+        limited to this size (RLIMIT_FSIZE).  The total is checked every
+        check_interval seconds and the job is killed once exceeded.
+    timeout
+        seconds of wall-clock time the job may run for.
+    kill_timeout
+        seconds between SIGTERM and SIGKILL when the job is killed for
+        exceeding the timeout or the output_size.
+    cgroup
+        a cgroup v2 directory delegated to this process; if available,
+        a cgroup is created under it for each job with the memory
+        (memory.max) and pids (pids.max) limits.
+    """
+
+    def __init__(
+            self, cpu_time=None, address_space=None, open_files=None,
+            output_size=None, timeout=None, kill_timeout=1.0,
+            check_interval=1.0, cgroup=None, memory=None, pids=None):
+        self.cpu_time = cpu_time
+        self.address_space = address_space
+        self.open_files = open_files
+        self.output_size = output_size
+        self.timeout = timeout
+        self.kill_timeout = kill_timeout
+        self.check_interval = check_interval
+        self.cgroup = cgroup
+        self.memory = memory
+        self.pids = pids
+
+    def replace(self, **kw):
+        """
+        Return a copy with the given limits replaced, e.g. for a job
+        with its own limits.
+        """
+
+        limits = ResourceLimits.__new__(type(self))
+        limits.__dict__.update(self.__dict__)
+        for key, value in kw.items():
+            if key not in self.__dict__:
+                raise TypeError('unknown limit %r' % key)
+            setattr(limits, key, value)
+        return limits
+
+    def rlimits(self):
+        """
+        Return the list of (resource, (soft, hard)) to be applied.
+        """
+
+        if resource is None:
+            return []
+        result = []
+        if self.cpu_time is not None:
+            cpu_time = int(self.cpu_time)
+            result.append((resource.RLIMIT_CPU, (cpu_time, cpu_time + 1)))
+        for rlimit, value in (
+                (resource.RLIMIT_AS, self.address_space),
+                (resource.RLIMIT_NOFILE, self.open_files),
+                (resource.RLIMIT_FSIZE, self.output_size)):
+            if value is not None:
+                result.append((rlimit, (int(value), int(value))))
+        return result
+
+    def create_cgroup(self, name):
+        """
+        Create the cgroup for a job under the configured cgroup, return
+        its path, or None if cgroups are unavailable or not needed.
+        """
+
+        if not (self.memory or self.pids) or self.cgroup is None:
+            return None
+        if not cgroup_available(self.cgroup):
+            logger.warning(
+                'cgroup %s is unavailable; memory and pids limits will '
+                'not be applied', self.cgroup)
+            return None
+        path = join(self.cgroup, name)
+        try:
+            os.mkdir(path)
+            if self.memory is not None:
+                with open(join(path, 'memory.max'), 'w') as fd:
+                    fd.write('%d' % self.memory)
+            if self.pids is not None:
+                with open(join(path, 'pids.max'), 'w') as fd:
+                    fd.write('%d' % self.pids)
+        except OSError:
+            logger.exception('failed to create cgroup %s', path)
+            self.remove_cgroup(path)
+            return None
+        return path
+
+    def remove_cgroup(self, path):
+        try:
+            os.rmdir(path)
+        except OSError:
+            pass
+
+    def preexec(self, cgroup=None):
+        """
+        Return the preexec_fn to apply the limits, or None if there are
+        none to apply.
+        """
+
+        rlimits = self.rlimits()
+        if not rlimits and cgroup is None:
+            return None
+        return lambda: apply_limits(rlimits, cgroup)
+
+
+class Watchdog(object):
+    """
+    Invoke the callbacks at their scheduled times, from a background
+    thread that is started on demand.
+    """
+
+    def __init__(self):
+        self.condition = Condition()
+        self.thread = None
+        self.timers = []
+        self._sequence = count()
+        self._closing = False
+
+    def call_later(self, delay, callback):
+        with self.condition:
+            heapq.heappush(
+                self.timers, (time() + delay, next(self._sequence), callback))
+            if self.thread is None:
+                self.thread = Thread(target=self._run, name='Watchdog')
+                self.thread.daemon = True
+                self.thread.start()
+            self.condition.notify()
+
+    def _run(self):
+        while True:
+            with self.condition:
+                while not self._closing:
+                    now = time()
+                    if self.timers and self.timers[0][0] <= now:
+                        break
+                    self.condition.wait(
+                        self.timers[0][0] - now if self.timers else None)
+                if self._closing:
+                    return
+                when, sequence, callback = heapq.heappop(self.timers)
+            try:
+                callback()
+            except Exception:
+                logger.exception('error in watchdog callback')
+
+    def close(self):
+        """
+        Stop the thread; the pending callbacks are discarded.
+        """
+
+        with self.condition:
+            thread = self.thread
+            if thread is None:
+                return
+            self._closing = True
+            self.condition.notify()
+        thread.join()
+        self.thread = None
+        self.timers = []
+        self._closing = False
@@ -3,33 +3,109 @@
 Manager test case
 """
 
+import heapq
+import json
 import logging
+import mmap
+import signal
 
+from collections import OrderedDict
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from fnmatch import fnmatchcase
+from functools import partial
+from hashlib import sha256
+from itertools import count
+from os.path import dirname
 from os.path import isfile
 from os.path import join
-from os.path import normpath
+from os.path import realpath
+from os.path import relpath
+from shutil import rmtree
+from stat import S_IMODE
+from stat import S_ISREG
+from os import O_DIRECTORY
+from os import O_NOFOLLOW
+from os import O_RDONLY
+from os import chmod
+from os import close
+from os import fstat
+from os import killpg
+from os import link
+from os import lstat
+from os import stat
+from os import sep
+from os import symlink
+from os import walk
 from os import listdir
+from os import makedirs
+from os import open as os_open
+from os.path import abspath
+from os.path import basename
+from subprocess import PIPE
 from subprocess import Popen
+from sys import platform
+from threading import RLock
+from time import time
 
 from tempfile import TemporaryDirectory
 from tempfile import mkdtemp
+from .compress import ENCODERS
+from .compress import compress_file
 from .exc import ManagerRuntimeError
+from .limits import LIMIT_SIGNALS
+from .limits import Watchdog
+from .output import OutputCollector
+from .spawn import POPEN
+from .spawn import POSIX_SPAWN
+from .spawn import HELPER
+from .spawn import Spawner
+from .spawn import posix_spawn
+from .spawn import unsupported
+from .output import RingLog
+from .retention import GarbageCollector
+from .retention import disk_usage
+from .watcher import ChildWatcher
 
 logger = logging.getLogger(__name__)
 
+# the states a job may be in, as reported by JobManager.poll
+QUEUED = 'queued'
+RUNNING = 'running'
+SUCCESS = 'success'
+FAILURE = 'failure'
+KILLED = 'killed'
+TIMEOUT = 'timeout'
+CANCELLED = 'cancelled'
+EVICTED = 'evicted'
+
+# the states of the finished jobs that have failed.
+FAILED = (FAILURE, KILLED, TIMEOUT, CANCELLED)
+
+# ru_maxrss is reported in bytes on macOS, kilobytes elsewhere.
+MAXRSS_SCALE = 1 if platform == 'darwin' else 1024
+
 
 class WDManager(object):
     """
     Simple manager class for creation and management of working
     directories.
+
+    The working directories are created under a temporary directory
+    that is removed on stop, unless a persistent root is provided.
     """
 
-    def __init__(self):
+    def __init__(self, root=None):
         # simply create the object for now
         self.root = NotImplemented
+        self.persistent_root = root
         self.tempdir = None
 
     def start(self):
+        if self.persistent_root:
+            self.root = abspath(self.persistent_root)
+            makedirs(self.root, exist_ok=True)
+            return
         tempdir = self.tempdir = TemporaryDirectory()
         self.root = tempdir.name
 
@@ -37,6 +113,7 @@ class WDManager(object):
         self.root = NotImplemented
         if self.tempdir:
             self.tempdir.cleanup()
+            self.tempdir = None
 
     def create_working_dir(self):
         return mkdtemp(dir=self.root)
@@ -61,18 +138,938 @@ class WDManager(object):
         return working_dir
 
 
+class JobStatus(object):
+    """
+    The status of a job tracked by a JobManager, with the timestamps of
+    its transitions.  There is one for every job that is tracked, so
+    the attributes are slotted.
+    """
+
+    __slots__ = (
+        'state', 'returncode', 'submitted', 'started', 'finished', 'pid',
+        'accessed', 'ttl', 'size', 'job_type', 'violation', 'cancelled',
+        'upstream', 'blocked_by', 'utime', 'stime', 'maxrss',
+    )
+
+    def __init__(self, submitted=None):
+        self.state = QUEUED
+        self.returncode = None
+        self.submitted = time() if submitted is None else submitted
+        self.started = None
+        self.finished = None
+        self.pid = None
+        self.accessed = self.submitted
+        # the per-job ttl and the measured size of the working_dir.
+        self.ttl = None
+        self.size = None
+        # the type of job for the accounting, and the resource usage of
+        # the subprocess as reported on termination, where available.
+        self.job_type = None
+        # the limit the job was found in violation of, if any, and
+        # whether it was cancelled.
+        self.violation = None
+        self.cancelled = False
+        # the working_dirs of the upstream jobs this job depends on, and
+        # the one that did not succeed such that this job never ran.
+        self.upstream = ()
+        self.blocked_by = None
+        self.utime = None
+        self.stime = None
+        self.maxrss = None
+
+    @property
+    def queue_time(self):
+        if self.started is None:
+            return None
+        return self.started - self.submitted
+
+    @property
+    def wall_time(self):
+        if self.started is None or self.finished is None:
+            return None
+        return self.finished - self.started
+
+    def account(self, rusage):
+        """
+        Record the resource usage (as returned by os.wait4).
+        """
+
+        self.utime = rusage.ru_utime
+        self.stime = rusage.ru_stime
+        self.maxrss = rusage.ru_maxrss * MAXRSS_SCALE
+
+
+# an entry of the index of the results of a finished job.
+ResultEntry = namedtuple('ResultEntry', ['path', 'size', 'mtime_ns', 'inode'])
+
+
 class JobManager(WDManager):
+    """
+    Manager that execute jobs as subprocesses, each in its own working
+    directory and session, with the jobs beyond max_concurrent queued
+    by their priority (see get_priority).  The JobStatus of the jobs is
+    tracked in the status table, and the subscribed callbacks are
+    invoked with the working_dir and the JobStatus as the jobs
+    transition; note that they may be invoked from other threads.
+    """
+
+    # results at least this size are memory mapped by get_result_view
+    mmap_threshold = 1 << 20
+    # the version tag for the memoized results; implementations should
+    # change this whenever their results for the same kwargs change.
+    cache_version = ''
+    # seconds between SIGTERM and SIGKILL for cancelled jobs.
+    cancel_timeout = 1.0
+    # the directories under the working_dir for the compressed copies
+    # of the results, the captured output, the results linked from the
+    # upstream jobs and the uploaded inputs; these are never listed as
+    # results.
+    compressed_dir = '.compressed'
+    logs_dir = '.logs'
+    upstream_dir = '.upstream'
+    inputs_dir = '.inputs'
+    # the names of the captured outputs of the jobs.
+    log_names = ('stdout', 'stderr')
+    # results smaller than this are not worth compressing.
+    compress_threshold = 1024
+    # the content encodings the results of the finished jobs are
+    # compressed with in the background, rather than on demand.
+    precompress = ()
+    # whether the indexed results are opened relative to a descriptor
+    # of the working_dir held open, rather than by their paths; this
+    # costs a descriptor for every indexed job.
+    use_dir_fd = False
 
-    def __init__(self):
-        super(JobManager, self).__init__()
+    def __init__(
+            self, max_concurrent=None, retention=None, memoize=False,
+            root=None, limits=None, capture_output=True,
+            log_size=1 << 20, spawn_strategy=POPEN):
+        super(JobManager, self).__init__(root=root)
+        reason = unsupported(spawn_strategy)
+        if reason is not None:
+            raise ValueError(reason)
+        # how the subprocesses are created: POPEN forks this process,
+        # POSIX_SPAWN never copies it but falls back to Popen for the
+        # jobs with limits, and HELPER has them created by a Spawner
+        # process started along with the manager; see repodono.jobs.spawn.
+        self.spawn_strategy = spawn_strategy
+        self.spawner = Spawner() if spawn_strategy == HELPER else None
+        # the most subprocesses running at once, or None for no limit.
+        self.max_concurrent = max_concurrent
+        # the RetentionPolicy the finished jobs are evicted by from a
+        # GarbageCollector, with the evicted state notified.
+        self.retention = retention
+        # the default ResourceLimits of the jobs (see get_limits); a job
+        # exceeding them finishes as killed, or timeout for its timeout.
+        self.limits = limits
+        # working_dir to the ResourceLimits and the cgroup of the jobs
+        # that are running with them.
+        self.job_limits = {}
+        self.cgroups = {}
+        self.watchdog = Watchdog()
+        self.compressor = None
+        # the futures of the pending precompressions.
+        self.compressing = set()
+        # evicts the discarded jobs, such that removing their working
+        # directories never holds up the watchdog.
+        self.evictor = None
+        # whether the stdout and stderr of the jobs are captured, each
+        # into a log keeping the most recent log_size bytes; see read_log.
+        self.capture_output = capture_output
+        self.log_size = log_size
+        self.output_collector = OutputCollector()
+        # whether a job submitted through run with the cache key of a
+        # tracked job that has not failed reuses it; see get_cache_key.
+        self.memoize = memoize
+        self.collector = None
+        # cache key to working_dir, and the reverse.
+        self.memo = {}
+        self.memo_keys = {}
+        # working_dir to the process of the jobs that are running, and to
+        # the JobStatus of all the jobs tracked.
         self.mapping = {}
+        self.status = {}
+        self.listings = {}
+        # working_dir to the index of its results, key to ResultEntry,
+        # and the descriptors of the working_dir for use_dir_fd.
+        self.indexes = {}
+        self.dir_fds = {}
+        self.callbacks = []
+        # working_dir to kwargs for all jobs that are still queued, with
+        # the heap of (priority, sequence, working_dir) for ordering.
+        self.queued = {}
+        self.pending = []
+        self.running = set()
+        # working_dir to (kwargs, set of upstream working_dirs) for the
+        # jobs waiting on their upstream jobs, and the reverse mapping.
+        self.waiting = {}
+        self.downstream = {}
+        self.lock = RLock()
+        self.watcher = ChildWatcher()
+        self._sequence = count()
+
+    @property
+    def reserved(self):
+        return (
+            self.compressed_dir, self.logs_dir, self.upstream_dir,
+            self.inputs_dir)
 
     def get_args(self, working_dir, **kw):
         raise NotImplementedError
 
+    def get_priority(self, **kw):
+        """
+        Return the priority for a job with the given kwargs.  Jobs with
+        a lower value will be started first; default is 0 for all jobs,
+        which results in FIFO ordering.
+        """
+
+        return 0
+
+    def get_ttl(self, **kw):
+        """
+        Return the ttl in seconds for the finished job with the given
+        kwargs; default is None, which defers to the retention policy.
+        """
+
+        return None
+
+    def get_limits(self, **kw):
+        """
+        Return the ResourceLimits for the job with the given kwargs;
+        default is the limits of this manager.
+        """
+
+        return self.limits
+
+    def get_job_type(self, **kw):
+        """
+        Return the type of the job with the given kwargs, under which
+        its resource usage will be accounted for; default is None.
+        """
+
+        return None
+
+    def get_cache_key(self, **kw):
+        """
+        Return the key for memoizing the job with the given kwargs; the
+        default is the hash of the canonical JSON form of the kwargs
+        along with the cache_version.
+        """
+
+        canonical = json.dumps(
+            [self.cache_version, kw], sort_keys=True,
+            separators=(',', ':'), default=repr)
+        return sha256(canonical.encode('utf8')).hexdigest()
+
+    def find_memoized(self, key):
+        """
+        Return the working_dir of the job memoized under key, if it is
+        still tracked and has not failed.
+        """
+
+        with self.lock:
+            working_dir = self.memo.get(key)
+            if working_dir is None:
+                return None
+            status = self.status.get(working_dir)
+            if status is None or status.state in FAILED:
+                self.forget_memoized(working_dir)
+                return None
+            return working_dir
+
+    def remember(self, key, working_dir):
+        with self.lock:
+            self.forget_memoized(self.memo.get(key))
+            self.memo[key] = working_dir
+            self.memo_keys[working_dir] = key
+
+    def forget_memoized(self, working_dir):
+        key = self.memo_keys.pop(working_dir, None)
+        if key is not None:
+            self.memo.pop(key, None)
+
+    def run(self, **kw):
+        if not self.memoize:
+            return super(JobManager, self).run(**kw)
+        if self.root is NotImplemented:
+            raise ManagerRuntimeError('manager not started')
+
+        key = self.get_cache_key(**kw)
+        with self.lock:
+            working_dir = self.find_memoized(key)
+            if working_dir is not None:
+                return working_dir
+            working_dir = self.create_working_dir()
+            self.remember(key, working_dir)
+        self.execute(working_dir=working_dir, **kw)
+        return working_dir
+
+    def enqueue_batch(self, batch):
+        """
+        Create and enqueue the jobs for each of the kwargs in batch,
+        without starting any of them, and return their working_dirs.
+        """
+
+        if self.root is NotImplemented:
+            raise ManagerRuntimeError('manager not started')
+        working_dirs = []
+        with self.lock:
+            for kw in batch:
+                key = self.get_cache_key(**kw) if self.memoize else None
+                working_dir = None
+                if key is not None:
+                    working_dir = self.find_memoized(key)
+                if working_dir is None:
+                    working_dir = self.create_working_dir()
+                    if key is not None:
+                        self.remember(key, working_dir)
+                    self.enqueue(working_dir, **kw)
+                working_dirs.append(working_dir)
+        return working_dirs
+
+    def run_batch(self, batch):
+        """
+        Run the jobs for each of the kwargs in batch as a group, such
+        that all of them are queued before any of them is started.
+        Return the list of their working_dirs.
+        """
+
+        working_dirs = self.enqueue_batch(batch)
+        self.schedule()
+        return working_dirs
+
+    def run_after(self, upstream, **kw):
+        """
+        Run the job once all of the upstream jobs (their working_dirs)
+        have succeeded; return its working_dir.  The job is never
+        memoized, as its results depend on those of the upstream jobs.
+        Raises KeyError if any of the upstream jobs is not tracked.
+        """
+
+        if self.root is NotImplemented:
+            raise ManagerRuntimeError('manager not started')
+        working_dir = self.create_working_dir()
+        try:
+            self.execute_after(working_dir, upstream, **kw)
+        except KeyError:
+            rmtree(working_dir, ignore_errors=True)
+            raise
+        return working_dir
+
+    def execute_after(self, working_dir, upstream, **kw):
+        """
+        Execute the job in the working_dir once all of the upstream jobs
+        have succeeded, as run_after does.
+        """
+
+        self.enqueue_after(working_dir, upstream, **kw)
+        self.schedule()
+
+    def enqueue_after(self, working_dir, upstream, **kw):
+        """
+        Enqueue the job such that it is only queued to be started once
+        all of the upstream jobs have succeeded.  The results of each of
+        them are linked as they succeed under the upstream_dir of the
+        working_dir as <n>/<key>, where n is the position of the job in
+        upstream; hard links are used where possible, such that they
+        remain available once the upstream job is evicted, with the
+        write permissions removed.  Should any of the upstream jobs not
+        succeed, the job fails without being started, with the blocked_by
+        of its status being that upstream job.
+        """
+
+        finished = self._enqueue_waiting(working_dir, upstream, kw)
+        self._release(working_dir, self._link_finished(working_dir, finished))
+
+    def _enqueue_waiting(self, working_dir, upstream, kw):
+        # enqueue the job as waiting on its upstream jobs, return the
+        # (working_dir, state) of those that have already finished.
+        # distinct, in their order (plain dicts are only ordered from
+        # Python 3.6 on).
+        upstream = tuple(OrderedDict.fromkeys(upstream))
+        with self.lock:
+            states = [self.status[wd].state for wd in upstream]
+            self.enqueue(working_dir, **kw)
+            self.status[working_dir].upstream = upstream
+            # the job itself is held as pending until the results of the
+            # upstream jobs that have already succeeded are linked.
+            pending = {working_dir}
+            for wd, state in zip(upstream, states):
+                if state in (QUEUED, RUNNING):
+                    pending.add(wd)
+                    self.downstream.setdefault(wd, set()).add(working_dir)
+            self.waiting[working_dir] = (
+                self.queued.pop(working_dir), pending)
+        return [
+            (wd, state) for wd, state in zip(upstream, states)
+            if state not in (QUEUED, RUNNING)
+        ]
+
+    def _link_finished(self, working_dir, finished):
+        # link the results of the finished upstream jobs, return the one
+        # blocking the job or None.
+        for wd, state in finished:
+            if state != SUCCESS or not self._link_upstream(working_dir, wd):
+                return wd
+        return None
+
+    def _release(self, working_dir, blocked):
+        if blocked is None:
+            self._satisfy(working_dir, working_dir)
+        else:
+            self._block(working_dir, blocked)
+
+    def link_results(self, working_dir, upstream):
+        """
+        Link the results of the succeeded upstream job into the
+        working_dir.  Raises KeyError if it is no longer tracked.
+        """
+
+        index = self.get_index(upstream)
+        if index is None:
+            raise KeyError('no such finished upstream job')
+        root = join(
+            working_dir, self.upstream_dir,
+            str(self.status[working_dir].upstream.index(upstream)))
+        for key, entry in index.items():
+            target = join(root, key)
+            makedirs(dirname(target), exist_ok=True)
+            try:
+                chmod(entry.path, S_IMODE(lstat(entry.path).st_mode) & ~0o222)
+                link(entry.path, target)
+            except OSError:
+                # e.g. the root spans multiple filesystems.
+                symlink(entry.path, target)
+
+    def _link_upstream(self, working_dir, upstream):
+        try:
+            self.link_results(working_dir, upstream)
+        except (KeyError, OSError):
+            logger.warning(
+                'failed to link the results of %s into %s',
+                upstream, working_dir, exc_info=True)
+            return False
+        return True
+
+    def _satisfy(self, working_dir, upstream):
+        # the upstream of the waiting job is satisfied; queue the job
+        # once all of them are.
+        with self.lock:
+            entry = self.waiting.get(working_dir)
+            if entry is None:
+                return
+            kw, pending = entry
+            pending.discard(upstream)
+            if pending:
+                return
+            del self.waiting[working_dir]
+            self._push(working_dir, kw)
+
+    def _block(self, working_dir, upstream):
+        # the upstream of the waiting job did not succeed, so it fails.
+        with self.lock:
+            if self.waiting.pop(working_dir, None) is None:
+                return
+            self.status[working_dir].blocked_by = upstream
+        logger.info(
+            'job at %s is blocked by the failed job at %s',
+            working_dir, upstream)
+        self.finish(working_dir, None)
+
+    def _link_downstream(self, working_dir, status, downstream):
+        # link the results of the finished job into the jobs downstream
+        # still waiting on it, return those that were linked.
+        if status.state != SUCCESS:
+            return set()
+        return {
+            wd for wd in sorted(downstream)
+            if wd in self.waiting and self._link_upstream(wd, working_dir)
+        }
+
+    def _resolve(self, working_dir, downstream, linked):
+        # release or block the jobs downstream of the finished job.
+        for wd in sorted(downstream):
+            if wd not in self.waiting:
+                continue
+            if wd in linked:
+                self._satisfy(wd, working_dir)
+            else:
+                self._block(wd, working_dir)
+
+    def subscribe(self, callback):
+        """
+        Register a callback to be invoked with the working_dir and the
+        JobStatus whenever a job is started or finished.
+        """
+
+        self.callbacks.append(callback)
+
+    def unsubscribe(self, callback):
+        self.callbacks.remove(callback)
+
+    def enqueue(self, working_dir, **kw):
+        with self.lock:
+            status = self.status[working_dir] = JobStatus()
+            status.ttl = self.get_ttl(**kw)
+            status.job_type = self.get_job_type(**kw)
+            self._push(working_dir, kw)
+
+    def _push(self, working_dir, kw):
+        self.queued[working_dir] = kw
+        heapq.heappush(self.pending, (
+            self.get_priority(**kw), next(self._sequence), working_dir))
+
+    def dequeue(self):
+        """
+        Return the next (working_dir, kw) to be started if there is a
+        free slot, otherwise None.  The slot is claimed for the job.
+        """
+
+        with self.lock:
+            while self.pending and self.has_capacity():
+                priority, sequence, working_dir = heapq.heappop(
+                    self.pending)
+                kw = self.queued.pop(working_dir, None)
+                if kw is None:
+                    # no longer queued.
+                    continue
+                self.running.add(working_dir)
+                status = self.status[working_dir]
+                status.state = RUNNING
+                status.started = time()
+                return working_dir, kw
+        return None
+
+    def finish(self, working_dir, returncode, rusage=None):
+        """
+        Record the returncode and the resource usage of the job, along
+        with the size of its output, and notify the subscribers.
+        """
+
+        index, size = self._measure(working_dir)
+        status, downstream = self._record(
+            working_dir, returncode, rusage, index, size)
+        if downstream:
+            self._resolve(working_dir, downstream, self._link_downstream(
+                working_dir, status, downstream))
+        self._finished(working_dir, status)
+
+    def _measure(self, working_dir):
+        # the index of the results and the size of the finished job.
+        return self.scan_results(working_dir), self.job_size(working_dir)
+
+    def _record(self, working_dir, returncode, rusage, index, size):
+        # record the outcome of the job with the index of its results
+        # and notify it, return its status and the jobs downstream.
+        with self.lock:
+            self.running.discard(working_dir)
+            # the process is of no further use once it has finished.
+            self.mapping.pop(working_dir, None)
+            limits = self.job_limits.pop(working_dir, None)
+            cgroup = self.cgroups.pop(working_dir, None)
+            status = self.status[working_dir]
+            status.returncode = returncode
+            status.finished = time()
+            status.size = size
+            self.indexes[working_dir] = index
+            if rusage is not None:
+                status.account(rusage)
+            if status.cancelled:
+                status.state = CANCELLED
+            elif status.violation is not None:
+                status.state = status.violation
+            elif returncode == 0:
+                status.state = SUCCESS
+            elif limits is not None and returncode in LIMIT_SIGNALS:
+                status.state = KILLED
+            else:
+                status.state = FAILURE
+            downstream = self.downstream.pop(working_dir, ())
+        if cgroup is not None:
+            limits.remove_cgroup(cgroup)
+        self.notify(working_dir, status)
+        return status, downstream
+
+    def _finished(self, working_dir, status):
+        if status.state == CANCELLED:
+            self.discard(working_dir)
+        elif self.precompress:
+            if self.compressor is None:
+                self.compressor = ThreadPoolExecutor(1)
+            future = self.compressor.submit(self._precompress, working_dir)
+            self.compressing.add(future)
+            future.add_done_callback(self.compressing.discard)
+
+    def notify(self, working_dir, status):
+        for callback in list(self.callbacks):
+            try:
+                callback(working_dir, status)
+            except Exception:
+                logger.exception('error in completion callback')
+
     def execute(self, working_dir, **kw):
+        self.enqueue(working_dir, **kw)
+        self.schedule()
+
+    def spawn(self, working_dir, **kw):
+        """
+        Actually start the subprocess for the working_dir.
+        """
+
         args = self.get_args(working_dir=working_dir, **kw)
-        self.mapping[working_dir] = Popen(args)
+        limits = self.prepare_limits(working_dir, **kw)
+        process = self.mapping[working_dir] = self.create_process(
+            args, working_dir)
+        status = self.status[working_dir]
+        status.pid = process.pid
+        for name in self.log_names:
+            pipe = getattr(process, name, None)
+            if pipe is not None and self.capture_output:
+                self.output_collector.add(
+                    pipe, self.create_log(working_dir, name))
+        self.watcher.add(process, partial(self._watched, working_dir))
+        if status.cancelled:
+            # cancelled while it was being spawned.
+            self.kill_process(working_dir, process, self.cancel_timeout)
+        elif limits is not None:
+            self.enforce(working_dir, process, limits)
+
+    def prepare_limits(self, working_dir, **kw):
+        """
+        Look up the limits for the job about to be spawned, and create
+        its cgroup if one is needed.
+        """
+
+        limits = self.get_limits(**kw)
+        if limits is not None:
+            self.job_limits[working_dir] = limits
+            cgroup = limits.create_cgroup(basename(working_dir))
+            if cgroup is not None:
+                self.cgroups[working_dir] = cgroup
+        return limits
+
+    def get_preexec(self, working_dir):
+        """
+        Return the preexec_fn that applies the limits for the job.
+        """
+
+        limits = self.job_limits.get(working_dir)
+        if limits is None:
+            return None
+        return limits.preexec(self.cgroups.get(working_dir))
+
+    def create_process(self, args, working_dir):
+        """
+        Create the subprocess for the args; must return a Popen
+        compatible object.
+        """
+
+        preexec = self.get_preexec(working_dir)
+        if self.spawn_strategy == POSIX_SPAWN and preexec is None:
+            return posix_spawn(args, capture=self.capture_output)
+        if self.spawn_strategy == HELPER:
+            limits = self.job_limits.get(working_dir)
+            return self.spawner.spawn(
+                args, rlimits=limits.rlimits() if limits else (),
+                cgroup=self.cgroups.get(working_dir),
+                capture=self.capture_output)
+        output = PIPE if self.capture_output else None
+        return Popen(
+            args, preexec_fn=preexec, start_new_session=True,
+            stdout=output, stderr=output)
+
+    def log_path(self, working_dir, name):
+        return join(working_dir, self.logs_dir, name + '.log')
+
+    def create_log(self, working_dir, name):
+        """
+        Create the RingLog for the named output of the job.
+        """
+
+        makedirs(join(working_dir, self.logs_dir), exist_ok=True)
+        return RingLog(self.log_path(working_dir, name), self.log_size)
+
+    def read_log(self, working_dir, name, offset=0, limit=65536):
+        """
+        Read the captured output (stdout or stderr) of the job from the
+        offset, see RingLog.read.  Raises KeyError if there is no such
+        job or output.
+        """
+
+        if name not in self.log_names or (
+                working_dir not in self.status):
+            raise KeyError('no such working_dir or log')
+        try:
+            return RingLog.read(
+                self.log_path(working_dir, name), offset, limit)
+        except FileNotFoundError:
+            raise KeyError('no such working_dir or log')
+
+    def call_later(self, delay, callback):
+        self.watchdog.call_later(delay, callback)
+
+    def enforce(self, working_dir, process, limits):
+        """
+        Schedule the checks for the limits that are not enforced by the
+        kernel, for the job that was just spawned.
+        """
+
+        if limits.timeout is not None:
+            self.call_later(limits.timeout, partial(
+                self.violate, working_dir, process, TIMEOUT, limits))
+        if limits.output_size is not None:
+            self.call_later(limits.check_interval, partial(
+                self._check_output, working_dir, process, limits))
+
+    def _alive(self, working_dir, process):
+        status = self.status.get(working_dir)
+        return (
+            self.mapping.get(working_dir) is process
+            and status is not None and status.state == RUNNING
+            and process.returncode is None
+        )
+
+    def _check_output(self, working_dir, process, limits):
+        if not self._alive(working_dir, process):
+            return
+        if self.job_size(working_dir) > limits.output_size:
+            self.violate(working_dir, process, KILLED, limits)
+        else:
+            self.call_later(limits.check_interval, partial(
+                self._check_output, working_dir, process, limits))
+
+    def violate(self, working_dir, process, violation, limits):
+        """
+        Kill the job for being in violation of its limits.
+        """
+
+        with self.lock:
+            if not self._alive(working_dir, process):
+                return
+            self.status[working_dir].violation = violation
+        logger.warning(
+            'killing subprocess %d for exceeding its limits (%s)',
+            process.pid, violation)
+        self.kill_process(working_dir, process, limits.kill_timeout)
+
+    def signal_process(self, process, sig):
+        """
+        Send the signal to the process group led by the process, or to
+        just the process if it does not lead one.
+        """
+
+        if process.returncode is not None:
+            return
+        try:
+            killpg(process.pid, sig)
+        except ProcessLookupError:
+            try:
+                process.send_signal(sig)
+            except ProcessLookupError:
+                pass
+
+    def kill_process(self, working_dir, process, timeout):
+        """
+        Terminate the process, escalating to kill after the timeout.
+        """
+
+        self.signal_process(process, signal.SIGTERM)
+        self.call_later(timeout, partial(
+            self.signal_process, process, signal.SIGKILL))
+
+    def _cancel(self, working_dir, timeout=None):
+        with self.lock:
+            status = self.status[working_dir]
+            if status.state not in (QUEUED, RUNNING):
+                finished = True
+            else:
+                finished = False
+                status.cancelled = True
+                queued = (
+                    self.queued.pop(working_dir, None) is not None
+                    or self.waiting.pop(working_dir, None) is not None)
+                # the slot is freed right away.
+                self.running.discard(working_dir)
+                process = self.mapping.get(working_dir)
+
+        if finished:
+            self.discard(working_dir)
+            return False
+        logger.info('cancelling job at %s', working_dir)
+        if queued:
+            self.finish(working_dir, None)
+        elif process is not None:
+            self.kill_process(working_dir, process, (
+                self.cancel_timeout if timeout is None else timeout))
+        return True
+
+    def cancel(self, working_dir):
+        """
+        Cancel the job at working_dir: its subprocesses are signalled
+        and its slot is given to the next queued job immediately, while
+        the subprocess is reaped and its working directory removed in
+        the background.  Return False if the job had already finished,
+        in which case it is simply removed.  Raises KeyError if no job
+        is associated with the working_dir.
+        """
+
+        cancelled = self._cancel(working_dir)
+        self.schedule()
+        return cancelled
+
+    def discard(self, working_dir):
+        """
+        Evict the finished job in the background.
+        """
+
+        with self.lock:
+            if self.evictor is None:
+                self.evictor = ThreadPoolExecutor(1)
+            self.evictor.submit(self.evict, working_dir)
+
+    def _watched(self, working_dir, returncode, rusage):
+        self.finish(working_dir, returncode, rusage)
+        self.schedule()
+
+    def has_capacity(self):
+        return (
+            self.max_concurrent is None
+            or len(self.running) < self.max_concurrent
+        )
+
+    def schedule(self):
+        """
+        Start queued jobs for as long as there are free slots.
+        """
+
+        while True:
+            job = self.dequeue()
+            if job is None:
+                break
+            working_dir, kw = job
+            self.notify(working_dir, self.status[working_dir])
+            try:
+                self.spawn(working_dir, **kw)
+            except Exception:
+                self.finish(working_dir, None)
+                raise
+
+    def poll(self, working_dir):
+        """
+        Return the state of the job associated with the working_dir.
+        Raises KeyError if no job is associated with it.
+        """
+
+        status = self.status[working_dir]
+        status.accessed = time()
+        return status.state
+
+    def restore(self, working_dir, status):
+        """
+        Restore the status of a finished job, e.g. one that was tracked
+        by a previous instance.
+        """
+
+        if status.state in (QUEUED, RUNNING):
+            raise ValueError('only finished jobs may be restored')
+        with self.lock:
+            self.status[working_dir] = status
+
+    def collect(self, now=None):
+        """
+        Evict the working directories of the finished jobs according to
+        the retention policy, and terminate the running jobs that have
+        exceeded the size allowed.  Return the evicted working_dirs.
+        """
+
+        policy = self.retention
+        if policy is None:
+            return []
+
+        now = time() if now is None else now
+        with self.lock:
+            jobs = list(self.status.items())
+
+        finished = []
+        total_size = 0
+        for working_dir, status in jobs:
+            if status.state == QUEUED:
+                continue
+            if status.state == RUNNING:
+                # size changes for as long as it is running.
+                size = self.job_size(working_dir)
+                process = self.mapping.get(working_dir)
+                oversized = (
+                    policy.max_job_size is not None
+                    and size > policy.max_job_size
+                )
+                if oversized and process is not None:
+                    logger.warning(
+                        'terminating subprocess %d for exceeding %d bytes'
+                        % (process.pid, policy.max_job_size))
+                    process.terminate()
+            else:
+                if status.size is None:
+                    status.size = self.job_size(working_dir)
+                size = status.size
+                finished.append((working_dir, status))
+            total_size += size
+
+        evicted = policy.select(finished, total_size, now)
+        for working_dir in evicted:
+            self.evict(working_dir)
+        return evicted
+
+    def evict(self, working_dir):
+        """
+        Remove the finished job and its working directory.
+        """
+
+        status = self._untrack(working_dir)
+        if status is None:
+            return False
+        rmtree(working_dir, ignore_errors=True)
+        status.state = EVICTED
+        self.notify(working_dir, status)
+        return True
+
+    def _untrack(self, working_dir):
+        # stop tracking the finished job ahead of its eviction, return
+        # its JobStatus or None if there is no such finished job.
+        with self.lock:
+            status = self.status.get(working_dir)
+            if status is None or status.state in (QUEUED, RUNNING):
+                return None
+            del self.status[working_dir]
+            self.mapping.pop(working_dir, None)
+            self.invalidate(working_dir)
+            self.forget_memoized(working_dir)
+        return status
+
+    def start(self):
+        super(JobManager, self).start()
+        if self.spawner is not None:
+            self.spawner.start()
+        if self.retention is not None and self.retention.interval:
+            self.collector = GarbageCollector(self, self.retention.interval)
+            self.collector.start()
+
+    def _stop_collector(self):
+        if self.collector is not None:
+            self.collector.stop()
+            self.collector = None
+        if self.compressor is not None:
+            # the pending ones are cancelled, as the cancel_futures
+            # argument of shutdown requires Python 3.9.
+            for future in list(self.compressing):
+                future.cancel()
+            self.compressor.shutdown()
+            self.compressor = None
+        if self.evictor is not None:
+            # the discarded jobs are still evicted.
+            self.evictor.shutdown()
+            self.evictor = None
 
     def _cleanup_subprocess(self, working_dir, subprocess):
         """
@@ -84,25 +1081,126 @@ class JobManager(WDManager):
         pass
 
     def stop(self):
-        for wd, p in self.mapping.items():
+        self._stop_collector()
+        with self.lock:
+            queued = len(self.queued) + len(self.waiting)
+            if queued:
+                logger.warning('discarding %d queued job(s)' % queued)
+            self.queued.clear()
+            self.pending.clear()
+            self.waiting.clear()
+            self.downstream.clear()
+        self.watchdog.close()
+        self.watcher.close()
+        for wd in list(self.dir_fds):
+            self.invalidate(wd)
+        with self.lock:
+            # the jobs still finishing (e.g. from the threads waiting on
+            # them without pidfd) remove themselves from the mapping.
+            processes = list(self.mapping.items())
+        for wd, p in processes:
             if p.poll() is None:
                 logger.warning('subprocess %d is still running' % p.pid)
                 self._cleanup_subprocess(wd, p)
+        if any(p.poll() is None for wd, p in processes):
+            # closing the pipes of the subprocesses left running would
+            # kill them on their next write, so their output is still
+            # collected until they exit.
+            self.output_collector.drain()
+        else:
+            self.output_collector.close()
+        if self.spawner is not None:
+            self.spawner.stop()
+        self.running.clear()
         super(JobManager, self).stop()
 
     def lookup_path(self, working_dir, key):
         """
         Look up the path associated with the given working_dir and key.
 
-        By default it is a simple normpath and verify that it is inside
-        working_dir, though some implementations may want to have a more
-        specific abstraction in place.
+        By default the key is looked up from the index of the results
+        for a finished job; otherwise the real path of the key must be
+        a file inside working_dir.  Some implementations may want to
+        have a more specific abstraction in place.
+        """
+
+        index = self.get_index(working_dir)
+        if index is not None:
+            entry = index.get(key)
+            return None if entry is None else entry.path
+
+        real_dir = realpath(working_dir)
+        target = realpath(join(real_dir, key))
+        # os.path.commonpath requires Python 3.5.
+        if not target.startswith(join(real_dir, '')) or not isfile(target):
+            return None
+        key = relpath(target, real_dir)
+        if key.split(sep)[0] in self.reserved:
+            return None
+        return join(working_dir, key)
+
+    def job_size(self, working_dir):
+        """
+        Return the size of the working directory of the job in bytes,
+        including the reserved directories (the uploaded inputs, the
+        captured output and the compressed copies); this is the size
+        the limits and the retention policy apply to.
+        """
+
+        return disk_usage(working_dir)
+
+    def scan_results(self, working_dir):
+        """
+        Return the index of all the regular files under the working_dir
+        excluding the reserved directories, as an ordered dict of the
+        relative paths as the keys to their ResultEntry.  Symbolic links
+        are never followed, so the files are always inside working_dir.
+        """
+
+        index = OrderedDict()
+        for root, dirs, files in walk(working_dir):
+            if root == working_dir:
+                dirs[:] = [d for d in dirs if d not in self.reserved]
+            dirs.sort()
+            for name in sorted(files):
+                path = join(root, name)
+                try:
+                    st = lstat(path)
+                except OSError:
+                    continue
+                if not S_ISREG(st.st_mode):
+                    continue
+                key = relpath(path, working_dir).replace(sep, '/')
+                index[key] = ResultEntry(
+                    path, st.st_size, st.st_mtime_ns, st.st_ino)
+        return index
+
+    def get_index(self, working_dir):
+        """
+        Return the index of the results of the finished job, scanning
+        it if needed (e.g. for a restored job), or None if no finished
+        job is associated with the working_dir.
         """
 
-        target = normpath(join(working_dir, key))
-        if not (target.startswith(working_dir) and isfile(target)):
+        index = self.indexes.get(working_dir)
+        if index is not None:
+            return index
+        status = self.status.get(working_dir)
+        if status is None or status.state in (QUEUED, RUNNING):
             return None
-        return target
+        index = self.scan_results(working_dir)
+        with self.lock:
+            if working_dir in self.status:
+                self.indexes[working_dir] = index
+        return index
+
+    def remote_url(self, working_dir, path=''):
+        """
+        Return the URL of the job on the agent that runs it joined with
+        the path, or None for a job run locally (the default).
+        """
+
+        return None
 
     def list_working_dir(self, working_dir):
         """
@@ -111,7 +1209,62 @@ class JobManager(WDManager):
         the file names.
         """
 
-        return listdir(working_dir)
+        return [
+            name for name in listdir(working_dir) if name not in self.reserved]
+
+    def list_result_keys(self, working_dir):
+        """
+        Return the result keys through list_working_dir; the keys will
+        be cached once the job has finished, as its working directory is
+        not expected to change afterwards.  Use invalidate should that
+        not be the case.
+        """
+
+        keys = self.listings.get(working_dir)
+        if keys is not None:
+            return list(keys)
+
+        keys = [
+            key for key in self.list_working_dir(working_dir)
+            if key not in self.reserved
+        ]
+        status = self.status.get(working_dir)
+        if status is not None and status.state not in (QUEUED, RUNNING):
+            self.listings[working_dir] = tuple(keys)
+        return keys
+
+    def invalidate(self, working_dir):
+        """
+        Invalidate the cached result keys and the index of the results
+        for the working_dir.
+        """
+
+        self.listings.pop(working_dir, None)
+        self.indexes.pop(working_dir, None)
+        with self.lock:
+            # closed under the lock as it may be in use by open_result.
+            dir_fd = self.dir_fds.pop(working_dir, None)
+            if dir_fd is not None:
+                close(dir_fd)
+
+    def list_result_files(self, working_dir, pattern=None):
+        """
+        Return the list of (key, path) for all the regular files under
+        the working_dir of a finished job, including those in the
+        subdirectories with the relative path as the key, in sorted
+        order.  If a glob pattern is provided, only the matching keys
+        are included.  Raises KeyError if no finished job is associated
+        with the working_dir.
+        """
+
+        index = self.get_index(working_dir)
+        if index is None:
+            raise KeyError('no such finished job')
+        self.status[working_dir].accessed = time()
+        return [
+            (key, entry.path) for key, entry in index.items()
+            if pattern is None or fnmatchcase(key, pattern)
+        ]
 
     def get_result_by_key(self, working_dir, key):
         """
@@ -127,3 +1280,117 @@ class JobManager(WDManager):
 
         with open(target) as fd:
             return fd.read()
+
+    def open_result(self, working_dir, key):
+        """
+        Open the result as a binary file object.
+        """
+
+        if self.use_dir_fd:
+            fd = self._open_indexed(working_dir, key)
+            if fd is not None:
+                return fd
+        target = self.lookup_path(working_dir, key)
+        if not target:
+            raise KeyError('no such working_dir or key')
+        status = self.status.get(working_dir)
+        if status is not None:
+            status.accessed = time()
+        return open(target, 'rb')
+
+    def _open_indexed(self, working_dir, key):
+        # open the indexed result relative to the descriptor of the
+        # working_dir, verifying that it is still the file indexed.
+        index = self.get_index(working_dir)
+        if index is None:
+            return None
+        entry = index.get(key)
+        if entry is None:
+            raise KeyError('no such working_dir or key')
+        with self.lock:
+            dir_fd = self.dir_fds.get(working_dir)
+            if dir_fd is None:
+                if working_dir not in self.status:
+                    raise KeyError('no such working_dir or key')
+                dir_fd = self.dir_fds[working_dir] = os_open(
+                    working_dir, O_RDONLY | O_DIRECTORY)
+            fd = os_open(key, O_RDONLY | O_NOFOLLOW, dir_fd=dir_fd)
+        fo = open(fd, 'rb')
+        if fstat(fd).st_ino != entry.inode:
+            fo.close()
+            raise KeyError('result has been replaced since indexed')
+        self.status[working_dir].accessed = time()
+        return fo
+
+    def get_result_view(self, working_dir, key):
+        """
+        Retrieve the raw result as a read-only memoryview; results that
+        are at least mmap_threshold in size will be memory mapped rather
+        than read into memory.
+        """
+
+        with self.open_result(working_dir, key) as fd:
+            size = fstat(fd.fileno()).st_size
+            if not size or size < self.mmap_threshold:
+                return memoryview(fd.read())
+            return memoryview(
+                mmap.mmap(fd.fileno(), 0, access=mmap.ACCESS_READ))
+
+    def get_compressed_result(self, working_dir, key, encoding):
+        """
+        Return the path to the copy of the result compressed with the
+        encoding, compressing it if a current copy is not already in
+        the cache.  Return None if it is not to be compressed, i.e. the
+        job has not finished or the result is below the threshold.
+        """
+
+        status = self.status.get(working_dir)
+        if status is None or status.state in (QUEUED, RUNNING):
+            return None
+        index = self.get_index(working_dir)
+        entry = None if index is None else index.get(key)
+        if entry is None:
+            raise KeyError('no such working_dir or key')
+        if entry.size < self.compress_threshold:
+            return None
+
+        cached = join(
+            working_dir, self.compressed_dir, key + ENCODERS[encoding][0])
+        try:
+            if stat(cached).st_mtime_ns >= entry.mtime_ns:
+                return cached
+        except FileNotFoundError:
+            pass
+        makedirs(dirname(cached), exist_ok=True)
+        compress_file(entry.path, cached, encoding)
+        return cached
+
+    def open_compressed_result(self, working_dir, key, encoding):
+        """
+        Open the result compressed with the encoding as a binary file
+        object, or return None if it is not to be compressed.
+        """
+
+        cached = self.get_compressed_result(working_dir, key, encoding)
+        if cached is None:
+            return None
+        status = self.status.get(working_dir)
+        if status is not None:
+            status.accessed = time()
+        return open(cached, 'rb')
+
+    def _precompress(self, working_dir):
+        try:
+            for key in list(self.get_index(working_dir) or ()):
+                for encoding in self.precompress:
+                    self.get_compressed_result(working_dir, key, encoding)
+        except (KeyError, OSError):
+            # the job may have been evicted in the meantime.
+            logger.debug(
+                'failed to compress results for %s', working_dir,
+                exc_info=True)
+            return
+        status = self.status.get(working_dir)
+        if status is not None:
+            # now including the compressed copies.
+            status.size = self.job_size(working_dir)
@@ -0,0 +1,167 @@
+# -*- coding: utf-8 -*-
+"""
+Aggregated accounting of the jobs, in the Prometheus text format
+"""
+
+from bisect import bisect_left
+from threading import Lock
+
+from .manager import EVICTED
+from .manager import QUEUED
+from .manager import RUNNING
+
+DEFAULT_TYPE = 'default'
+
+SECONDS_BUCKETS = (
+    0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300, 900, 3600)
+BYTES_BUCKETS = tuple(1 << shift for shift in range(10, 36, 2))
+
+
+def escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace(
+        '\n', '\\n')
+
+
+def format_labels(labels):
+    if not labels:
+        return ''
+    return '{%s}' % ','.join(
+        '%s="%s"' % (key, escape(value)) for key, value in labels)
+
+
+class Histogram(object):
+    """
+    A histogram of the observed values over the upper bounds of the
+    buckets.
+    """
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def samples(self, name, labels):
+        cumulative = 0
+        for bound, value in zip(self.buckets + ('+Inf',), self.counts):
+            cumulative += value
+            yield '%s_bucket%s %d' % (
+                name, format_labels(labels + (('le', bound),)), cumulative)
+        yield '%s_sum%s %r' % (name, format_labels(labels), self.sum)
+        yield '%s_count%s %d' % (name, format_labels(labels), self.count)
+
+
+class JobMetrics(object):
+    """
+    Accumulate the counters and the histograms of the resource usage of
+    the jobs, by their job type.  An instance is to be subscribed to the
+    JobManager, whose current queued and running jobs are reported as
+    gauges by render.
+    """
+
+    histograms = (
+        # name, help, JobStatus attribute, buckets
+        ('job_queue_seconds', 'Time spent by jobs in the queue.',
+            'queue_time', SECONDS_BUCKETS),
+        ('job_wall_seconds', 'Wall clock time of the job subprocesses.',
+            'wall_time', SECONDS_BUCKETS),
+        ('job_user_cpu_seconds', 'User CPU time of the job subprocesses.',
+            'utime', SECONDS_BUCKETS),
+        ('job_system_cpu_seconds',
+            'System CPU time of the job subprocesses.',
+            'stime', SECONDS_BUCKETS),
+        ('job_max_rss_bytes', 'Maximum resident set size of the jobs.',
+            'maxrss', BYTES_BUCKETS),
+        ('job_size_bytes', 'Size of the working directories of the jobs.',
+            'size', BYTES_BUCKETS),
+    )
+
+    def __init__(self, prefix='repodono'):
+        self.prefix = prefix
+        self.lock = Lock()
+        # (job_type,) to the count of the started jobs.
+        self.started = {}
+        # (job_type, state) to the count of the finished jobs.
+        self.finished = {}
+        # name to {(job_type,): Histogram}
+        self.observed = {name: {} for name, _, _, _ in self.histograms}
+
+    def __call__(self, working_dir, status):
+        job_type = status.job_type or DEFAULT_TYPE
+        with self.lock:
+            if status.state == RUNNING:
+                self.started[job_type] = self.started.get(job_type, 0) + 1
+                return
+            if status.state in (QUEUED, EVICTED):
+                return
+            key = (job_type, status.state)
+            self.finished[key] = self.finished.get(key, 0) + 1
+            for name, _, attr, buckets in self.histograms:
+                value = getattr(status, attr)
+                if value is None:
+                    continue
+                histogram = self.observed[name].get(job_type)
+                if histogram is None:
+                    histogram = self.observed[name][job_type] = Histogram(
+                        buckets)
+                histogram.observe(value)
+
+    def render(self, manager=None, admission=None):
+        """
+        Return the metrics in the Prometheus text exposition format,
+        with the gauges of the manager and the rejections counted by
+        the AdmissionControl if provided.
+        """
+
+        prefix = self.prefix
+        lines = []
+
+        def header(name, help, kind):
+            lines.append('# HELP %s_%s %s' % (prefix, name, help))
+            lines.append('# TYPE %s_%s %s' % (prefix, name, kind))
+
+        with self.lock:
+            header('jobs_started_total', 'Jobs started.', 'counter')
+            for job_type, value in sorted(self.started.items()):
+                lines.append('%s_jobs_started_total%s %d' % (
+                    prefix, format_labels((('type', job_type),)), value))
+
+            header('jobs_finished_total', 'Jobs finished.', 'counter')
+            for (job_type, state), value in sorted(self.finished.items()):
+                lines.append('%s_jobs_finished_total%s %d' % (
+                    prefix, format_labels(
+                        (('type', job_type), ('state', state))), value))
+
+            for name, help, _, _ in self.histograms:
+                header(name, help, 'histogram')
+                for job_type, histogram in sorted(
+                        self.observed[name].items()):
+                    lines.extend(histogram.samples(
+                        '%s_%s' % (prefix, name), (('type', job_type),)))
+
+        if manager is not None:
+            header('jobs_queued', 'Jobs currently queued.', 'gauge')
+            lines.append('%s_jobs_queued %d' % (prefix, len(manager.queued)))
+            header(
+                'jobs_waiting', 'Jobs currently waiting on their upstream.',
+                'gauge')
+            lines.append(
+                '%s_jobs_waiting %d' % (prefix, len(manager.waiting)))
+            header('jobs_running', 'Jobs currently running.', 'gauge')
+            lines.append(
+                '%s_jobs_running %d' % (prefix, len(manager.running)))
+            header('jobs_tracked', 'Jobs currently tracked.', 'gauge')
+            lines.append('%s_jobs_tracked %d' % (prefix, len(manager.status)))
+
+        if admission is not None:
+            header('jobs_rejected_total', 'Jobs rejected.', 'counter')
+            for status, value in sorted(admission.rejected.items()):
+                lines.append('%s_jobs_rejected_total%s %d' % (
+                    prefix, format_labels((('status', status),)), value))
+
+        return '\n'.join(lines) + '\n'
@@ -0,0 +1,131 @@
+# -*- coding: utf-8 -*-
+"""
+Capture of the output of the job subprocesses
+"""
+
+import logging
+import os
+import struct
+
+from .selector import SelectorThread
+
+logger = logging.getLogger(__name__)
+
+
+class RingLog(object):
+    """
+    A log file of bounded size; once its capacity is reached, the bytes
+    written overwrite the oldest ones.  The bytes are addressed by their
+    offset from the start of the output, and a header records the
+    capacity, the total bytes written and whether the output is closed,
+    such that readers in any process may tell which offsets are still
+    available.
+    """
+
+    header = struct.Struct('<QQQ')
+
+    def __init__(self, path, capacity):
+        self.path = path
+        self.capacity = capacity
+        self.written = 0
+        self.fd = os.open(path, os.O_RDWR | os.O_CREAT | os.O_TRUNC, 0o644)
+        self._write_header(False)
+
+    def _write_header(self, closed):
+        os.pwrite(self.fd, self.header.pack(
+            self.capacity, self.written, int(closed)), 0)
+
+    def write(self, data):
+        if len(data) > self.capacity:
+            self.written += len(data) - self.capacity
+            data = data[-self.capacity:]
+        position = self.written % self.capacity
+        head = data[:self.capacity - position]
+        os.pwrite(self.fd, head, self.header.size + position)
+        if len(head) < len(data):
+            os.pwrite(self.fd, data[len(head):], self.header.size)
+        self.written += len(data)
+        self._write_header(False)
+
+    def close(self):
+        if self.fd is None:
+            return
+        self._write_header(True)
+        os.close(self.fd)
+        self.fd = None
+
+    @classmethod
+    def read(cls, path, offset=0, limit=65536):
+        """
+        Read up to limit bytes from the log at path starting from the
+        offset; a negative offset is relative to the end of the output.
+        Return the data, the offset it starts from (which is later than
+        the one requested if those bytes were overwritten), and whether
+        the output is closed.  Raises OSError if the log is missing.
+        """
+
+        with open(path, 'rb') as fd:
+            capacity, written, closed = cls.header.unpack(
+                fd.read(cls.header.size))
+            if offset < 0:
+                offset = written + offset
+            start = max(offset, written - capacity, 0)
+            stop = min(written, start + limit)
+            data = b''
+            while start + len(data) < stop:
+                position = (start + len(data)) % capacity
+                fd.seek(cls.header.size + position)
+                data += fd.read(
+                    min(stop - start - len(data), capacity - position))
+            if data:
+                # bytes overwritten while being read are discarded.
+                fd.seek(0)
+                _, written, _ = cls.header.unpack(fd.read(cls.header.size))
+                lost = written - capacity - start
+                if lost > 0:
+                    data = data[lost:]
+                    start += lost
+        return data, start, bool(closed) and stop == written
+
+
+class OutputCollector(SelectorThread):
+    """
+    Collect the output from the pipes of the subprocesses into their
+    RingLogs, from a single background thread.  A slow reader of a log
+    never blocks the subprocess, as the pipes are always drained.
+    """
+
+    name = 'OutputCollector'
+    chunk_size = 65536
+
+    def add(self, pipe, log):
+        """
+        Collect the output from pipe (a file object) into the log until
+        the end of file, at which point both are closed.
+        """
+
+        self.watch(pipe.fileno(), (pipe, log))
+
+    def ready(self, key):
+        pipe, log = key.data
+        try:
+            data = os.read(key.fd, self.chunk_size)
+        except OSError:
+            data = b''
+        try:
+            if data:
+                log.write(data)
+                return
+        except OSError:
+            # the working directory may have been removed.
+            logger.debug('failed to write %s', log.path)
+        self.selector.unregister(key.fd)
+        self.release(key.fd, key.data)
+
+    def release(self, fd, data):
+        pipe, log = data
+        pipe.close()
+        try:
+            log.close()
+        except OSError:
+            pass
@@ -0,0 +1,205 @@
+# -*- coding: utf-8 -*-
+"""
+Pool of warm Python workers
+"""
+
+import json
+import logging
+import sys
+
+from os.path import dirname
+from os.path import join
+from subprocess import PIPE
+from subprocess import Popen
+from subprocess import TimeoutExpired
+from threading import Event
+from threading import Lock
+from threading import Thread
+
+from .manager import JobManager
+
+logger = logging.getLogger(__name__)
+
+WORKER = join(dirname(__file__), 'worker.py')
+
+
+def _close_output(worker):
+    for pipe in (worker.stdout, worker.stderr):
+        if pipe is not None:
+            pipe.close()
+
+
+class WorkerPool(object):
+    """
+    Keep a number of Python processes started with the preload modules
+    imported, such that Python commands may be run by them without
+    paying for the interpreter startup.
+
+    Each worker runs exactly one job and exits with its exit status, so
+    the Popen instance of the worker stands in for the job itself.  A
+    replacement worker is started from a background thread whenever one
+    is dispatched, such that dispatch never waits on it.  If capture is
+    enabled, the stdout and stderr of the workers are pipes to be
+    collected by the caller once dispatched.
+    """
+
+    def __init__(
+            self, size=4, preload=(), executable=sys.executable,
+            capture=False):
+        self.size = size
+        self.preload = tuple(preload)
+        self.executable = executable
+        self.capture = capture
+        self.lock = Lock()
+        self.idle = []
+        self.running = False
+        # the thread that starts the replacement workers, which is woken
+        # up through wanted.
+        self.replenisher = None
+        self.wanted = Event()
+
+    def _spawn_worker(self):
+        output = PIPE if self.capture else None
+        return Popen(
+            (self.executable, WORKER) + self.preload, stdin=PIPE,
+            start_new_session=True, stdout=output, stderr=output)
+
+    def start(self):
+        with self.lock:
+            self.running = True
+        self._fill()
+
+    def _fill(self):
+        while True:
+            with self.lock:
+                if not self.running or len(self.idle) >= self.size:
+                    return
+            worker = self._spawn_worker()
+            with self.lock:
+                if self.running:
+                    self.idle.append(worker)
+                    continue
+            # stopped while the worker was being started.
+            self._retire([worker])
+            return
+
+    def _replenish(self):
+        with self.lock:
+            if not self.running:
+                return
+            self.wanted.set()
+            if self.replenisher is None:
+                self.replenisher = Thread(
+                    target=self._run_replenisher, name='WorkerPool')
+                self.replenisher.daemon = True
+                self.replenisher.start()
+
+    def _run_replenisher(self):
+        while True:
+            self.wanted.wait()
+            self.wanted.clear()
+            if not self.running:
+                return
+            try:
+                self._fill()
+            except OSError:
+                logger.exception('failed to start a worker')
+
+    def stop(self):
+        with self.lock:
+            self.running = False
+            replenisher, self.replenisher = self.replenisher, None
+            idle, self.idle = self.idle, []
+        if replenisher is not None:
+            self.wanted.set()
+            replenisher.join()
+        self._retire(idle)
+
+    def _retire(self, idle):
+        for worker in idle:
+            # closing stdin without a job will have the worker exit.
+            worker.stdin.close()
+        for worker in idle:
+            try:
+                worker.wait(timeout=1)
+            except TimeoutExpired:
+                worker.kill()
+                worker.wait()
+            _close_output(worker)
+
+    def accepts(self, args):
+        """
+        Return whether the args is a Python command line that could be
+        run by the workers.
+        """
+
+        if len(args) < 2 or args[0] != self.executable:
+            return False
+        if args[1] in ('-c', '-m'):
+            return len(args) >= 3
+        return not args[1].startswith('-')
+
+    def dispatch(self, args, working_dir, rlimits=(), cgroup=None):
+        """
+        Run the Python command line args in working_dir with a worker,
+        return its Popen instance.  The worker applies the rlimits (a
+        list of (resource, (soft, hard))) and joins the cgroup first.
+        """
+
+        job = (json.dumps({
+            'args': list(args), 'cwd': working_dir,
+            'rlimits': list(rlimits), 'cgroup': cgroup,
+        }) + '\n').encode('utf8')
+
+        while True:
+            with self.lock:
+                worker = self.idle.pop(0) if self.idle else None
+            if worker is None:
+                # none are ready; only the replacements are started in
+                # the background.
+                worker = self._spawn_worker()
+            try:
+                worker.stdin.write(job)
+                worker.stdin.close()
+            except (BrokenPipeError, ValueError):
+                logger.warning('worker %d has exited early' % worker.pid)
+                worker.wait()
+                _close_output(worker)
+                continue
+            break
+
+        self._replenish()
+        return worker
+
+
+class WorkerPoolJobManager(JobManager):
+    """
+    Job manager that runs the Python commands returned by get_args with
+    a pool of warm workers, falling back to a new subprocess for other
+    commands.  Unlike the default, the jobs will be run with the
+    working_dir as the current directory.
+    """
+
+    def __init__(self, pool_size=4, preload=(), **kw):
+        super(WorkerPoolJobManager, self).__init__(**kw)
+        self.pool = WorkerPool(
+            size=pool_size, preload=preload, capture=self.capture_output)
+
+    def start(self):
+        super(WorkerPoolJobManager, self).start()
+        self.pool.start()
+
+    def stop(self):
+        self.pool.stop()
+        super(WorkerPoolJobManager, self).stop()
+
+    def create_process(self, args, working_dir):
+        if not self.pool.accepts(args):
+            return super(WorkerPoolJobManager, self).create_process(
+                args, working_dir)
+        limits = self.job_limits.get(working_dir)
+        if limits is None:
+            return self.pool.dispatch(args, working_dir)
+        return self.pool.dispatch(
+            args, working_dir, rlimits=limits.rlimits(),
+            cgroup=self.cgroups.get(working_dir))
@@ -0,0 +1,247 @@
+# -*- coding: utf-8 -*-
+"""
+Compact records of the jobs, indexed for listing them a page at a time
+"""
+
+import heapq
+
+from bisect import bisect_left
+from bisect import bisect_right
+from bisect import insort
+from itertools import count
+from itertools import islice
+from threading import Lock
+
+
+class JobRecord(object):
+    """
+    The job_id and the working_dir of a job known to a JobServer, with
+    the fields of its JobStatus that are listed, copied on every
+    transition.
+    """
+
+    __slots__ = (
+        'sequence', 'job_id', 'working_dir', 'state', 'submitted',
+        'started', 'finished', 'returncode',
+    )
+
+    def __init__(self, sequence, job_id, working_dir, status):
+        self.sequence = sequence
+        self.job_id = job_id
+        self.working_dir = working_dir
+        self.update(status)
+
+    def update(self, status):
+        self.state = status.state
+        self.submitted = status.submitted
+        self.started = status.started
+        self.finished = status.finished
+        self.returncode = status.returncode
+
+    def as_dict(self):
+        return {
+            'id': self.job_id,
+            'status': self.state,
+            'submitted': self.submitted,
+            'started': self.started,
+            'finished': self.finished,
+            'returncode': self.returncode,
+        }
+
+
+class SequenceList(object):
+    """
+    Sorted list of distinct sequence numbers, held in buckets of up to
+    twice the load, such that adding or removing one only shifts the
+    bucket it falls in rather than the whole list.
+    """
+
+    load = 512
+
+    def __init__(self):
+        self.buckets = []
+        # the last sequence of each of the buckets.
+        self.maxes = []
+        self.length = 0
+
+    def __len__(self):
+        return self.length
+
+    def __iter__(self):
+        return self.after(None)
+
+    def add(self, sequence):
+        if not self.buckets:
+            self.buckets.append([sequence])
+            self.maxes.append(sequence)
+            self.length += 1
+            return
+        idx = bisect_left(self.maxes, sequence)
+        if idx == len(self.maxes):
+            # mostly appended, as the sequences are mostly added in the
+            # order they were issued in.
+            idx -= 1
+            self.buckets[idx].append(sequence)
+            self.maxes[idx] = sequence
+        else:
+            insort(self.buckets[idx], sequence)
+        self.length += 1
+        bucket = self.buckets[idx]
+        if len(bucket) >= self.load * 2:
+            self.buckets.insert(idx + 1, bucket[self.load:])
+            self.maxes.insert(idx + 1, bucket[-1])
+            del bucket[self.load:]
+            self.maxes[idx] = bucket[-1]
+
+    def remove(self, sequence):
+        idx = bisect_left(self.maxes, sequence)
+        bucket = self.buckets[idx]
+        pos = bisect_left(bucket, sequence)
+        del bucket[pos]
+        self.length -= 1
+        if not bucket:
+            del self.buckets[idx]
+            del self.maxes[idx]
+        elif pos == len(bucket):
+            self.maxes[idx] = bucket[-1]
+
+    def after(self, sequence):
+        """
+        Iterate through the sequences after the given one, or all of
+        them for None.
+        """
+
+        if sequence is None:
+            idx = pos = 0
+        else:
+            idx = bisect_right(self.maxes, sequence)
+            if idx == len(self.buckets):
+                return
+            pos = bisect_right(self.buckets[idx], sequence)
+        for bucket in islice(self.buckets, idx, None):
+            for value in islice(bucket, pos, None):
+                yield value
+            pos = 0
+
+
+class JobIndex(object):
+    """
+    The JobRecords of the jobs, indexed by their job_id, and by their
+    state and the order they were added in (i.e. their submission
+    order), such that the jobs in a given state may be listed a page at
+    a time without going through all the others; see page.
+
+    The sequence numbers of the records in each state are kept in
+    SequenceLists, from which they are removed as the jobs move on.
+    """
+
+    def __init__(self):
+        self.lock = Lock()
+        self.records = {}
+        # sequence to the record, and the sorted sequences of all the
+        # records and of those in each state.
+        self.sequences = {}
+        self.ordered = SequenceList()
+        self.states = {}
+        self._sequence = count()
+
+    def clear(self):
+        with self.lock:
+            self.records.clear()
+            self.sequences.clear()
+            self.ordered = SequenceList()
+            self.states = {}
+
+    def __len__(self):
+        return len(self.records)
+
+    def get(self, job_id):
+        return self.records.get(job_id)
+
+    def add(self, job_id, working_dir, status):
+        """
+        Add the record for the job with its status, replacing the one
+        for the job_id if there is one.
+        """
+
+        with self.lock:
+            self._remove(job_id)
+            record = JobRecord(
+                next(self._sequence), job_id, working_dir, status)
+            self.records[job_id] = record
+            self.sequences[record.sequence] = record
+            self.ordered.add(record.sequence)
+            self._index(record)
+        return record
+
+    def update(self, job_id, status):
+        """
+        Update the record for the job from its status, reindexing it
+        under its state; return it, or None if the job_id has no record.
+        """
+
+        with self.lock:
+            record = self.records.get(job_id)
+            if record is None:
+                return None
+            if record.state != status.state:
+                self._discard(record)
+                record.update(status)
+                self._index(record)
+            else:
+                record.update(status)
+        return record
+
+    def remove(self, job_id):
+        with self.lock:
+            return self._remove(job_id)
+
+    def _remove(self, job_id):
+        record = self.records.pop(job_id, None)
+        if record is not None:
+            del self.sequences[record.sequence]
+            self._discard(record)
+            self.ordered.remove(record.sequence)
+        return record
+
+    def _index(self, record):
+        sequences = self.states.get(record.state)
+        if sequences is None:
+            sequences = self.states[record.state] = SequenceList()
+        sequences.add(record.sequence)
+
+    def _discard(self, record):
+        sequences = self.states[record.state]
+        sequences.remove(record.sequence)
+        if not sequences:
+            del self.states[record.state]
+
+    def _scan(self, sequences, after):
+        # the (sequence, record) of the sequences after the cursor.
+        for sequence in sequences.after(after):
+            yield sequence, self.sequences[sequence]
+
+    def page(self, states=None, after=None, limit=100):
+        """
+        Return up to limit records in submission order, of the jobs in
+        any of the states (default is all jobs) submitted after the one
+        with the sequence after, along with the cursor for the next
+        page (the sequence of the last record), or None if the last page
+        has been reached.
+        """
+
+        with self.lock:
+            if states is None:
+                scans = [self._scan(self.ordered, after)]
+            else:
+                # the sequences are distinct, so the records themselves
+                # are never compared.
+                scans = [
+                    self._scan(self.states[state], after)
+                    for state in set(states) if state in self.states
+                ]
+            records = [record for sequence, record in islice(
+                heapq.merge(*scans), limit + 1)]
+        if len(records) > limit:
+            return records[:limit], records[limit - 1].sequence
+        return records, None
@@ -0,0 +1,464 @@
+# -*- coding: utf-8 -*-
+"""
+Manager that runs the jobs with remote executor agents
+"""
+
+import http.client
+import json
+import logging
+
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from threading import Event
+from threading import Lock
+from threading import Thread
+from urllib.parse import quote
+from urllib.parse import urlsplit
+
+from .exc import ManagerRuntimeError
+from .manager import JobManager
+from .manager import QUEUED
+from .manager import RUNNING
+from .manager import KILLED
+from .manager import TIMEOUT
+from .manager import ResultEntry
+
+logger = logging.getLogger(__name__)
+
+
+class AgentError(Exception):
+    """
+    The agent responded with an error.
+    """
+
+    def __init__(self, status, message):
+        super(AgentError, self).__init__('%d %s' % (status, message))
+        self.status = status
+
+
+class AgentClient(object):
+    """
+    The client for an executor agent at url, see repodono.jobs.agent,
+    tracking its load as last reported.
+    """
+
+    def __init__(self, url, timeout=10.0):
+        self.url = url.rstrip('/')
+        parts = urlsplit(self.url)
+        self.host = parts.hostname
+        self.port = parts.port
+        self.timeout = timeout
+        self.lock = Lock()
+        # the jobs running and queued on the agent and the number it
+        # may run at once, as last reported.
+        self.load = 0
+        self.capacity = 1
+
+    def open(self, method, path, body=None):
+        """
+        Make the request, return the HTTPResponse for reading; raises
+        AgentError for an error response, or OSError if unreachable.
+        """
+
+        connection = http.client.HTTPConnection(
+            self.host, self.port, timeout=self.timeout)
+        headers = {}
+        if body is not None:
+            body = json.dumps(body).encode('utf8')
+            headers['Content-Type'] = 'application/json'
+        connection.request(method, path, body=body, headers=headers)
+        response = connection.getresponse()
+        if response.status >= 400:
+            try:
+                message = json.loads(response.read().decode('utf8'))['error']
+            except (ValueError, KeyError):
+                message = response.reason
+            finally:
+                connection.close()
+            raise AgentError(response.status, message)
+        return response
+
+    def request(self, method, path, body=None):
+        with self.open(method, path, body) as response:
+            return json.loads(response.read().decode('utf8'))
+
+    def report(self, result):
+        with self.lock:
+            self.load = result['running'] + result['queued']
+            self.capacity = max(result['capacity'], 1)
+
+    def utilization(self):
+        with self.lock:
+            return self.load / self.capacity
+
+    def reserve(self):
+        with self.lock:
+            # a job placed onto the agent, counted until the next report.
+            self.load += 1
+
+    def submit(self, kw):
+        return self.request('POST', '/jobs', kw)['job_id']
+
+    def poll(self, job_ids):
+        result = self.request('POST', '/poll', list(job_ids))
+        self.report(result)
+        return result['jobs']
+
+    def refresh(self):
+        self.report(self.request('GET', '/capacity'))
+
+    def describe(self, job_id):
+        return self.request('GET', '/jobs/%s' % quote(job_id))
+
+    def cancel(self, job_id):
+        return self.request('DELETE', '/jobs/%s' % quote(job_id))['cancelled']
+
+    def index(self, job_id):
+        return self.request('GET', '/jobs/%s/index' % quote(job_id))
+
+    def open_result(self, job_id, key):
+        return self.open('GET', '/jobs/%s/results/%s' % (
+            quote(job_id), quote(key)))
+
+
+class RemoteProcess(object):
+    """
+    Stands in for the subprocess of a job run by an agent, as far as
+    the JobManager is concerned.  The job_id is None until the job has
+    been submitted to the agent.
+    """
+
+    pid = None
+
+    def __init__(self, agent, job_id=None):
+        self.agent = agent
+        self.job_id = job_id
+        self.returncode = None
+        self.signalled = False
+        self.lock = Lock()
+        # set once the job is submitted, or has failed to be.
+        self.placed = Event()
+
+    def poll(self):
+        return self.returncode
+
+    def submitted(self, job_id):
+        """
+        Record the job_id of the submitted job; return True if it was
+        signalled in the meantime, in which case it must be cancelled.
+        """
+
+        with self.lock:
+            self.job_id = job_id
+            return self.signalled
+
+    def send_signal(self, sig):
+        # any signal cancels the job, which is only done once; one that
+        # is yet to be submitted is cancelled once it is.
+        with self.lock:
+            if self.signalled or self.returncode is not None:
+                return
+            self.signalled = True
+            if self.job_id is None:
+                return
+        self.cancel()
+
+    def cancel(self):
+        try:
+            self.agent.cancel(self.job_id)
+        except (AgentError, OSError):
+            logger.warning(
+                'failed to cancel job %s on %s', self.job_id,
+                self.agent.url, exc_info=True)
+
+    def terminate(self):
+        self.send_signal(None)
+
+    kill = terminate
+
+
+class AgentPoller(Thread):
+    """
+    Background thread that polls the agents of the manager for the
+    states of their jobs.
+    """
+
+    def __init__(self, manager, interval):
+        super(AgentPoller, self).__init__(name='AgentPoller')
+        self.daemon = True
+        self.manager = manager
+        self.interval = interval
+        self.stopped = Event()
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            try:
+                self.manager._poll_agents()
+            except Exception:
+                logger.exception('error polling the agents')
+
+    def stop(self):
+        self.stopped.set()
+        if self.is_alive():
+            self.join()
+
+
+class RemoteJobManager(JobManager):
+    """
+    Job manager that places its jobs onto the least utilized of the
+    executor agents at the urls in agents, by their reported load
+    relative to their capacity.  The kwargs of the jobs are sent to the
+    agents, which must run a manager that accepts them, and so must be
+    serializable as JSON.
+
+    The jobs are submitted to the agents, and cancelled and deleted on
+    them, from a pool of max_requests threads such that the callers
+    (e.g. the event loop of a server) are never held up by a slow or an
+    unreachable agent, and the agents are polled every poll_interval
+    seconds for the states of the jobs and their load from a thread of
+    their own.  The results of the finished jobs remain
+    with the agents; they are read through open_result, or served from
+    the agent at remote_url, and evicting the job deletes it from the
+    agent.  The resource limits are left for the agents to apply, and
+    the output of the jobs is captured by them.
+    """
+
+    def __init__(self, agents=(), poll_interval=0.25, max_requests=4, **kw):
+        super(RemoteJobManager, self).__init__(**kw)
+        self.agents = [AgentClient(url) for url in agents]
+        self.poll_interval = poll_interval
+        self.max_requests = max_requests
+        # working_dir to the RemoteProcess of the jobs.
+        self.placements = {}
+        self.poller = None
+        # the pool the requests to the agents are made from.
+        self.requests = None
+
+    def start(self):
+        if not self.agents:
+            raise ManagerRuntimeError('no agents are configured')
+        super(RemoteJobManager, self).start()
+        for agent in self.agents:
+            try:
+                agent.refresh()
+            except (AgentError, OSError):
+                logger.warning('agent %s is unavailable', agent.url)
+        self.requests = ThreadPoolExecutor(self.max_requests)
+        self.poller = AgentPoller(self, self.poll_interval)
+        self.poller.start()
+
+    def stop(self):
+        if self.poller is not None:
+            self.poller.stop()
+            self.poller = None
+        with self.lock:
+            running = [
+                (wd, process) for wd, process in self.placements.items()
+                if process.returncode is None]
+        for wd, process in running:
+            logger.warning(
+                'cancelling job %s on %s', process.job_id, process.agent.url)
+            process.terminate()
+            self.mapping.pop(wd, None)
+        if self.requests is not None:
+            # the jobs still being submitted are cancelled as they are.
+            self.requests.shutdown()
+            self.requests = None
+        super(RemoteJobManager, self).stop()
+        self.placements.clear()
+
+    def request(self, fn, *a):
+        """
+        Make the request to the agent through fn from the pool, or right
+        away once the manager has stopped.
+        """
+
+        requests = self.requests
+        if requests is None:
+            fn(*a)
+            return
+        try:
+            requests.submit(fn, *a)
+        except RuntimeError:
+            # shut down in the meantime.
+            fn(*a)
+
+    def place(self, **kw):
+        """
+        Return the agents in the order of preference for the job; the
+        least utilized first.
+        """
+
+        return sorted(self.agents, key=lambda agent: agent.utilization())
+
+    def spawn(self, working_dir, **kw):
+        # placed right away, so that the jobs spawned in the meantime
+        # are spread across the agents, but submitted from the pool.
+        agents = self.place(**kw)
+        agents[0].reserve()
+        process = RemoteProcess(agents[0])
+        with self.lock:
+            self.mapping[working_dir] = process
+            self.placements[working_dir] = process
+            cancelled = self.status[working_dir].cancelled
+        if cancelled:
+            # cancelled while it was being spawned.
+            process.terminate()
+        self.request(self._submit, working_dir, process, agents, kw)
+
+    def _submit(self, working_dir, process, agents, kw):
+        for agent in agents:
+            if agent is not process.agent:
+                agent.reserve()
+                process.agent = agent
+            try:
+                job_id = agent.submit(kw)
+            except AgentError:
+                logger.exception(
+                    'agent %s rejected the job at %s', agent.url, working_dir)
+                break
+            except OSError:
+                logger.warning(
+                    'agent %s is unavailable', agent.url, exc_info=True)
+                continue
+            if process.submitted(job_id):
+                # cancelled while it was being submitted.
+                process.cancel()
+            process.placed.set()
+            return
+        else:
+            logger.error('no agents are available for the job at %s', (
+                working_dir))
+
+        process.placed.set()
+        try:
+            self._watched(working_dir, None, None)
+        except Exception:
+            logger.exception('failed to finish job at %s', working_dir)
+
+    def signal_process(self, process, sig):
+        self.request(process.send_signal, sig)
+
+    def _poll_agents(self):
+        with self.lock:
+            if self.root is NotImplemented:
+                return
+            running = {}
+            for wd, process in self.placements.items():
+                if process.returncode is None and process.job_id is not None:
+                    running.setdefault(process.agent, []).append(
+                        (wd, process))
+        for agent in self.agents:
+            jobs = running.get(agent, [])
+            try:
+                states = agent.poll(process.job_id for wd, process in jobs)
+            except (AgentError, OSError):
+                logger.warning('failed to poll agent %s', agent.url)
+                continue
+            for wd, process in jobs:
+                state = states[process.job_id]
+                if state['state'] in (QUEUED, RUNNING):
+                    continue
+                process.returncode = state['returncode']
+                if state['state'] in (KILLED, TIMEOUT):
+                    self.status[wd].violation = state['state']
+                try:
+                    self._watched(wd, process.returncode, None)
+                except Exception:
+                    logger.exception('failed to finish job at %s', wd)
+
+    def remote_url(self, working_dir, path=''):
+        process = self.placements.get(working_dir)
+        if process is None or process.job_id is None:
+            return None
+        return '%s/jobs/%s%s' % (
+            process.agent.url, quote(process.job_id), path)
+
+    def scan_results(self, working_dir):
+        process = self.placements.get(working_dir)
+        if process is None:
+            return super(RemoteJobManager, self).scan_results(working_dir)
+        if process.signalled or process.job_id is None:
+            # cancelled, which discards the job on the agent, or never
+            # submitted.
+            return {}
+        try:
+            entries = process.agent.index(process.job_id)
+        except (AgentError, OSError):
+            logger.warning(
+                'failed to index the results of job %s on %s',
+                process.job_id, process.agent.url)
+            return {}
+        # the results have no local paths.
+        return OrderedDict(
+            (key, ResultEntry(None, size, mtime_ns, inode))
+            for key, size, mtime_ns, inode in entries
+        )
+
+    def _measure(self, working_dir):
+        index, size = super(RemoteJobManager, self)._measure(working_dir)
+        if working_dir in self.placements:
+            # the results are held by the agent, which reports their
+            # sizes in the index.
+            size += sum(entry.size for entry in index.values())
+        return index, size
+
+    def list_working_dir(self, working_dir):
+        process = self.placements.get(working_dir)
+        if process is None:
+            return super(RemoteJobManager, self).list_working_dir(
+                working_dir)
+        if working_dir not in self.status:
+            raise KeyError('no such working_dir')
+        # the keys of the results indexed as the job finished, rather
+        # than requested from the agent by the caller.
+        index = self.get_index(working_dir)
+        return [] if index is None else list(index)
+
+    def lookup_path(self, working_dir, key):
+        if working_dir in self.placements:
+            return None
+        return super(RemoteJobManager, self).lookup_path(working_dir, key)
+
+    def open_result(self, working_dir, key):
+        """
+        Open the result as a binary file object, which is read from the
+        agent for a remote job.
+        """
+
+        process = self.placements.get(working_dir)
+        if process is None:
+            return super(RemoteJobManager, self).open_result(
+                working_dir, key)
+        try:
+            return process.agent.open_result(process.job_id, key)
+        except AgentError:
+            raise KeyError('no such working_dir or key')
+
+    def get_result_by_key(self, working_dir, key):
+        with self.open_result(working_dir, key) as fd:
+            return fd.read().decode('utf8')
+
+    def get_result_view(self, working_dir, key):
+        if working_dir not in self.placements:
+            return super(RemoteJobManager, self).get_result_view(
+                working_dir, key)
+        with self.open_result(working_dir, key) as fd:
+            return memoryview(fd.read())
+
+    def get_compressed_result(self, working_dir, key, encoding):
+        if working_dir in self.placements:
+            return None
+        return super(RemoteJobManager, self).get_compressed_result(
+            working_dir, key, encoding)
+
+    def evict(self, working_dir):
+        process = self.placements.get(working_dir)
+        evicted = super(RemoteJobManager, self).evict(working_dir)
+        if evicted and process is not None:
+            self.placements.pop(working_dir, None)
+            if process.signalled or process.job_id is None:
+                return evicted
+            # deletes the finished job from the agent.
+            self.request(process.cancel)
+        return evicted
@@ -0,0 +1,130 @@
+# -*- coding: utf-8 -*-
+"""
+Retention of the working directories of finished jobs
+"""
+
+import logging
+
+from os import lstat
+from os import walk
+from os.path import join
+from threading import Event
+from threading import Thread
+
+logger = logging.getLogger(__name__)
+
+
+def disk_usage(path, exclude=()):
+    """
+    Return the total size of the files under path, in bytes, skipping
+    the directories directly under path that are named in exclude.
+    """
+
+    total = 0
+    for root, dirs, files in walk(path):
+        if root == path and exclude:
+            dirs[:] = [name for name in dirs if name not in exclude]
+        for name in files:
+            try:
+                total += lstat(join(root, name)).st_size
+            except OSError:
+                # vanished while being measured.
+                continue
+    return total
+
+
+class RetentionPolicy(object):
+    """
+    Describe how long and how many of the finished jobs will be
+    retained.
+
+    ttl
+        seconds a finished job is retained for, unless the job was
+        given its own ttl.
+    max_job_size
+        finished jobs with more than this many bytes in their working
+        directory are evicted; running jobs are terminated.
+    max_total_size
+        least recently accessed finished jobs are evicted until the
+        total size of all working directories is within this many bytes.
+    max_jobs
+        least recently accessed finished jobs are evicted until at most
+        this many finished jobs remain.
+    interval
+        seconds between each collection done by the GarbageCollector.
+    """
+
+    def __init__(
+            self, ttl=None, max_job_size=None, max_total_size=None,
+            max_jobs=None, interval=60):
+        self.ttl = ttl
+        self.max_job_size = max_job_size
+        self.max_total_size = max_total_size
+        self.max_jobs = max_jobs
+        self.interval = interval
+
+    def expired(self, status, now):
+        ttl = self.ttl if status.ttl is None else status.ttl
+        return ttl is not None and now - status.finished > ttl
+
+    def oversized(self, status):
+        return (
+            self.max_job_size is not None
+            and (status.size or 0) > self.max_job_size
+        )
+
+    def select(self, finished, total_size, now):
+        """
+        Return the working_dirs to be evicted, out of the list of
+        (working_dir, status) for the finished jobs, given the
+        total_size of all the working directories.
+        """
+
+        evict = []
+        retained = []
+        for working_dir, status in finished:
+            if self.expired(status, now) or self.oversized(status):
+                evict.append(working_dir)
+                total_size -= status.size or 0
+            else:
+                retained.append((status.accessed, working_dir, status))
+
+        retained.sort(key=lambda item: item[0])
+        remaining = len(retained)
+        for accessed, working_dir, status in retained:
+            if not (
+                    (self.max_total_size is not None
+                        and total_size > self.max_total_size)
+                    or (self.max_jobs is not None
+                        and remaining > self.max_jobs)):
+                break
+            evict.append(working_dir)
+            total_size -= status.size or 0
+            remaining -= 1
+
+        return evict
+
+
+class GarbageCollector(Thread):
+    """
+    Background thread that periodically calls collect on the manager.
+    """
+
+    def __init__(self, manager, interval):
+        super(GarbageCollector, self).__init__(name='GarbageCollector')
+        self.daemon = True
+        self.manager = manager
+        self.interval = interval
+        self.stopped = Event()
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            try:
+                self.manager.collect()
+            except Exception:
+                logger.exception('error collecting working directories')
+
+    def stop(self):
+        self.stopped.set()
+        if self.is_alive():
+            self.join()
@@ -3,10 +3,51 @@
 Sanic implementation
 """
 
+import asyncio
+import json
+import logging
+import re
+
 from sanic import response
 from sanic import Blueprint
 
+from collections import OrderedDict
+from contextlib import contextmanager
+from inspect import isawaitable
+from mimetypes import guess_type
+from os import fstat
+from os import getpid
+from os import kill
+from os.path import isdir
+from os.path import join
 from random import getrandbits
+from shutil import rmtree
+from time import time
+from urllib.parse import quote
+from urllib.parse import urlencode
+from urllib.parse import urlsplit
+
+from .manager import QUEUED
+from .manager import RUNNING
+from .manager import SUCCESS
+from .manager import FAILURE
+from .manager import FAILED
+from .manager import KILLED
+from .manager import TIMEOUT
+from .manager import CANCELLED
+from .manager import EVICTED
+from .archive import FORMATS
+from .compress import ENCODERS
+from .compress import negotiate
+from .metrics import JobMetrics
+from .records import JobIndex
+from .upload import UploadError
+from .upload import create_reader
+
+logger = logging.getLogger(__name__)
+
+# a Range header for a single range of bytes.
+BYTE_RANGE = re.compile(r'^\s*bytes\s*=\s*([0-9]*)-([0-9]*)\s*$')
 
 
 class JobServer(object):
@@ -20,50 +61,885 @@ class JobServer(object):
     above.
     """
 
+    # size of the chunks used for streaming results.
+    chunk_size = 65536
+    # number of evicted job_ids remembered for reporting as gone.
+    max_evicted = 65536
+    # the most jobs that may be submitted or polled in one batch.
+    max_batch = 1000
+    # seconds between the reads of a log that is being followed.
+    log_interval = 0.25
+    # seconds a log of a finished job is followed for without new
+    # output before giving up on it being closed.
+    log_grace = 1.0
+    # the field a raw body posted to the upload route is uploaded as.
+    upload_field = 'input'
+    # the bytes of an upload gathered before they are written out.
+    upload_batch_size = 262144
+    # the default and the most jobs listed in one page.
+    page_size = 100
+    max_page_size = 1000
+
     def __init__(
             self, job_manager,
             base_url='/',
             route_execute='execute',
             route_poll='poll',
-            name=None, hook_start_stop=True):
+            route_stream='stream',
+            route_metrics='metrics',
+            route_batch='batch',
+            route_archive='archive',
+            route_logs='logs',
+            route_upload='upload',
+            route_jobs='jobs',
+            encodings=None,
+            name=None, hook_start_stop=True,
+            max_wait=60, keepalive=15, store=None, shared=False,
+            shared_interval=0.25, metrics=None, admission=None,
+            max_upload_size=None):
         """
         Takes in a subclass of job_manager, and provide some standard
-        ways of interfacing with it.
+        ways of interfacing with it through the routes of the blueprint,
+        each at the path given by its route_ argument.
         """
 
+        if shared and store is None:
+            raise ValueError('shared mode requires a store')
+
         self.job_manager = job_manager
         self.base_url = base_url
         self.route_execute = route_execute
         self.route_poll = route_poll
+        self.route_stream = route_stream
+        self.route_metrics = route_metrics
+        self.route_batch = route_batch
+        self.route_archive = route_archive
+        self.route_logs = route_logs
+        self.route_upload = route_upload
+        self.route_jobs = route_jobs
+        # the content encodings the results may be served compressed
+        # with, the most preferred first (default is all available).
+        self.encodings = list(ENCODERS) if encodings is None else encodings
+        # the most seconds a long-poll request may wait for, and the
+        # seconds between the comments sent down idle event streams.
+        self.max_wait = max_wait
+        self.keepalive = keepalive
+        # the JobStore the jobs are registered with and restored from on
+        # start, which requires a persistent root for the job_manager.
+        self.store = store
+        # whether the store shares the jobs with the other processes of
+        # the app, with the job_ids prefixed by the owning process and
+        # the jobs of the others polled every shared_interval seconds.
+        self.shared = shared
+        self.shared_interval = shared_interval
+        # the JobMetrics exposed through the metrics route.
+        self.metrics = JobMetrics() if metrics is None else metrics
+        # the AdmissionControl the submitted jobs must pass first.
+        self.admission = admission
+        # the most bytes of an upload, on top of the REQUEST_MAX_SIZE of
+        # sanic.
+        self.max_upload_size = max_upload_size
+        self.worker_id = None
+        # working_dir to the set of (loop, asyncio.Event) for requests
+        # that are waiting on a state transition of that job.
+        self.waiters = {}
         self.name = name or '%s_%d' % (__name__, id(self))
         self.blueprint = Blueprint(self.name)
         self.setup(hook_start_stop)
 
     def start(self, sanic, loop):
-        self.job_manager.start()
-        self.mapping = {}
+        # the server process may be forked from where this was created.
+        self.worker_id = '%x' % getpid()
+        # the JobRecords of the jobs by their job_id, and the reverse.
+        self.records = JobIndex()
+        self.job_ids = {}
+        # working_dir to the job_ids of its upstream jobs.
+        self.dependencies = {}
+        self.evicted = OrderedDict()
+        if self._transition not in self.job_manager.callbacks:
+            self.job_manager.subscribe(self._transition)
+        if self.metrics not in self.job_manager.callbacks:
+            self.job_manager.subscribe(self.metrics)
+        if self.admission is not None and (
+                self.admission not in self.job_manager.callbacks):
+            self.job_manager.subscribe(self.admission)
+        result = self.job_manager.start()
+        if self.store is not None:
+            self.store.open()
+            self._restore()
+        return result
+
+    def _restore(self):
+        """
+        Restore the jobs from the store.  As the exit status for jobs
+        started by a previous process cannot be collected, the ones not
+        finished are marked as failed.
+        """
+
+        # in the order they were submitted, for the records.
+        for job_id, working_dir, status in sorted(
+                self.store.load(), key=lambda job: job[2].submitted):
+            if self.shared and self._owned_elsewhere(job_id):
+                continue
+            if not isdir(working_dir):
+                self.store.delete(job_id)
+                continue
+            if status.state in (QUEUED, RUNNING):
+                logger.warning(
+                    'job %s was orphaned by a restart; marking as failed',
+                    job_id)
+                status.state = FAILURE
+                status.finished = time()
+                self.store.put(job_id, working_dir, status)
+            self.job_manager.restore(working_dir, status)
+            self.job_ids[working_dir] = job_id
+            self.records.add(job_id, working_dir, status)
 
     def stop(self, sanic, loop):
-        self.job_manager.stop()
-        self.mapping.clear()
+        # the result is returned such that sanic will await on it for
+        # managers with coroutine stop methods.
+        self.records.clear()
+        self.job_ids.clear()
+        self.dependencies.clear()
+        self.evicted.clear()
+        if self._transition in self.job_manager.callbacks:
+            self.job_manager.unsubscribe(self._transition)
+        if self.metrics in self.job_manager.callbacks:
+            self.job_manager.unsubscribe(self.metrics)
+        if self.admission in self.job_manager.callbacks:
+            self.job_manager.unsubscribe(self.admission)
+        if self.store is not None:
+            self.store.close()
+        return self.job_manager.stop()
+
+    def _transition(self, working_dir, status):
+        # this may be called from the job manager's threads.
+        if status.state == EVICTED:
+            self._forget(working_dir)
+        else:
+            job_id = self.job_ids.get(working_dir)
+            if job_id is not None:
+                self.records.update(job_id, status)
+                if self.store is not None:
+                    self.store.put(job_id, working_dir, status)
+        for loop, event in list(self.waiters.get(working_dir, ())):
+            try:
+                loop.call_soon_threadsafe(event.set)
+            except RuntimeError:
+                # the loop has been closed.
+                pass
+
+    def _forget(self, working_dir):
+        self.dependencies.pop(working_dir, None)
+        job_id = self.job_ids.pop(working_dir, None)
+        if job_id is None:
+            return
+        self.records.remove(job_id)
+        if self.store is not None:
+            self.store.delete(job_id)
+        self._evicted(job_id)
+
+    def _evicted(self, job_id):
+        self.evicted[job_id] = None
+        while len(self.evicted) > self.max_evicted:
+            self.evicted.popitem(last=False)
+
+    def _owned_elsewhere(self, job_id):
+        """
+        Return whether the job_id was generated by another server
+        process that is still running.
+        """
+
+        worker_id, sep, _ = job_id.partition('-')
+        if not sep or worker_id == self.worker_id:
+            return False
+        try:
+            kill(int(worker_id, 16), 0)
+        except (ValueError, ProcessLookupError):
+            return False
+        except PermissionError:
+            pass
+        return True
+
+    def _lookup(self, job_id):
+        """
+        Return the working_dir for the job_id, or None.
+        """
+
+        record = self.records.get(job_id)
+        working_dir = None if record is None else record.working_dir
+        if working_dir is None and self.shared:
+            record = self.store.get(job_id)
+            if record is not None:
+                working_dir = record[0]
+        return working_dir
+
+    def _missing_result(self, job_id):
+        # the response body and status for a job_id without a
+        # working_dir.
+        if job_id in self.evicted:
+            return {'status': EVICTED, 'error': 'job has been evicted'}, 410
+        return {'error': 'no such job_id'}, 404
+
+    def _missing(self, job_id):
+        obj, status = self._missing_result(job_id)
+        return self._response(obj, status=status)
+
+    def _register(self, working_dir):
+        """
+        Return the job_id for the working_dir returned by the manager,
+        and whether it was newly created rather than memoized.
+        """
+
+        job_id = self.job_ids.get(working_dir)
+        if job_id is not None:
+            return job_id, False
+        job_id = self._generate_job_id()
+        status = self.job_manager.status.get(working_dir)
+        if status is None:
+            # already evicted.
+            self._evicted(job_id)
+            return job_id, True
+        # set first, such that the transitions from this point on are
+        # indexed.
+        self.job_ids[working_dir] = job_id
+        self.records.add(job_id, working_dir, status)
+        if self.store is not None:
+            self.store.put(job_id, working_dir, status)
+        return job_id, True
+
+    def _list_args(self, request):
+        """
+        Return the states, the cursor and the limit for the listing of
+        the jobs from the arguments of the request, or raise ValueError.
+        """
+
+        states = None
+        if request.args.get('state'):
+            states = []
+            for state in request.args.get('state').split(','):
+                state = state.strip()
+                if state == 'failed':
+                    states.extend(FAILED)
+                elif state in (QUEUED, RUNNING, SUCCESS) + FAILED:
+                    states.append(state)
+                else:
+                    raise ValueError('invalid state %r' % state)
+        try:
+            after = request.args.get('after')
+            after = None if after is None else int(after)
+        except ValueError:
+            raise ValueError('invalid cursor')
+        try:
+            limit = int(request.args.get('limit', self.page_size))
+        except ValueError:
+            raise ValueError('invalid limit')
+        if not 0 < limit <= self.max_page_size:
+            raise ValueError(
+                'limit must be between 1 and %d' % self.max_page_size)
+        return states, after, limit
+
+    def _load_batch(self, request):
+        """
+        Return the JSON array from the body of the request, or raise
+        ValueError.
+        """
+
+        try:
+            batch = json.loads(request.body.decode('utf8'))
+        except ValueError:
+            raise ValueError('request body must be a JSON array')
+        if not isinstance(batch, list):
+            raise ValueError('request body must be a JSON array')
+        if not batch:
+            raise ValueError('batch is empty')
+        if len(batch) > self.max_batch:
+            raise ValueError(
+                'batch exceeds the maximum of %d' % self.max_batch)
+        return batch
+
+    def _admit(self, request, count=1):
+        """
+        Return the client key the count jobs of the request are admitted
+        for, and the response rejecting them or None.
+        """
+
+        admission = self.admission
+        if admission is None:
+            return None, None
+        key = None
+        if admission.key_header:
+            key = request.headers.get(admission.key_header)
+        if not key:
+            key = request.ip
+        manager = self.job_manager
+        rejection = admission.admit(key, len(manager.running) + len(
+            manager.queued) + len(manager.waiting), count)
+        if rejection is None:
+            return key, None
+        headers = {}
+        if rejection.retry_after is not None:
+            headers['Retry-After'] = str(rejection.retry_after)
+        return key, self._error(
+            error_msg=rejection.message, status=rejection.status,
+            headers=headers)
+
+    def _settle(self, key, count, working_dirs):
+        """
+        Bind the jobs admitted for the client to the working_dirs they
+        were submitted as, releasing the rest.
+        """
+
+        if self.admission is None:
+            return
+        bound = 0
+        for working_dir in working_dirs:
+            status = self.job_manager.status.get(working_dir)
+            if status is not None:
+                self.admission.bind(key, working_dir, status)
+                bound += 1
+        self.admission.release(key, count - bound)
+
+    async def _execute(self, request):
+        """
+        Run the job for the execute request; return its working_dir and
+        None, or None and the error response.
+        """
+
+        try:
+            kwargs = self.job_manager.verify_run_kwargs(
+                **dict(request.form))
+        except ValueError as e:
+            return None, self._error(error_msg=str(e))
+
+        after = request.args.get('after')
+        if not after:
+            working_dir = self.job_manager.run(**kwargs)
+            if isawaitable(working_dir):
+                working_dir = await working_dir
+            return working_dir, None
+
+        try:
+            job_ids, upstream = self._resolve_upstream(after)
+        except ValueError as e:
+            return None, self._error(error_msg=str(e))
+        try:
+            working_dir = self.job_manager.run_after(upstream, **kwargs)
+            if isawaitable(working_dir):
+                working_dir = await working_dir
+        except KeyError:
+            # evicted in the meantime.
+            return None, self._error(
+                error_msg='upstream job has been evicted')
+        self.dependencies[working_dir] = job_ids
+        return working_dir, None
+
+    async def _read_chunk(self, request):
+        # the stream is a queue before sanic 19.
+        stream = request.stream
+        if hasattr(stream, 'read'):
+            return await stream.read()
+        return await stream.get()
+
+    async def _in_executor(self, fn, *a):
+        # should the request go away, the call is still waited on, such
+        # that what it works on is only cleaned up once it is done.
+        future = asyncio.get_event_loop().run_in_executor(None, fn, *a)
+        try:
+            return await asyncio.shield(future)
+        except asyncio.CancelledError:
+            await asyncio.wait([future])
+            raise
+
+    async def _read_upload(self, request, reader):
+        """
+        Feed the streamed body of the request to the reader in batches
+        of upload_batch_size bytes, and return the fields read.
+        """
+
+        # the files of the upload are written off the loop.
+        size = 0
+        batch = []
+        batched = 0
+        while True:
+            chunk = await self._read_chunk(request)
+            if chunk is not None:
+                size += len(chunk)
+                if self.max_upload_size is not None and (
+                        size > self.max_upload_size):
+                    raise UploadError('upload too large', 413)
+                batch.append(chunk)
+                batched += len(chunk)
+                if batched < self.upload_batch_size:
+                    continue
+            if batch:
+                await self._in_executor(reader.feed, b''.join(batch))
+                batch = []
+                batched = 0
+            if chunk is None:
+                break
+        return await self._in_executor(reader.close)
+
+    async def _upload(self, request):
+        """
+        Run the job for the streamed upload request; return its
+        working_dir and None, or None and the error response.
+        """
+
+        length = request.headers.get('Content-Length')
+        if self.max_upload_size is not None and length and (
+                length.isdigit() and int(length) > self.max_upload_size):
+            return None, self._error(error_msg='upload too large', status=413)
+        job_ids = upstream = None
+        after = request.args.get('after')
+        if after:
+            try:
+                job_ids, upstream = self._resolve_upstream(after)
+            except ValueError as e:
+                return None, self._error(error_msg=str(e))
+
+        manager = self.job_manager
+        working_dir = manager.create_working_dir()
+        fields = {
+            name: list(values) for name, values in request.args.items()
+            if name != 'after'
+        }
+        reader = None
+        try:
+            reader = await self._in_executor(
+                create_reader,
+                request.headers.get('Content-Type'),
+                join(working_dir, manager.inputs_dir),
+                self.upload_field, fields,
+            )
+            kwargs = manager.verify_run_kwargs(
+                **(await self._read_upload(request, reader)))
+        except UploadError as e:
+            self._discard_upload(working_dir, reader)
+            return None, self._error(error_msg=str(e), status=e.status)
+        except ValueError as e:
+            self._discard_upload(working_dir, reader)
+            return None, self._error(error_msg=str(e))
+        except BaseException:
+            # including the client going away midway.
+            self._discard_upload(working_dir, reader)
+            raise
+
+        try:
+            if upstream is None:
+                result = manager.execute(working_dir=working_dir, **kwargs)
+            else:
+                result = manager.execute_after(
+                    working_dir, upstream, **kwargs)
+            if isawaitable(result):
+                await result
+        except KeyError:
+            rmtree(working_dir, ignore_errors=True)
+            # evicted in the meantime.
+            return None, self._error(
+                error_msg='upstream job has been evicted')
+        if upstream is not None:
+            self.dependencies[working_dir] = job_ids
+        return working_dir, None
+
+    def _discard_upload(self, working_dir, reader):
+        if reader is not None:
+            reader.abort()
+        rmtree(working_dir, ignore_errors=True)
+
+    def _created(self, working_dir):
+        """
+        The response for the job submitted as the working_dir.
+        """
+
+        job_id, created = self._register(working_dir)
+        if created and self.shared:
+            # other processes must be able to find it right away
+            self.store.flush()
+        return self._response(
+            {
+                'status': 'created',
+                'location': '/%s/%s' % (self.route_poll, job_id),
+            },
+            headers={
+                'Location': '/%s/%s' % (self.route_poll, job_id),
+            },
+            status=201 if created else 200,
+        )
+
+    def _poll(self, job_id, working_dir):
+        if working_dir in self.job_manager.status:
+            try:
+                return self.job_manager.poll(working_dir)
+            except KeyError:
+                # the job was evicted while being served.
+                return EVICTED
+        if self.shared:
+            record = self.store.get(job_id)
+            if record is not None:
+                return record[1].state
+        return EVICTED
+
+    @contextmanager
+    def _waiter(self, working_dir):
+        """
+        Provide an asyncio.Event that will be set on every state
+        transition of the job at working_dir.
+        """
+
+        waiter = (asyncio.get_event_loop(), asyncio.Event())
+        waiters = self.waiters.setdefault(working_dir, set())
+        waiters.add(waiter)
+        try:
+            yield waiter[1]
+        finally:
+            waiters.discard(waiter)
+            if not waiters:
+                self.waiters.pop(working_dir, None)
+
+    async def _wait_transition(self, job_id, working_dir, state, timeout):
+        """
+        Wait up to timeout seconds for the job to transition out of the
+        state, if it is still pending; return the resulting state.
+        """
+
+        if state not in (QUEUED, RUNNING):
+            return self._poll(job_id, working_dir)
+
+        if working_dir not in self.job_manager.status:
+            # owned by another server process, so poll the store.
+            loop = asyncio.get_event_loop()
+            deadline = loop.time() + timeout
+            current = self._poll(job_id, working_dir)
+            while current == state and loop.time() < deadline:
+                await asyncio.sleep(
+                    min(self.shared_interval, deadline - loop.time()))
+                current = self._poll(job_id, working_dir)
+            return current
+
+        with self._waiter(working_dir) as event:
+            if self._poll(job_id, working_dir) == state:
+                try:
+                    await asyncio.wait_for(event.wait(), timeout)
+                except asyncio.TimeoutError:
+                    pass
+        return self._poll(job_id, working_dir)
+
+    def _resolve_upstream(self, after):
+        """
+        Return the distinct comma-separated job_ids and their
+        working_dirs, or raise ValueError if any of them is not a job of
+        this process.
+        """
+
+        job_ids = tuple(OrderedDict.fromkeys(
+            job_id.strip() for job_id in after.split(',')))
+        upstream = []
+        for job_id in job_ids:
+            record = self.records.get(job_id)
+            working_dir = None if record is None else record.working_dir
+            if working_dir not in self.job_manager.status:
+                raise ValueError('no such upstream job_id %r' % job_id)
+            upstream.append(working_dir)
+        return job_ids, upstream
+
+    def _dag_result(self, working_dir):
+        """
+        Return the report of the upstream jobs of the job, if any.
+        """
+
+        job_ids = self.dependencies.get(working_dir)
+        if not job_ids:
+            return None
+        status = self.job_manager.status.get(working_dir)
+        result = {
+            'upstream': {
+                job_id: self._poll(job_id, self._lookup(job_id))
+                for job_id in job_ids
+            },
+        }
+        if status is not None and status.blocked_by is not None:
+            result['blocked_by'] = job_ids[
+                status.upstream.index(status.blocked_by)]
+        return result
+
+    def _poll_result(self, working_dir, state):
+        """
+        Return the response body and status code for the job at the
+        working_dir with the state, along with the report of its
+        upstream jobs.
+        """
+
+        obj, status = self._state_result(working_dir, state)
+        dag = self._dag_result(working_dir)
+        if dag is not None:
+            obj['dag'] = dag
+        return obj, status
+
+    def _state_result(self, working_dir, state):
+        if state in (QUEUED, RUNNING):
+            return {'status': state}, 200
+        elif state == FAILURE:
+            return {
+                'status': 'failure',
+                'error': 'job execution terminated with an error',
+            }, 400
+        elif state == KILLED:
+            return {
+                'status': KILLED,
+                'error': 'job was killed for exceeding its resource limits',
+            }, 400
+        elif state == TIMEOUT:
+            return {
+                'status': TIMEOUT,
+                'error': 'job was killed for exceeding its time limit',
+            }, 400
+        elif state == CANCELLED:
+            return {
+                'status': CANCELLED,
+                'error': 'job has been cancelled',
+            }, 410
+        elif state == EVICTED:
+            return {
+                'status': EVICTED,
+                'error': 'job has been evicted',
+            }, 410
+        else:
+            return {
+                'status': 'success',
+                'keys': self.job_manager.list_result_keys(working_dir),
+            }, 200
+
+    async def _write(self, stream, data):
+        # the write method became a coroutine in later versions of sanic
+        result = stream.write(data)
+        if isawaitable(result):
+            await result
+
+    def _etag(self, stat):
+        return '"%x-%x-%x"' % (stat.st_ino, stat.st_size, stat.st_mtime_ns)
+
+    def _parse_range(self, header, size):
+        """
+        Parse the value of a Range header for a single range of bytes,
+        returning the (start, stop) offsets, or None if the header is to
+        be ignored, as it is when it is not valid (or is for other
+        units, or many ranges).  Raises ValueError for a valid range
+        that is not satisfiable.
+        """
+
+        match = BYTE_RANGE.match(header)
+        if match is None:
+            return None
+        first, last = match.groups()
+        if not first:
+            if not last:
+                return None
+            # suffix range, i.e. the last n bytes.
+            start, stop = max(size - int(last), 0), size
+            if int(last) == 0:
+                raise ValueError('range not satisfiable')
+        else:
+            start = int(first)
+            if last and int(last) < start:
+                return None
+            stop = min(int(last) + 1, size) if last else size
+        if start >= stop:
+            raise ValueError('range not satisfiable')
+        return start, stop
+
+    def _file_response(self, request, fd, filename, headers=None):
+        """
+        Generate the streamed response for the file object, with support
+        for conditional requests through ETag and byte ranges.
+        """
+
+        stat = fstat(fd.fileno())
+        etag = self._etag(stat)
+        headers = dict(headers or {})
+        headers.update({'ETag': etag, 'Accept-Ranges': 'bytes'})
+
+        if_none_match = request.headers.get('If-None-Match')
+        if if_none_match and (if_none_match.strip() == '*' or etag in (
+                tag.strip().replace('W/', '', 1)
+                for tag in if_none_match.split(','))):
+            fd.close()
+            return response.HTTPResponse(status=304, headers=headers)
+
+        start, stop = 0, stat.st_size
+        status = 200
+        range_header = request.headers.get('Range')
+        if range_header:
+            try:
+                byte_range = self._parse_range(range_header, stat.st_size)
+            except ValueError:
+                fd.close()
+                headers['Content-Range'] = 'bytes */%d' % stat.st_size
+                return self._error(
+                    error_msg='requested range not satisfiable',
+                    status=416, headers=headers)
+            if byte_range:
+                start, stop = byte_range
+                status = 206
+                headers['Content-Range'] = 'bytes %d-%d/%d' % (
+                    start, stop - 1, stat.st_size)
+
+        async def streaming_fn(stream):
+            with fd:
+                fd.seek(start)
+                remaining = stop - start
+                while remaining > 0:
+                    chunk = fd.read(min(self.chunk_size, remaining))
+                    if not chunk:
+                        break
+                    remaining -= len(chunk)
+                    await self._write(stream, chunk)
+
+        return response.stream(
+            streaming_fn, status=status, headers=headers,
+            content_type=guess_type(filename)[0] or 'application/octet-stream')
+
+    async def _stream_events(self, job_id, working_dir, stream):
+        """
+        Write the state of the job to the stream as server-sent events
+        as it transitions, until the job is finished.
+        """
+
+        state = self._poll(job_id, working_dir)
+        while True:
+            obj, status = self._poll_result(working_dir, state)
+            await self._write(stream, 'event: %s\ndata: %s\n\n' % (
+                state, json.dumps(obj)))
+            if state not in (QUEUED, RUNNING):
+                break
+            current = await self._wait_transition(
+                job_id, working_dir, state, self.keepalive)
+            while current == state:
+                await self._write(stream, ': keepalive\n\n')
+                current = await self._wait_transition(
+                    job_id, working_dir, state, self.keepalive)
+            state = current
+
+    async def _follow_log(self, job_id, working_dir, name, offset, stream):
+        """
+        Write the log to the stream from the offset as it is written,
+        until it is closed.
+        """
+
+        loop = asyncio.get_event_loop()
+        idle_since = None
+        while True:
+            try:
+                data, start, closed = self.job_manager.read_log(
+                    working_dir, name, offset, self.chunk_size)
+            except KeyError:
+                # not yet created for a queued job, or evicted.
+                data, start, closed = b'', offset, False
+            if data:
+                await self._write(stream, data)
+                offset = start + len(data)
+                idle_since = None
+                continue
+            if closed:
+                break
+            if self._poll(job_id, working_dir) not in (QUEUED, RUNNING):
+                # the remaining output may still be drained for a while
+                # after the job has finished.
+                if idle_since is None:
+                    idle_since = loop.time()
+                elif loop.time() - idle_since >= self.log_grace:
+                    break
+            await asyncio.sleep(self.log_interval)
+
+    async def _proxy(self, url, headers=None):
+        """
+        Stream the response for a GET of the url from an executor agent,
+        whose responses are delimited by the closing of the connection.
+        The headers are added to a successful response.
+        """
+
+        parts = urlsplit(url)
+        try:
+            reader, writer = await asyncio.open_connection(
+                parts.hostname, parts.port)
+        except OSError:
+            return self._error(error_msg='agent is unavailable', status=502)
+        writer.write((
+            'GET %s HTTP/1.0\r\nHost: %s\r\n\r\n' % (
+                parts.path + ('?' + parts.query if parts.query else ''),
+                parts.netloc)).encode('latin1'))
+        try:
+            status = int((await reader.readline()).split()[1])
+            received = {}
+            while True:
+                line = (await reader.readline()).decode('latin1')
+                if not line.strip():
+                    break
+                name, _, value = line.partition(':')
+                received[name.strip().lower()] = value.strip()
+        except (IndexError, ValueError, OSError):
+            writer.close()
+            return self._error(error_msg='agent is unavailable', status=502)
+
+        async def streaming_fn(stream):
+            try:
+                while True:
+                    chunk = await reader.read(self.chunk_size)
+                    if not chunk:
+                        break
+                    await self._write(stream, chunk)
+            finally:
+                writer.close()
+
+        return response.stream(
+            streaming_fn, status=status,
+            headers=dict(headers or {}) if status == 200 else {},
+            content_type=received.get(
+                'content-type', 'application/octet-stream'))
+
+    async def _cancel(self, job_id, working_dir):
+        """
+        Cancel the job, or remove it if it has finished.
+        """
+
+        if working_dir not in self.job_manager.status:
+            if self.shared and self._owned_elsewhere(job_id):
+                return self._error(
+                    error_msg='job is owned by another server process',
+                    status=409)
+            return self._missing(job_id)
+        try:
+            cancelled = self.job_manager.cancel(working_dir)
+            if isawaitable(cancelled):
+                cancelled = await cancelled
+        except KeyError:
+            return self._missing(job_id)
+        if cancelled:
+            return self._report(status_msg=CANCELLED, status=202)
+        return self._report(status_msg='deleted', status=202)
 
     def _response(self, obj, **kwargs):
         return response.json(obj, **kwargs)
 
-    def _report(self, error_msg=None, status_msg=None, status=200):
+    def _report(
+            self, error_msg=None, status_msg=None, status=200, **kwargs):
         # shorthand to generate the standardized responses.
         response = {}
         if error_msg:
             response['error'] = error_msg
         if status_msg:
             response['status'] = status_msg
-        return self._response(response, status=status)
+        return self._response(response, status=status, **kwargs)
 
-    def _error(self, error_msg=None, status_msg=None, status=400):
+    def _error(
+            self, error_msg=None, status_msg=None, status=400, **kwargs):
         return self._report(
-            error_msg=error_msg, status_msg=status_msg, status=status)
+            error_msg=error_msg, status_msg=status_msg, status=status,
+            **kwargs)
 
     def _generate_job_id(self):
+        if self.shared:
+            return '%s-%032x' % (self.worker_id, getrandbits(128))
         return '%032x' % getrandbits(128)
 
     def setup(self, hook_start_stop=True):
@@ -83,70 +959,335 @@ class JobServer(object):
         route_execute = '/%s' % self.route_execute
         route_poll = '/%s/<job_id:string>' % self.route_poll
         route_poll_result = '%s/<key:string>' % route_poll
+        route_stream = '/%s/<job_id:string>' % self.route_stream
+        route_metrics = '/%s' % self.route_metrics
+        route_batch = '/%s' % self.route_batch
+        route_archive = '/%s/<job_id:string>' % self.route_archive
+        route_logs = '/%s/<job_id:string>/<name:string>' % self.route_logs
+        route_upload = '/%s' % self.route_upload
+        route_batch_poll = '%s/%s' % (route_batch, self.route_poll)
+        route_jobs = '/%s' % self.route_jobs
 
         @blueprint.route(route_execute, methods=['POST'])
         async def execute(request):
             """
-            The post end point for starting a job
+            The post end point for starting a job; the comma-separated
+            job_ids given as the after argument are the upstream jobs it
+            is only started after (see JobManager.enqueue_after).
+            """
+
+            key, rejected = self._admit(request)
+            if rejected is not None:
+                return rejected
+            working_dirs = []
+            try:
+                working_dir, error = await self._execute(request)
+                if error is not None:
+                    return error
+                working_dirs.append(working_dir)
+            finally:
+                self._settle(key, 1, working_dirs)
+            return self._created(working_dir)
+
+        @blueprint.route(route_upload, methods=['POST'], stream=True)
+        async def upload(request):
+            """
+            The post end point for starting a job with streamed inputs,
+            a multipart/form-data body or a raw body uploaded as the
+            upload_field; the files are written into the inputs_dir of
+            the job and passed to verify_run_kwargs as lists of Upload.
+            """
+
+            key, rejected = self._admit(request)
+            if rejected is not None:
+                return rejected
+            working_dirs = []
+            try:
+                working_dir, error = await self._upload(request)
+                if error is not None:
+                    return error
+                working_dirs.append(working_dir)
+            finally:
+                self._settle(key, 1, working_dirs)
+            return self._created(working_dir)
+
+        @blueprint.route(route_batch, methods=['POST'])
+        async def batch(request):
+            """
+            The post end point for starting many jobs at once, from a
+            JSON array of their kwargs
             """
 
             try:
-                kwargs = self.job_manager.verify_run_kwargs(
-                    **dict(request.form))
+                specs = self._load_batch(request)
             except ValueError as e:
                 return self._error(error_msg=str(e))
 
-            working_dir = self.job_manager.run(**kwargs)
-            job_id = self._generate_job_id()
-            self.mapping[job_id] = working_dir
-            return self._response(
-                {
-                    'status': 'created',
-                    'location': '/%s/%s' % (self.route_poll, job_id),
-                },
-                headers={
-                    'Location': '/%s/%s' % (self.route_poll, job_id),
-                },
-                status=201,
-            )
+            key, rejected = self._admit(request, len(specs))
+            if rejected is not None:
+                return rejected
+            working_dirs = []
+            try:
+                batch = []
+                for idx, spec in enumerate(specs):
+                    if not isinstance(spec, dict):
+                        return self._error(
+                            error_msg='job %d: must be a JSON object' % idx)
+                    try:
+                        batch.append(self.job_manager.verify_run_kwargs(**{
+                            name: value if isinstance(value, list) else [
+                                value]
+                            for name, value in spec.items()
+                        }))
+                    except ValueError as e:
+                        return self._error(
+                            error_msg='job %d: %s' % (idx, e))
+
+                working_dirs = self.job_manager.run_batch(batch)
+                if isawaitable(working_dirs):
+                    working_dirs = await working_dirs
+            finally:
+                self._settle(key, len(specs), working_dirs)
+            job_ids = [
+                self._register(working_dir)[0]
+                for working_dir in working_dirs
+            ]
+            if self.shared:
+                self.store.flush()
+            return self._response({
+                'status': 'created',
+                'job_ids': job_ids,
+                'locations': [
+                    '/%s/%s' % (self.route_poll, job_id)
+                    for job_id in job_ids
+                ],
+            }, status=201)
+
+        @blueprint.route(route_batch_poll, methods=['POST'])
+        async def batch_poll(request):
+            """
+            The end point for polling the states of many jobs at once
+            """
+
+            try:
+                job_ids = self._load_batch(request)
+            except ValueError as e:
+                return self._error(error_msg=str(e))
+
+            jobs = {}
+            for job_id in job_ids:
+                if not isinstance(job_id, str):
+                    return self._error(error_msg='job_ids must be strings')
+                working_dir = self._lookup(job_id)
+                if working_dir is None:
+                    obj, status = self._missing_result(job_id)
+                else:
+                    obj, status = self._poll_result(
+                        working_dir, self._poll(job_id, working_dir))
+                jobs[job_id] = obj
+            return self._response({'jobs': jobs})
 
-        @blueprint.route(route_poll)
+        @blueprint.route(route_jobs)
+        async def jobs(request):
+            """
+            The end point for listing the jobs a page at a time in the
+            order they were submitted, optionally only those in the
+            comma-separated states (failed for all the failed ones); the
+            next cursor is the after argument for the following page.
+            """
+
+            try:
+                states, after, limit = self._list_args(request)
+            except ValueError as e:
+                return self._error(error_msg=str(e))
+            records, cursor = self.records.page(states, after, limit)
+            return self._response({
+                'jobs': [record.as_dict() for record in records],
+                'next': None if cursor is None else str(cursor),
+            })
+
+        @blueprint.route(route_poll, methods=['GET', 'DELETE'])
         async def poll(request, job_id):
-            if job_id not in self.mapping:
-                return self._error(error_msg='no such job_id', status=404)
-
-            # XXX whenever the API for dealing with the actual Popen
-            # objects (i.e. the actual polling) are done it should be
-            # used instead
-            working_dir = self.mapping[job_id]
-            process = self.job_manager.mapping[working_dir]
-            status = process.poll()
-
-            # TODO clean this up
-            if status is None:
-                return self._report(status_msg='running')
-            elif status != 0:
-                return self._error(
-                    status_msg='failure',
-                    error_msg='job execution terminated with an error',
-                )
-            else:
-                result = {'status': 'success'}
-                result['keys'] = self.job_manager.list_working_dir(
-                    working_dir)
-                return self._response(result)
+            working_dir = self._lookup(job_id)
+            if working_dir is None:
+                return self._missing(job_id)
+            if request.method == 'DELETE':
+                return await self._cancel(job_id, working_dir)
+
+            wait = request.args.get('wait')
+            state = self._poll(job_id, working_dir)
+            if wait:
+                try:
+                    wait = min(float(wait), self.max_wait)
+                except ValueError:
+                    return self._error(error_msg='invalid wait')
+                state = await self._wait_transition(
+                    job_id, working_dir, state, wait)
+
+            obj, status = self._poll_result(working_dir, state)
+            return self._response(obj, status=status)
+
+        @blueprint.route(route_stream)
+        async def stream(request, job_id):
+            working_dir = self._lookup(job_id)
+            if working_dir is None:
+                return self._missing(job_id)
+
+            async def streaming_fn(stream):
+                await self._stream_events(job_id, working_dir, stream)
+
+            return response.stream(
+                streaming_fn, content_type='text/event-stream',
+                headers={'Cache-Control': 'no-cache'})
 
         @blueprint.route(route_poll_result)
         async def results(request, job_id, key):
-            if job_id not in self.mapping:
-                return self._error(error_msg='no such job_id', status=404)
+            working_dir = self._lookup(job_id)
+            if working_dir is None:
+                return self._missing(job_id)
+
+            url = self.job_manager.remote_url(
+                working_dir, '/results/' + quote(key))
+            if url is not None:
+                return await self._proxy(url)
+
+            headers = {'Vary': 'Accept-Encoding'}
+            encoding = negotiate(
+                request.headers.get('Accept-Encoding'), self.encodings)
+            fd = None
+            if encoding is not None:
+                # compressed off the loop, as that may take a while on
+                # the first request.
+                try:
+                    fd = await asyncio.get_event_loop().run_in_executor(
+                        None, self.job_manager.open_compressed_result,
+                        working_dir, key, encoding)
+                except KeyError:
+                    return self._error(
+                        error_msg='no such key for job', status=404)
+                except OSError:
+                    logger.warning(
+                        'failed to compress %s for job %s', key, job_id,
+                        exc_info=True)
+                if fd is not None:
+                    headers['Content-Encoding'] = encoding
+
+            if fd is None:
+                try:
+                    fd = self.job_manager.open_result(working_dir, key)
+                except KeyError:
+                    return self._error(
+                        error_msg='no such key for job', status=404)
+            return self._file_response(request, fd, key, headers=headers)
+
+        @blueprint.route(route_archive)
+        async def archive(request, job_id):
+            """
+            The end point for all the results of a finished job as an
+            archive in the format argument, optionally only the keys
+            matching the glob argument
+            """
+
+            working_dir = self._lookup(job_id)
+            if working_dir is None:
+                return self._missing(job_id)
 
-            working_dir = self.mapping[job_id]
-            target = self.job_manager.lookup_path(working_dir, key)
-            if target is None:
+            fmt = request.args.get('format', 'tar.gz')
+            if fmt not in FORMATS:
+                return self._error(error_msg='unsupported archive format')
+            state = self._poll(job_id, working_dir)
+            if state in (QUEUED, RUNNING):
                 return self._error(
-                    error_msg='no such key for job', status=404)
-            return await response.file(target)
+                    status_msg=state, error_msg='job has not finished',
+                    status=409)
+            generate, extension, content_type = FORMATS[fmt]
+            headers = {
+                'Content-Disposition': 'attachment; filename="%s%s"' % (
+                    job_id, extension),
+            }
+            glob = request.args.get('glob')
+            query = {'format': fmt}
+            if glob is not None:
+                query['glob'] = glob
+            url = self.job_manager.remote_url(
+                working_dir, '/archive?' + urlencode(query))
+            if url is not None:
+                return await self._proxy(url, headers)
+
+            try:
+                entries = self.job_manager.list_result_files(
+                    working_dir, glob)
+            except KeyError:
+                obj, status = self._poll_result(working_dir, EVICTED)
+                return self._response(obj, status=status)
+
+            async def streaming_fn(stream):
+                # produced (and compressed) off the loop.
+                chunks = generate(entries, self.chunk_size)
+                try:
+                    while True:
+                        chunk = await self._in_executor(next, chunks, None)
+                        if chunk is None:
+                            break
+                        await self._write(stream, chunk)
+                finally:
+                    chunks.close()
+
+            return response.stream(
+                streaming_fn, content_type=content_type, headers=headers)
+
+        @blueprint.route(route_logs)
+        async def logs(request, job_id, name):
+            """
+            The end point for the captured output of a job from the
+            offset argument (negative is from the end), or followed as
+            the job runs; X-Log-Offset is the offset of the first byte.
+            """
+
+            working_dir = self._lookup(job_id)
+            if working_dir is None:
+                return self._missing(job_id)
+
+            try:
+                offset = int(request.args.get('offset', 0))
+            except ValueError:
+                return self._error(error_msg='invalid offset')
+            follow = bool(request.args.get('follow'))
+            try:
+                data, start, closed = self.job_manager.read_log(
+                    working_dir, name, offset, self.chunk_size)
+            except KeyError:
+                queued = (
+                    follow and name in self.job_manager.log_names
+                    and self._poll(job_id, working_dir) == QUEUED)
+                if not queued:
+                    return self._error(
+                        error_msg='no such log for job', status=404)
+                data, start, closed = b'', max(offset, 0), False
+
+            headers = {'X-Log-Offset': str(start), 'Cache-Control': 'no-cache'}
+            if not follow:
+                headers['X-Log-Closed'] = 'true' if closed else 'false'
+                return response.raw(
+                    data, headers=headers,
+                    content_type='text/plain; charset=utf-8')
+
+            async def streaming_fn(stream):
+                if data:
+                    await self._write(stream, data)
+                if not closed:
+                    await self._follow_log(
+                        job_id, working_dir, name, start + len(data), stream)
+
+            return response.stream(
+                streaming_fn, headers=headers,
+                content_type='text/plain; charset=utf-8')
+
+        @blueprint.route(route_metrics)
+        async def metrics(request):
+            return response.text(
+                self.metrics.render(self.job_manager, self.admission),
+                content_type='text/plain; version=0.0.4')
 
     def register(self, app):
         app.blueprint(self.blueprint)
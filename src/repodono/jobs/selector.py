@@ -0,0 +1,136 @@
+# -*- coding: utf-8 -*-
+"""
+Base for watching file descriptors from a background thread
+"""
+
+import os
+import selectors
+
+from threading import Lock
+from threading import Thread
+
+
+class SelectorThread(object):
+    """
+    Watch file descriptors for reading from a single background thread
+    that is started on demand.  The file descriptors are handed to the
+    thread through watch, and subclasses implement ready to handle the
+    keys of those that are ready, and release to dispose of those that
+    are no longer watched once closed.
+    """
+
+    # the name of the background thread.
+    name = 'SelectorThread'
+
+    def __init__(self):
+        self.lock = Lock()
+        self.thread = None
+        self.selector = None
+        self._additions = []
+        self._closing = False
+        self._draining = False
+        self._wakeup = None
+
+    def _start(self):
+        self.selector = selectors.DefaultSelector()
+        self._wakeup = os.pipe()
+        self.selector.register(self._wakeup[0], selectors.EVENT_READ)
+        self.thread = Thread(target=self._run, name=self.name)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def _wake(self):
+        os.write(self._wakeup[1], b'\0')
+
+    def watch(self, fd, data):
+        """
+        Watch the fd, registered with the data, from the thread.
+        """
+
+        with self.lock:
+            if self.thread is None:
+                self._start()
+            self._draining = False
+            self._additions.append((fd, data))
+            self._wake()
+
+    def ready(self, key):
+        """
+        Handle the key of a watched fd that is ready for reading; it
+        remains watched until unregistered from the selector.
+        """
+
+        raise NotImplementedError
+
+    def release(self, fd, data):
+        """
+        Dispose of the fd and its data, which are no longer watched.
+        """
+
+        raise NotImplementedError
+
+    def _run(self):
+        selector = self.selector
+        while True:
+            for key, mask in selector.select():
+                if key.fd != self._wakeup[0]:
+                    self.ready(key)
+                    continue
+
+                os.read(self._wakeup[0], 4096)
+                with self.lock:
+                    additions, self._additions = self._additions, []
+                    if self._closing:
+                        for fd, data in additions:
+                            self.release(fd, data)
+                        return
+                for fd, data in additions:
+                    selector.register(fd, selectors.EVENT_READ, data)
+
+            with self.lock:
+                if (self._draining and not self._closing
+                        and not self._additions
+                        and len(selector.get_map()) == 1):
+                    # only the wakeup pipe is left.
+                    self._teardown()
+                    return
+
+    def drain(self):
+        """
+        Stop the thread once the file descriptors being watched have all
+        been released, rather than releasing them as close does.
+        """
+
+        with self.lock:
+            if self.thread is None:
+                return
+            self._draining = True
+            self._wake()
+
+    def close(self):
+        """
+        Stop the thread; the remaining file descriptors are released.
+        """
+
+        with self.lock:
+            thread = self.thread
+            if thread is None:
+                return
+            self._closing = True
+            self._wake()
+        thread.join()
+
+        for key in list(self.selector.get_map().values()):
+            if key.fd != self._wakeup[0]:
+                self.release(key.fd, key.data)
+        self._teardown()
+
+    def _teardown(self):
+        self.selector.close()
+        os.close(self._wakeup[0])
+        os.close(self._wakeup[1])
+        self.thread = None
+        self.selector = None
+        self._wakeup = None
+        self._closing = False
+        self._draining = False
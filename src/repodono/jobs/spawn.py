@@ -0,0 +1,336 @@
+# -*- coding: utf-8 -*-
+"""
+Strategies for spawning the subprocesses of the jobs
+"""
+
+import array
+import json
+import logging
+import os
+import signal
+import socket
+import sys
+
+from collections import namedtuple
+from itertools import count
+from os.path import dirname
+from os.path import join
+from subprocess import Popen
+from subprocess import TimeoutExpired
+from threading import Event
+from threading import Lock
+from threading import Thread
+from time import monotonic
+from time import sleep
+
+logger = logging.getLogger(__name__)
+
+SPAWNER = join(dirname(__file__), 'spawner.py')
+
+posix_spawnp = getattr(os, 'posix_spawnp', None)
+
+# the strategies for JobManager.spawn_strategy: a plain Popen, which
+# forks the server process; os.posix_spawn, which does not copy it; or
+# the Spawner, a small helper process that spawns them instead.
+POPEN = 'popen'
+POSIX_SPAWN = 'posix_spawn'
+HELPER = 'spawner'
+STRATEGIES = (POPEN, POSIX_SPAWN, HELPER)
+
+# the resource usage of a subprocess as reported by the Spawner, with
+# the attributes used by JobStatus.account.
+Rusage = namedtuple('Rusage', ['ru_utime', 'ru_stime', 'ru_maxrss'])
+
+
+def exitcode(status):
+    """
+    Return the returncode for the wait status, as Popen reports it;
+    i.e. the negated signal for a process terminated by one.
+    """
+
+    if os.WIFSIGNALED(status):
+        return -os.WTERMSIG(status)
+    return os.WEXITSTATUS(status)
+
+
+def send_fds(sock, data, fds):
+    """
+    Send the data with the file descriptors attached, as socket.send_fds
+    does where available.
+    """
+
+    return sock.sendmsg(data, [(
+        socket.SOL_SOCKET, socket.SCM_RIGHTS, array.array('i', fds))])
+
+
+def unsupported(strategy):
+    """
+    Return the reason the strategy cannot be used on this platform, or
+    None if it can.
+    """
+
+    if strategy not in STRATEGIES:
+        return 'unknown spawn_strategy %r' % strategy
+    if strategy == POSIX_SPAWN and posix_spawnp is None:
+        return 'the posix_spawn strategy requires os.posix_spawnp'
+    if strategy == HELPER:
+        try:
+            pair = socket.socketpair(socket.AF_UNIX, socket.SOCK_SEQPACKET)
+        except (AttributeError, OSError):
+            return (
+                'the spawner strategy requires unix sockets of the '
+                'SOCK_SEQPACKET type')
+        for sock in pair:
+            sock.close()
+        if not hasattr(os, 'wait4') or not hasattr(socket, 'SCM_RIGHTS'):
+            return (
+                'the spawner strategy requires os.wait4 and the passing '
+                'of file descriptors')
+    return None
+
+
+class SpawnedProcess(object):
+    """
+    A Popen compatible stand-in for a subprocess that was not started
+    by Popen.  The exit status of a child is collected by waitpid (if
+    not already reaped by the ChildWatcher); otherwise it must be
+    reported, along with the resource usage.
+    """
+
+    def __init__(self, pid, stdout=None, stderr=None, child=True):
+        self.pid = pid
+        self.stdout = stdout
+        self.stderr = stderr
+        self.child = child
+        self.returncode = None
+        self.rusage = None
+        self.exited = Event()
+
+    def report(self, returncode, rusage=None):
+        self.rusage = rusage
+        self.returncode = returncode
+        self.exited.set()
+
+    def poll(self):
+        if self.returncode is None and self.child:
+            try:
+                pid, status = os.waitpid(self.pid, os.WNOHANG)
+            except ChildProcessError:
+                # reaped elsewhere, which sets the returncode.
+                return self.returncode
+            if pid:
+                self.report(exitcode(status))
+        return self.returncode
+
+    def wait(self, timeout=None):
+        if not self.child:
+            if not self.exited.wait(timeout):
+                raise TimeoutExpired(str(self.pid), timeout)
+            return self.returncode
+        deadline = None if timeout is None else monotonic() + timeout
+        while self.poll() is None:
+            if deadline is not None and monotonic() > deadline:
+                raise TimeoutExpired(str(self.pid), timeout)
+            sleep(0.005)
+        return self.returncode
+
+    def send_signal(self, sig):
+        if self.returncode is None:
+            os.kill(self.pid, sig)
+
+    def terminate(self):
+        self.send_signal(signal.SIGTERM)
+
+    def kill(self):
+        self.send_signal(signal.SIGKILL)
+
+
+def _pipes(capture):
+    return [os.pipe() for name in ('stdout', 'stderr')] if capture else []
+
+
+def _close(fds):
+    for fd in fds:
+        try:
+            os.close(fd)
+        except OSError:
+            pass
+
+
+def posix_spawn(args, capture=False):
+    """
+    Spawn the args in a new session with os.posix_spawnp, such that the
+    server process is never copied, with the stdout and stderr as pipes
+    if capture is enabled.  Unlike Popen, the inheritable descriptors
+    are not closed, and there is no preexec_fn.
+    """
+
+    pipes = _pipes(capture)
+    file_actions = [
+        (os.POSIX_SPAWN_DUP2, w, fd) for (r, w), fd in zip(pipes, (1, 2))]
+    try:
+        pid = posix_spawnp(
+            args[0], list(args), os.environ, file_actions=file_actions,
+            setsid=True)
+    except BaseException:
+        _close(fd for pipe in pipes for fd in pipe)
+        raise
+    _close(w for r, w in pipes)
+    return SpawnedProcess(pid, *(os.fdopen(r, 'rb') for r, w in pipes))
+
+
+class Spawner(object):
+    """
+    Spawn the subprocesses through a small helper process (see the
+    spawner script) started from a fresh interpreter, such that the
+    cost of spawning does not grow with the size of the server.  The
+    stdout and stderr pipes are passed to it over a unix socket, and
+    the returncodes and the resource usage of the subprocesses are sent
+    back, from which they are reported by a background thread.
+
+    Should the helper go away, the subprocesses it spawned are killed.
+    """
+
+    # seconds to wait for the helper to spawn a subprocess.
+    timeout = 10.0
+
+    def __init__(self, executable=sys.executable):
+        self.executable = executable
+        self.lock = Lock()
+        self.process = None
+        self.sock = None
+        self.thread = None
+        # the id of the requests to the Event, the reply and the read
+        # ends of the pipes for the subprocess.
+        self.requests = {}
+        # pid to the SpawnedProcess that has not exited.
+        self.processes = {}
+        self._ids = count()
+        self._stopping = False
+
+    def start(self):
+        if self.process is not None:
+            return
+        self.sock, remote = socket.socketpair(
+            socket.AF_UNIX, socket.SOCK_SEQPACKET)
+        try:
+            self.process = Popen(
+                (self.executable, SPAWNER, str(remote.fileno())),
+                pass_fds=(remote.fileno(),), start_new_session=True)
+        finally:
+            remote.close()
+        self.thread = Thread(target=self._run, name='Spawner')
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self):
+        if self.process is None:
+            return
+        # the helper exits once the socket is shut down.
+        self._stopping = True
+        self.sock.shutdown(socket.SHUT_RDWR)
+        self.thread.join()
+        self._stopping = False
+        self.sock.close()
+        try:
+            self.process.wait(timeout=1)
+        except TimeoutExpired:
+            self.process.kill()
+            self.process.wait()
+        self.process = None
+        self.sock = None
+        self.thread = None
+
+    def _run(self):
+        while True:
+            try:
+                data = self.sock.recv(65536)
+            except OSError:
+                data = b''
+            if not data:
+                break
+            record = json.loads(data.decode('utf8'))
+            if 'id' in record:
+                self._reply(record)
+                continue
+            with self.lock:
+                process = self.processes.pop(record['pid'], None)
+            if process is not None:
+                process.report(record['returncode'], Rusage(
+                    *record['rusage']))
+
+        with self.lock:
+            processes, self.processes = self.processes, {}
+            requests, self.requests = self.requests, {}
+        for event, reply, reads in requests.values():
+            event.set()
+        for pid in processes:
+            self._kill(pid, 'spawner stopped' if self._stopping else (
+                'spawner has gone away'))
+        for process in processes.values():
+            process.report(-signal.SIGKILL)
+
+    def _kill(self, pid, reason):
+        logger.warning('%s; killing subprocess %d', reason, pid)
+        try:
+            os.killpg(pid, signal.SIGKILL)
+        except OSError:
+            pass
+
+    def _reply(self, record):
+        # the process is registered here, before its exit is received.
+        with self.lock:
+            request = self.requests.pop(record['id'], None)
+            if request is not None:
+                event, reply, reads = request
+                if 'error' in record:
+                    reply.append(OSError(record['errno'], record['error']))
+                else:
+                    reply.append(SpawnedProcess(
+                        record['pid'], *(os.fdopen(r, 'rb') for r in reads),
+                        child=False))
+                    self.processes[record['pid']] = reply[0]
+                event.set()
+                return
+        if 'pid' in record:
+            self._kill(record['pid'], 'spawn request timed out')
+
+    def spawn(self, args, rlimits=(), cgroup=None, capture=False):
+        """
+        Spawn the args in a new session with the rlimits (a list of
+        (resource, (soft, hard))) applied and the cgroup joined; return
+        the SpawnedProcess.  Raises OSError if it could not be spawned.
+        """
+
+        if self.process is None:
+            raise OSError('spawner not started')
+        pipes = _pipes(capture)
+        reads = [r for r, w in pipes]
+        event = Event()
+        reply = []
+        with self.lock:
+            request_id = next(self._ids)
+            self.requests[request_id] = (event, reply, reads)
+        try:
+            send_fds(self.sock, [json.dumps({
+                'id': request_id, 'args': list(args),
+                'rlimits': list(rlimits), 'cgroup': cgroup,
+            }).encode('utf8')], [w for r, w in pipes])
+        except BaseException:
+            with self.lock:
+                self.requests.pop(request_id, None)
+            _close(reads)
+            raise
+        finally:
+            _close(w for r, w in pipes)
+
+        event.wait(self.timeout)
+        with self.lock:
+            self.requests.pop(request_id, None)
+        if not reply or isinstance(reply[0], OSError):
+            # the read ends were never taken.
+            _close(reads)
+            if not reply:
+                raise OSError('spawner did not respond')
+            raise reply[0]
+        return reply[0]
@@ -0,0 +1,174 @@
+# -*- coding: utf-8 -*-
+"""
+Spawner helper for the Spawner
+
+This module is executed directly as a script, so it must only depend on
+the standard library.  It is kept small such that forking it remains
+cheap no matter how large the server that started it grows.  The server
+sends the jobs to spawn over the socket given by its file descriptor as
+the argument, as JSON records with the descriptors for the stdout and
+stderr of the job attached; the pid of each subprocess is replied, and
+its returncode and resource usage sent once it has terminated.
+"""
+
+import array
+import fcntl
+import json
+import os
+import selectors
+import signal
+import socket
+import sys
+
+# the largest record that may be received, with the descriptors.
+MAX_RECORD = 1 << 20
+MAX_FDS = 2
+
+
+def exitcode(status):
+    # as repodono.jobs.spawn.exitcode, which cannot be imported here.
+    if os.WIFSIGNALED(status):
+        return -os.WTERMSIG(status)
+    return os.WEXITSTATUS(status)
+
+
+def recv_fds(sock, bufsize, maxfds):
+    """
+    Receive the data and the file descriptors attached, as
+    socket.recv_fds does where available.
+    """
+
+    fds = array.array('i')
+    data, ancdata, flags, addr = sock.recvmsg(
+        bufsize, socket.CMSG_LEN(maxfds * fds.itemsize))
+    for level, kind, cmsg_data in ancdata:
+        if level == socket.SOL_SOCKET and kind == socket.SCM_RIGHTS:
+            fds.frombytes(cmsg_data[
+                :len(cmsg_data) - (len(cmsg_data) % fds.itemsize)])
+    return data, list(fds)
+
+
+def limit(rlimits, cgroup):
+    """
+    Apply the resource limits and join the cgroup, as for the preexec_fn
+    of the subprocesses spawned by the manager.
+    """
+
+    if cgroup:
+        with open(os.path.join(cgroup, 'cgroup.procs'), 'w') as fd:
+            fd.write('0')
+    if rlimits:
+        import resource
+        for rlimit, value in rlimits:
+            resource.setrlimit(rlimit, tuple(value))
+
+
+def spawn(job, fds):
+    """
+    Fork and exec the job, return its pid; raises OSError if it could
+    not be executed.
+    """
+
+    # closed on exec, such that only a failure is ever written to it.
+    errpipe = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        try:
+            os.close(errpipe[0])
+            # the ignored signals would be inherited through exec.
+            for signum in (signal.SIGCHLD, signal.SIGINT):
+                signal.signal(signum, signal.SIG_DFL)
+            os.setsid()
+            for fd, target in zip(fds, (1, 2)):
+                os.dup2(fd, target)
+            for fd in fds:
+                if fd not in (1, 2):
+                    os.close(fd)
+            if job.get('cwd'):
+                os.chdir(job['cwd'])
+            limit(job.get('rlimits'), job.get('cgroup'))
+            os.execvp(job['args'][0], job['args'])
+        except BaseException as e:
+            os.write(errpipe[1], json.dumps([
+                getattr(e, 'errno', None) or 0, str(e)]).encode('utf8'))
+        finally:
+            os._exit(127)
+
+    os.close(errpipe[1])
+    with os.fdopen(errpipe[0], 'rb') as fd:
+        error = fd.read()
+    if error:
+        os.waitpid(pid, 0)
+        raise OSError(*json.loads(error.decode('utf8')))
+    return pid
+
+
+def reap(sock):
+    while True:
+        try:
+            pid, status, rusage = os.wait4(-1, os.WNOHANG)
+        except ChildProcessError:
+            return
+        if not pid:
+            return
+        send(sock, {
+            'pid': pid, 'returncode': exitcode(status),
+            'rusage': [rusage.ru_utime, rusage.ru_stime, rusage.ru_maxrss],
+        })
+
+
+def send(sock, record):
+    sock.send(json.dumps(record).encode('utf8'))
+
+
+def main(fileno):
+    sock = socket.socket(fileno=fileno)
+    sock.set_inheritable(False)
+    wakeup = os.pipe()
+    fcntl.fcntl(wakeup[1], fcntl.F_SETFL, fcntl.fcntl(
+        wakeup[1], fcntl.F_GETFL) | os.O_NONBLOCK)
+    try:
+        signal.set_wakeup_fd(wakeup[1], warn_on_full_buffer=False)
+    except TypeError:
+        # before Python 3.7.
+        signal.set_wakeup_fd(wakeup[1])
+    signal.signal(signal.SIGCHLD, lambda signum, frame: None)
+    # terminated only by the server going away.
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+    selector = selectors.DefaultSelector()
+    selector.register(sock, selectors.EVENT_READ)
+    selector.register(wakeup[0], selectors.EVENT_READ)
+    try:
+        serve(sock, selector, wakeup[0])
+    except (BrokenPipeError, ConnectionResetError):
+        # the server has gone away.
+        pass
+
+
+def serve(sock, selector, wakeup):
+    while True:
+        for key, mask in selector.select():
+            if key.fileobj != sock:
+                os.read(wakeup, 4096)
+                reap(sock)
+                continue
+            data, fds = recv_fds(sock, MAX_RECORD, MAX_FDS)
+            if not data:
+                return
+            job = json.loads(data.decode('utf8'))
+            try:
+                send(sock, {'id': job['id'], 'pid': spawn(job, fds)})
+            except OSError as e:
+                send(sock, {
+                    'id': job['id'], 'errno': e.errno,
+                    'error': e.strerror or str(e)})
+            finally:
+                for fd in fds:
+                    os.close(fd)
+
+
+if __name__ == '__main__':
+    # the directory of this script must not shadow anything.
+    sys.path[0] = ''
+    main(int(sys.argv[1]))
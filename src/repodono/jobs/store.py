@@ -0,0 +1,193 @@
+# -*- coding: utf-8 -*-
+"""
+Persistent stores for the job registry
+"""
+
+import logging
+import sqlite3
+
+from threading import Event
+from threading import Lock
+from threading import Thread
+
+from .manager import JobStatus
+
+logger = logging.getLogger(__name__)
+
+
+class JobStore(object):
+    """
+    Interface for the storage of the registry of job_id to the
+    working_dir and the JobStatus of the job.
+    """
+
+    def open(self):
+        pass
+
+    def close(self):
+        pass
+
+    def flush(self):
+        """
+        Ensure all prior writes are visible to other processes.
+        """
+
+        pass
+
+    def put(self, job_id, working_dir, status):
+        raise NotImplementedError
+
+    def delete(self, job_id):
+        raise NotImplementedError
+
+    def get(self, job_id):
+        """
+        Return the (working_dir, status) for the job_id, or None.
+        """
+
+        raise NotImplementedError
+
+    def load(self):
+        """
+        Return an iterable of (job_id, working_dir, status) for all the
+        stored jobs.
+        """
+
+        raise NotImplementedError
+
+
+class SQLiteJobStore(JobStore):
+    """
+    Job store backed by a SQLite database in WAL mode.
+
+    Writes are buffered and committed in batches, whenever batch_size
+    writes are pending, every flush_interval seconds and on close; the
+    buffer is consulted by get, so reads are always consistent.
+    """
+
+    columns = (
+        'job_id', 'working_dir', 'state', 'returncode', 'submitted',
+        'started', 'finished', 'ttl', 'pid',
+    )
+
+    def __init__(self, path, batch_size=100, flush_interval=1.0):
+        self.path = path
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.conn = None
+        self.lock = Lock()
+        # job_id to the row to be written, or None for deletion.
+        self.pending = {}
+        self.flusher = None
+        self.stopped = Event()
+
+    def open(self):
+        conn = self.conn = sqlite3.connect(
+            self.path, check_same_thread=False)
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        conn.execute(
+            'CREATE TABLE IF NOT EXISTS jobs ('
+            'job_id TEXT PRIMARY KEY, '
+            'working_dir TEXT NOT NULL, '
+            'state TEXT NOT NULL, '
+            'returncode INTEGER, '
+            'submitted REAL, '
+            'started REAL, '
+            'finished REAL, '
+            'ttl REAL, '
+            'pid INTEGER)'
+        )
+        conn.commit()
+        if self.flush_interval:
+            self.stopped.clear()
+            self.flusher = Thread(target=self._run, name='SQLiteJobStore')
+            self.flusher.daemon = True
+            self.flusher.start()
+
+    def _run(self):
+        while not self.stopped.wait(self.flush_interval):
+            try:
+                self.flush()
+            except Exception:
+                logger.exception('error flushing job store')
+
+    def close(self):
+        if self.conn is None:
+            return
+        if self.flusher is not None:
+            self.stopped.set()
+            self.flusher.join()
+            self.flusher = None
+        self.flush()
+        self.conn.close()
+        self.conn = None
+
+    def flush(self):
+        with self.lock:
+            if self.conn is None or not self.pending:
+                return
+            pending, self.pending = self.pending, {}
+            rows = [row for row in pending.values() if row is not None]
+            deleted = [
+                (job_id,) for job_id, row in pending.items() if row is None]
+            with self.conn:
+                if rows:
+                    self.conn.executemany(
+                        'INSERT OR REPLACE INTO jobs (%s) VALUES (%s)' % (
+                            ', '.join(self.columns),
+                            ', '.join('?' * len(self.columns))),
+                        rows,
+                    )
+                if deleted:
+                    self.conn.executemany(
+                        'DELETE FROM jobs WHERE job_id = ?', deleted)
+
+    def _write(self, job_id, row):
+        with self.lock:
+            self.pending[job_id] = row
+            full = len(self.pending) >= self.batch_size
+        if full:
+            self.flush()
+
+    def put(self, job_id, working_dir, status):
+        self._write(job_id, (
+            job_id, working_dir, status.state, status.returncode,
+            status.submitted, status.started, status.finished, status.ttl,
+            status.pid,
+        ))
+
+    def delete(self, job_id):
+        self._write(job_id, None)
+
+    def _from_row(self, row):
+        (job_id, working_dir, state, returncode, submitted, started,
+            finished, ttl, pid) = row
+        status = JobStatus(submitted=submitted)
+        status.state = state
+        status.returncode = returncode
+        status.started = started
+        status.finished = finished
+        status.ttl = ttl
+        status.pid = pid
+        status.accessed = finished or submitted
+        return job_id, working_dir, status
+
+    def get(self, job_id):
+        with self.lock:
+            if job_id in self.pending:
+                row = self.pending[job_id]
+            else:
+                row = self.conn.execute(
+                    'SELECT %s FROM jobs WHERE job_id = ?' % ', '.join(
+                        self.columns), (job_id,)).fetchone()
+        if row is None:
+            return None
+        return self._from_row(row)[1:]
+
+    def load(self):
+        self.flush()
+        with self.lock:
+            rows = self.conn.execute(
+                'SELECT %s FROM jobs' % ', '.join(self.columns)).fetchall()
+        return [self._from_row(row) for row in rows]
@@ -0,0 +1,299 @@
+# -*- coding: utf-8 -*-
+"""
+Asyncio manager test case
+"""
+
+import asyncio
+import io
+import logging
+import signal
+import unittest
+from textwrap import dedent
+
+import sys
+from os.path import exists
+from os.path import join
+from threading import current_thread
+
+from repodono.jobs.aio import AsyncJobManager
+from repodono.jobs.aio import logger as aio_logger
+from repodono.jobs.exc import ManagerRuntimeError
+from repodono.jobs.manager import QUEUED
+from repodono.jobs.manager import RUNNING
+from repodono.jobs.manager import SUCCESS
+from repodono.jobs.manager import FAILURE
+from repodono.jobs.manager import TIMEOUT
+from repodono.jobs.manager import CANCELLED
+from repodono.jobs.manager import EVICTED
+from repodono.jobs.limits import ResourceLimits
+
+
+class DummyAsyncManager(AsyncJobManager):
+
+    def get_args(self, working_dir, s, t, **kw):
+        target = join(working_dir, 'out')
+
+        prog = dedent("""
+        import sys
+        from time import sleep
+
+        t = %(t)f
+        if t < 0:
+            sys.exit(1)
+        sleep(t)
+        sys.stdout.write('%(s)s')
+
+        with open(%(target)r, 'w') as fd:
+            fd.write('%(s)s')
+        """) % locals()
+
+        return (sys.executable, '-c', prog)
+
+
+class AsyncJobManagerTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        self.manager = DummyAsyncManager(max_concurrent=1)
+        self.stream = io.StringIO()
+        self.handler = logging.StreamHandler(self.stream)
+        aio_logger.addHandler(self.handler)
+
+    def tearDown(self):
+        self.loop.run_until_complete(self.manager.stop())
+        self.loop.close()
+        aio_logger.removeHandler(self.handler)
+
+    def run_loop(self, coro):
+        return self.loop.run_until_complete(coro)
+
+    def test_not_started(self):
+        with self.assertRaises(ManagerRuntimeError):
+            self.run_loop(self.manager.run(s='hello', t=0))
+
+    def test_run_wait(self):
+        self.manager.start()
+
+        async def main():
+            wd1 = await self.manager.run(s='hello', t=0.05)
+            wd2 = await self.manager.run(s='world', t=-1)
+            self.assertEqual(self.manager.poll(wd1), RUNNING)
+            self.assertEqual(self.manager.poll(wd2), QUEUED)
+            self.assertEqual(await self.manager.wait(wd1), 0)
+            self.assertEqual(await self.manager.wait(wd2), 1)
+            return wd1, wd2
+
+        wd1, wd2 = self.run_loop(main())
+        self.assertEqual(self.manager.poll(wd1), SUCCESS)
+        self.assertEqual(self.manager.poll(wd2), FAILURE)
+        self.assertEqual(
+            self.manager.get_result_by_key(wd1, 'out'), 'hello')
+
+        with self.assertRaises(KeyError):
+            self.manager.poll('no_such_dir')
+
+    def test_terminate(self):
+        self.manager.start()
+        states = {}
+        self.manager.subscribe(
+            lambda wd, status: states.setdefault(wd, []).append(status.state))
+
+        async def main():
+            wd1 = await self.manager.run(s='hello', t=10)
+            wd2 = await self.manager.run(s='world', t=0)
+            wd3 = await self.manager.run_after([wd1], s='never', t=0)
+            # the jobs not yet started have no returncode.
+            self.assertIsNone(await self.manager.terminate(wd2))
+            self.assertIsNone(await self.manager.terminate(wd3))
+            self.assertEqual(await self.manager.terminate(wd1), -15)
+            return wd1, wd2, wd3
+
+        wd1, wd2, wd3 = self.run_loop(main())
+        # cancelled as cancel would, rather than failed.
+        for wd in (wd1, wd2, wd3):
+            self.assertIn(CANCELLED, states[wd])
+            self.assertNotIn(FAILURE, states[wd])
+
+    def test_terminate_evict(self):
+        self.manager.start()
+        threads = {}
+        self.manager.subscribe(lambda wd, status: threads.setdefault(
+            status.state, set()).add(current_thread()))
+
+        async def main():
+            wd1 = await self.manager.run(s='hello', t=10)
+            wd2 = await self.manager.run(s='world', t=0)
+            self.assertIsNone(await self.manager.terminate(wd2))
+            self.assertEqual(await self.manager.terminate(wd1), -15)
+            while self.manager.status:
+                await asyncio.sleep(0.01)
+            return wd1, wd2
+
+        wd1, wd2 = self.run_loop(main())
+        self.assertFalse(exists(wd1))
+        self.assertFalse(exists(wd2))
+        self.assertEqual(self.manager.events, {})
+        # the callbacks are all invoked from the loop.
+        self.assertEqual(threads[EVICTED], {current_thread()})
+        self.assertEqual(threads[CANCELLED], {current_thread()})
+
+    def test_terminate_escalate(self):
+        self.manager.start()
+
+        async def main():
+            wd = await self.manager.run(s='hello', t=10)
+            signal_process = self.manager.signal_process
+            # simulate a subprocess that ignores the termination signal
+            self.manager.signal_process = lambda process, sig: (
+                sig != signal.SIGTERM and signal_process(process, sig))
+            return await self.manager.terminate(wd, timeout=0.1)
+
+        self.assertEqual(self.run_loop(main()), -9)
+        self.assertIn('did not terminate; killing', self.stream.getvalue())
+
+    def test_stop_running(self):
+        self.manager.start()
+        self.run_loop(self.manager.run(s='hello', t=10))
+        self.run_loop(self.manager.run(s='hello', t=10))
+        self.run_loop(self.manager.stop())
+        self.assertIn('discarding 1 queued job(s)', self.stream.getvalue())
+        self.assertIn('is still running', self.stream.getvalue())
+        self.assertIs(self.manager.root, NotImplemented)
+
+    def test_memoize_coalesce(self):
+        manager = DummyAsyncManager(memoize=True)
+        manager.start()
+
+        async def main():
+            working_dirs = await asyncio.gather(*(
+                manager.run(s='hello', t=0.05) for x in range(5)))
+            await manager.wait(working_dirs[0])
+            return working_dirs
+
+        working_dirs = self.run_loop(main())
+        self.assertEqual(len(set(working_dirs)), 1)
+        self.assertEqual(len(manager.status), 1)
+        # the process is dropped once it has finished.
+        self.assertEqual(manager.mapping, {})
+        self.run_loop(manager.stop())
+
+    def test_limits_timeout(self):
+        self.manager.limits = ResourceLimits(timeout=0.1, kill_timeout=0.5)
+        self.manager.start()
+
+        async def main():
+            working_dir = await self.manager.run(s='hello', t=10)
+            self.assertEqual(
+                await self.manager.wait(working_dir), -signal.SIGTERM)
+            return working_dir
+
+        working_dir = self.run_loop(main())
+        self.assertEqual(self.manager.poll(working_dir), TIMEOUT)
+
+    def test_cancel(self):
+        self.manager.start()
+
+        async def main():
+            wd1 = await self.manager.run(s='hello', t=10)
+            wd2 = await self.manager.run(s='world', t=0)
+            self.assertTrue(await self.manager.cancel(wd1))
+            self.assertEqual(self.manager.poll(wd2), RUNNING)
+            self.assertEqual(await self.manager.wait(wd1), -signal.SIGTERM)
+            self.assertEqual(await self.manager.wait(wd2), 0)
+            for x in range(100):
+                if wd1 not in self.manager.status:
+                    break
+                await asyncio.sleep(0.02)
+            return wd1
+
+        wd1 = self.run_loop(main())
+        self.assertNotIn(wd1, self.manager.status)
+
+    def test_run_batch(self):
+        self.manager.start()
+
+        async def main():
+            wd1, wd2 = await self.manager.run_batch([
+                {'s': 'hello', 't': 0},
+                {'s': 'world', 't': 0},
+            ])
+            self.assertEqual(self.manager.poll(wd1), RUNNING)
+            self.assertEqual(self.manager.poll(wd2), QUEUED)
+            self.assertEqual(await self.manager.wait(wd2), 0)
+            return wd1, wd2
+
+        wd1, wd2 = self.run_loop(main())
+        self.assertEqual(self.manager.get_result_by_key(wd2, 'out'), 'world')
+
+    def test_capture_output(self):
+        self.manager.start()
+
+        async def main():
+            working_dir = await self.manager.run(s='hello', t=0)
+            self.assertEqual(await self.manager.wait(working_dir), 0)
+            for x in range(100):
+                result = self.manager.read_log(working_dir, 'stdout')
+                if result[2]:
+                    break
+                await asyncio.sleep(0.02)
+            return working_dir, result
+
+        working_dir, result = self.run_loop(main())
+        self.assertEqual(result, (b'hello', 0, True))
+        self.assertEqual(self.manager.list_result_keys(working_dir), ['out'])
+
+    def test_run_after(self):
+        self.manager.start()
+
+        async def main():
+            wd1 = await self.manager.run(s='hello', t=0.1)
+            wd2 = await self.manager.run_after([wd1], s='world', t=0)
+            self.assertEqual(self.manager.poll(wd2), QUEUED)
+            self.assertEqual(await self.manager.wait(wd2), 0)
+            wd3 = await self.manager.run(s='fail', t=-1)
+            wd4 = await self.manager.run_after([wd3], s='never', t=0)
+            self.assertIsNone(await self.manager.wait(wd4))
+            return wd1, wd2, wd3, wd4
+
+        wd1, wd2, wd3, wd4 = self.run_loop(main())
+        with open(join(wd2, '.upstream', '0', 'out')) as fd:
+            self.assertEqual(fd.read(), 'hello')
+        self.assertEqual(self.manager.poll(wd4), FAILURE)
+        self.assertEqual(self.manager.status[wd4].blocked_by, wd3)
+
+    def test_finish_off_loop(self):
+        self.manager.start()
+        threads = []
+        scan_results = self.manager.scan_results
+        link_results = self.manager.link_results
+
+        def scan(working_dir):
+            threads.append(current_thread())
+            return scan_results(working_dir)
+
+        def link(working_dir, upstream):
+            threads.append(current_thread())
+            link_results(working_dir, upstream)
+
+        self.manager.scan_results = scan
+        self.manager.link_results = link
+
+        async def main():
+            wd1 = await self.manager.run(s='hello', t=0.1)
+            wd2 = await self.manager.run_after([wd1], s='world', t=0)
+            self.assertEqual(await self.manager.wait(wd1), 0)
+            # recorded along with the index of the results.
+            self.assertEqual(self.manager.poll(wd1), SUCCESS)
+            self.assertEqual(list(self.manager.indexes[wd1]), ['out'])
+            self.assertEqual(await self.manager.wait(wd2), 0)
+            wd3 = await self.manager.run_after([wd1], s='again', t=0)
+            self.assertEqual(await self.manager.wait(wd3), 0)
+
+        self.run_loop(main())
+        # the scans of both and the links into both downstream jobs.
+        self.assertEqual(len(threads), 5)
+        self.assertNotIn(current_thread(), threads)
+
+    def test_spawn_strategy(self):
+        with self.assertRaises(ValueError):
+            DummyAsyncManager(spawn_strategy='posix_spawn')
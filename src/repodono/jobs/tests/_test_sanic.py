@@ -6,17 +6,29 @@ Manager test case
 import io
 import json
 import logging
+import tarfile
 import unittest
+import zipfile
 from textwrap import dedent
 
 import sys
+from os import listdir
 from os.path import join
+from tempfile import TemporaryDirectory
 from time import sleep
 
 from sanic import Sanic
 from repodono.jobs.sanic import JobServer
 
+from repodono.jobs.admission import AdmissionControl
+from repodono.jobs.agent import Agent
+from repodono.jobs.aio import AsyncJobManager
+from repodono.jobs.archive import FORMATS
 from repodono.jobs.manager import JobManager
+from repodono.jobs.limits import ResourceLimits
+from repodono.jobs.remote import RemoteJobManager
+from repodono.jobs.retention import RetentionPolicy
+from repodono.jobs.store import SQLiteJobStore
 from repodono.jobs.manager import logger as manager_logger
 
 sanic_logger = logging.getLogger('sanic')
@@ -39,6 +51,8 @@ class DummyManager(JobManager):
         if not timeout:
             sys.exit(1)
 
+        sys.stdout.write('%(msg)s')
+        sys.stdout.flush()
         sleep(timeout)
 
         if isdir(dirname(target)):
@@ -66,6 +80,32 @@ class DummyManager(JobManager):
                 break
 
 
+class RemoteDummyManager(RemoteJobManager):
+
+    verify_run_kwargs = DummyManager.verify_run_kwargs
+
+
+class UploadManager(JobManager):
+
+    def get_args(self, working_dir, path, **kw):
+        return (sys.executable, '-c', dedent("""
+        import shutil
+        shutil.copy(%r, %r)
+        """) % (path, join(working_dir, 'out')))
+
+    def verify_run_kwargs(self, **kw):
+        try:
+            return {'path': kw['input'][0].path}
+        except (KeyError, AttributeError):
+            raise ValueError("missing or invalid arguments")
+
+
+class DummyAsyncManager(AsyncJobManager):
+
+    get_args = DummyManager.get_args
+    verify_run_kwargs = DummyManager.verify_run_kwargs
+
+
 class SanicProviderTestCase(unittest.TestCase):
 
     def setUp(self):
@@ -82,9 +122,10 @@ class SanicProviderTestCase(unittest.TestCase):
         manager_logger.removeHandler(self.handler)
         sanic_logger.setLevel(self.sanic_level)
 
-    def create_app(self, hook_start_stop=False):
-        manager = DummyManager()
-        job_server = JobServer(manager, hook_start_stop=hook_start_stop)
+    def create_app(self, hook_start_stop=False, **kw):
+        manager = DummyManager(**kw)
+        job_server = self.job_server = JobServer(
+            manager, hook_start_stop=hook_start_stop)
         app = Sanic()
         job_server.register(app)
         if not hook_start_stop:
@@ -170,3 +211,690 @@ class SanicProviderTestCase(unittest.TestCase):
         request, response = app.test_client.get(location + '/out')
         j = json.loads(response.text)
         self.assertEqual(j['error'], 'no such key for job')
+
+    def test_run_queued(self):
+        app = self.create_app(max_concurrent=1)
+        request, response = app.test_client.post('/execute', data={
+            'timeout': '0.1',
+            'msg': 'hello',
+        })
+        first = json.loads(response.text)['location']
+        request, response = app.test_client.post('/execute', data={
+            'timeout': '0.5',
+            'msg': 'world',
+        })
+        second = json.loads(response.text)['location']
+
+        request, response = app.test_client.get(second)
+        j = json.loads(response.text)
+        self.assertEqual(j['status'], 'queued')
+
+        sleep(0.4)
+        request, response = app.test_client.get(first)
+        self.assertEqual(json.loads(response.text)['status'], 'success')
+        request, response = app.test_client.get(second)
+        self.assertEqual(json.loads(response.text)['status'], 'running')
+
+    def test_run_async_manager(self):
+        job_server = JobServer(DummyAsyncManager())
+        app = Sanic()
+        job_server.register(app)
+        # the server hooks will await on the stop coroutine which will
+        # terminate the job.
+        request, response = app.test_client.post('/execute', data={
+            'timeout': '10',
+            'msg': 'hello',
+        })
+        j = json.loads(response.text)
+        self.assertEqual(j['status'], 'created')
+        self.assertIs(job_server.job_manager.root, NotImplemented)
+
+    def test_poll_wait(self):
+        app = self.create_app()
+        request, response = app.test_client.post('/execute', data={
+            'timeout': '0.2',
+            'msg': 'hello',
+        })
+        location = json.loads(response.text)['location']
+
+        request, response = app.test_client.get(location + '?wait=xx')
+        self.assertEqual(json.loads(response.text)['error'], 'invalid wait')
+
+        # returns as soon as the job transitions.
+        request, response = app.test_client.get(location + '?wait=5')
+        j = json.loads(response.text)
+        self.assertEqual(j['status'], 'success')
+        self.assertEqual(j['keys'], ['out'])
+
+        # finished jobs will not wait.
+        request, response = app.test_client.get(location + '?wait=5')
+        self.assertEqual(json.loads(response.text)['status'], 'success')
+
+    def test_poll_wait_timeout(self):
+        app = self.create_app()
+        request, response = app.test_client.post('/execute', data={
+            'timeout': '1',
+            'msg': 'hello',
+        })
+        location = json.loads(response.text)['location']
+        request, response = app.test_client.get(location + '?wait=0.1')
+        self.assertEqual(json.loads(response.text)['status'], 'running')
+
+    def test_stream(self):
+        app = self.create_app(max_concurrent=1)
+        request, response = app.test_client.post('/execute', data={
+            'timeout': '0.1',
+            'msg': 'hello',
+        })
+        request, response = app.test_client.post('/execute', data={
+            'timeout': '0',
+            'msg': 'world',
+        })
+        job_id = json.loads(response.text)['location'].split('/')[-1]
+
+        request, response = app.test_client.get('/stream/' + job_id)
+        self.assertEqual(
+            response.headers['Content-Type'], 'text/event-stream')
+        events = [
+            line for line in response.text.splitlines()
+            if line.startswith('event: ')
+        ]
+        # the running state may be too short lived to be reported.
+        self.assertEqual(events[0], 'event: queued')
+        self.assertEqual(events[-1], 'event: failure')
+
+        request, response = app.test_client.get('/stream/no_such_job')
+        self.assertEqual(response.status, 404)
+
+    def test_results_conditional_range(self):
+        app = self.create_app()
+        request, response = app.test_client.post('/execute', data={
+            'timeout': '0.01',
+            'msg': 'hello world',
+        })
+        location = json.loads(response.text)['location']
+        request, response = app.test_client.get(location + '?wait=5')
+        self.assertEqual(json.loads(response.text)['status'], 'success')
+
+        target = location + '/out'
+        request, response = app.test_client.get(target)
+        self.assertEqual(response.status, 200)
+        self.assertEqual(response.text, 'hello world')
+        self.assertEqual(response.headers['Accept-Ranges'], 'bytes')
+        etag = response.headers['ETag']
+
+        request, response = app.test_client.get(
+            target, headers={'If-None-Match': etag})
+        self.assertEqual(response.status, 304)
+        self.assertEqual(response.headers['ETag'], etag)
+
+        request, response = app.test_client.get(
+            target, headers={'If-None-Match': '"other"'})
+        self.assertEqual(response.status, 200)
+
+        request, response = app.test_client.get(
+            target, headers={'Range': 'bytes=6-'})
+        self.assertEqual(response.status, 206)
+        self.assertEqual(response.text, 'world')
+        self.assertEqual(response.headers['Content-Range'], 'bytes 6-10/11')
+
+        request, response = app.test_client.get(
+            target, headers={'Range': 'bytes=-5'})
+        self.assertEqual(response.status, 206)
+        self.assertEqual(response.text, 'world')
+
+        request, response = app.test_client.get(
+            target, headers={'Range': 'bytes=0-4'})
+        self.assertEqual(response.text, 'hello')
+
+        request, response = app.test_client.get(
+            target, headers={'Range': 'bytes=20-'})
+        self.assertEqual(response.status, 416)
+        self.assertEqual(response.headers['Content-Range'], 'bytes */11')
+
+        request, response = app.test_client.get(
+            target, headers={'Range': 'bytes=-0'})
+        self.assertEqual(response.status, 416)
+
+        # invalid, or not a single range of bytes; ignored.
+        for value in ('lines=1-2', 'bytes=5-2', 'bytes=-', 'bytes=a-',
+                      'bytes=1-2x', 'bytes=0-1,3-4', 'bytes=+1-'):
+            request, response = app.test_client.get(
+                target, headers={'Range': value})
+            self.assertEqual(response.status, 200)
+            self.assertEqual(response.text, 'hello world')
+
+    def test_evicted(self):
+        app = self.create_app(retention=RetentionPolicy(ttl=0, interval=None))
+        request, response = app.test_client.post('/execute', data={
+            'timeout': '0.01',
+            'msg': 'hello',
+        })
+        location = json.loads(response.text)['location']
+        request, response = app.test_client.get(location + '?wait=5')
+        self.assertEqual(json.loads(response.text)['status'], 'success')
+
+        self.job_server.job_manager.collect()
+
+        request, response = app.test_client.get(location)
+        self.assertEqual(response.status, 410)
+        self.assertEqual(json.loads(response.text)['status'], 'evicted')
+        request, response = app.test_client.get(location + '/out')
+        self.assertEqual(response.status, 410)
+
+    def test_memoized(self):
+        app = self.create_app(memoize=True)
+        request, response = app.test_client.post('/execute', data={
+            'timeout': '0.01',
+            'msg': 'hello',
+        })
+        self.assertEqual(response.status, 201)
+        location = json.loads(response.text)['location']
+        request, response = app.test_client.post('/execute', data={
+            'timeout': '0.01',
+            'msg': 'hello',
+        })
+        self.assertEqual(response.status, 200)
+        self.assertEqual(json.loads(response.text)['location'], location)
+        self.assertEqual(len(self.job_server.records), 1)
+
+    def test_store_restore(self):
+        tempdir = TemporaryDirectory()
+        self.addCleanup(tempdir.cleanup)
+        root = join(tempdir.name, 'root')
+        db = join(tempdir.name, 'jobs.db')
+
+        def create_app():
+            job_server = JobServer(
+                DummyManager(root=root), store=SQLiteJobStore(db))
+            app = Sanic()
+            job_server.register(app)
+            return app
+
+        # the hooks will start and stop the server for each request.
+        app = create_app()
+        request, response = app.test_client.post('/execute', data={
+            'timeout': '0.01',
+            'msg': 'hello',
+        })
+        location = json.loads(response.text)['location']
+        sleep(0.3)
+
+        app = create_app()
+        request, response = app.test_client.get(location)
+        j = json.loads(response.text)
+        # the job was still running when the previous server stopped.
+        self.assertEqual(j['status'], 'failure')
+
+        app = create_app()
+        request, response = app.test_client.get(location + '/out')
+        self.assertEqual(response.text, 'hello')
+
+    def test_shared_requires_store(self):
+        with self.assertRaises(ValueError):
+            JobServer(DummyManager(), shared=True)
+
+    def test_shared(self):
+        tempdir = TemporaryDirectory()
+        self.addCleanup(tempdir.cleanup)
+        root = join(tempdir.name, 'root')
+        db = join(tempdir.name, 'jobs.db')
+
+        def create_app():
+            job_server = JobServer(
+                DummyManager(root=root), hook_start_stop=False,
+                store=SQLiteJobStore(db, flush_interval=0.01), shared=True)
+            app = Sanic()
+            job_server.register(app)
+            job_server.start(None, None)
+            self.addCleanup(job_server.stop, None, None)
+            return app, job_server
+
+        app1, server1 = create_app()
+        app2, server2 = create_app()
+
+        request, response = app1.test_client.post('/execute', data={
+            'timeout': '0.1',
+            'msg': 'hello',
+        })
+        location = json.loads(response.text)['location']
+        job_id = location.split('/')[-1]
+        self.assertTrue(job_id.startswith(server1.worker_id + '-'))
+
+        # the job is found through the store by the other server.
+        request, response = app2.test_client.get(location)
+        self.assertEqual(json.loads(response.text)['status'], 'running')
+        self.assertIsNone(server2.records.get(job_id))
+
+        request, response = app2.test_client.get(location + '?wait=5')
+        j = json.loads(response.text)
+        self.assertEqual(j['status'], 'success')
+        self.assertEqual(j['keys'], ['out'])
+
+        request, response = app2.test_client.get(location + '/out')
+        self.assertEqual(response.text, 'hello')
+
+        request, response = app2.test_client.get('/poll/no_such_job')
+        self.assertEqual(response.status, 404)
+
+    def test_metrics(self):
+        app = self.create_app()
+        request, response = app.test_client.post('/execute', data={
+            'timeout': '0.01',
+            'msg': 'hello',
+        })
+        location = json.loads(response.text)['location']
+        request, response = app.test_client.get(location + '?wait=5')
+        self.assertEqual(json.loads(response.text)['status'], 'success')
+
+        request, response = app.test_client.get('/metrics')
+        self.assertEqual(response.status, 200)
+        self.assertIn(
+            'repodono_jobs_finished_total{type="default",state="success"} 1',
+            response.text)
+        self.assertIn(
+            'repodono_job_size_bytes_count{type="default"} 1',
+            response.text)
+        self.assertIn('repodono_jobs_running 0', response.text)
+
+    def test_timeout(self):
+        app = self.create_app(limits=ResourceLimits(timeout=0.1))
+        request, response = app.test_client.post('/execute', data={
+            'timeout': '10',
+            'msg': 'hello',
+        })
+        location = json.loads(response.text)['location']
+        request, response = app.test_client.get(location + '?wait=5')
+        self.assertEqual(response.status, 400)
+        self.assertEqual(json.loads(response.text)['status'], 'timeout')
+
+    def test_cancel(self):
+        app = self.create_app(max_concurrent=1)
+        request, response = app.test_client.post('/execute', data={
+            'timeout': '10',
+            'msg': 'hello',
+        })
+        location = json.loads(response.text)['location']
+        request, response = app.test_client.delete(location)
+        self.assertEqual(response.status, 202)
+        self.assertEqual(json.loads(response.text)['status'], 'cancelled')
+
+        for x in range(50):
+            request, response = app.test_client.get(location)
+            if response.status == 410:
+                break
+            sleep(0.1)
+        self.assertEqual(response.status, 410)
+
+        request, response = app.test_client.delete('/poll/no_such_job')
+        self.assertEqual(response.status, 404)
+
+    def test_batch(self):
+        app = self.create_app()
+        request, response = app.test_client.post('/batch', data=json.dumps([
+            {'timeout': '0.1', 'msg': 'hello'},
+            {'timeout': 0.1, 'msg': ['world']},
+        ]))
+        self.assertEqual(response.status, 201)
+        j = json.loads(response.text)
+        self.assertEqual(j['status'], 'created')
+        self.assertEqual(len(j['job_ids']), 2)
+        self.assertEqual(j['locations'][0], '/poll/' + j['job_ids'][0])
+
+        for x in range(50):
+            request, response = app.test_client.post(
+                '/batch/poll', data=json.dumps(j['job_ids'] + ['nothing']))
+            jobs = json.loads(response.text)['jobs']
+            if all(jobs[job_id]['status'] == 'success'
+                    for job_id in j['job_ids']):
+                break
+            sleep(0.1)
+        self.assertEqual(jobs[j['job_ids'][0]]['keys'], ['out'])
+        self.assertEqual(jobs['nothing'], {'error': 'no such job_id'})
+
+        request, response = app.test_client.get(j['locations'][1] + '/out')
+        self.assertEqual(response.text, 'world')
+
+    def test_batch_invalid(self):
+        app = self.create_app()
+        for body, error in (
+                ('{', 'request body must be a JSON array'),
+                ('{}', 'request body must be a JSON array'),
+                ('[]', 'batch is empty'),
+                ('[1]', 'job 0: must be a JSON object'),
+                ('[{"timeout": "0"}, {"timeout": "x", "msg": "x"}]',
+                    'job 0: missing or invalid arguments')):
+            request, response = app.test_client.post('/batch', data=body)
+            self.assertEqual(response.status, 400)
+            self.assertEqual(json.loads(response.text)['error'], error)
+        # nothing was started.
+        self.assertEqual(self.job_server.job_manager.status, {})
+
+    def test_jobs(self):
+        app = self.create_app()
+        request, response = app.test_client.post('/batch', data=json.dumps([
+            {'timeout': 0.01, 'msg': 'hello'},
+            {'timeout': 10, 'msg': 'world'},
+            {'timeout': 0, 'msg': 'fail'},
+        ]))
+        job_ids = json.loads(response.text)['job_ids']
+        for x in range(50):
+            request, response = app.test_client.get('/jobs?state=running')
+            if len(json.loads(response.text)['jobs']) == 1:
+                break
+            sleep(0.1)
+        j = json.loads(response.text)
+        self.assertEqual([job['id'] for job in j['jobs']], [job_ids[1]])
+        self.assertIsNone(j['jobs'][0]['finished'])
+        self.assertIsNone(j['next'])
+
+        for x in range(50):
+            request, response = app.test_client.get(
+                '/jobs?state=success,failed')
+            if len(json.loads(response.text)['jobs']) == 2:
+                break
+            sleep(0.1)
+        jobs = json.loads(response.text)['jobs']
+        self.assertEqual(
+            [job['id'] for job in jobs], [job_ids[0], job_ids[2]])
+        self.assertEqual(
+            [job['status'] for job in jobs], ['success', 'failure'])
+        self.assertEqual([job['returncode'] for job in jobs], [0, 1])
+
+        # all the jobs, a page at a time.
+        listed = []
+        location = '/jobs?limit=2'
+        while True:
+            request, response = app.test_client.get(location)
+            j = json.loads(response.text)
+            listed.extend(job['id'] for job in j['jobs'])
+            if j['next'] is None:
+                break
+            location = '/jobs?limit=2&after=' + j['next']
+        self.assertEqual(listed, job_ids)
+
+        # the cancelled job is no longer listed once it is evicted.
+        app.test_client.delete('/poll/' + job_ids[1])
+        for x in range(50):
+            request, response = app.test_client.get('/jobs')
+            if len(json.loads(response.text)['jobs']) == 2:
+                break
+            sleep(0.1)
+        self.assertEqual(
+            [job['id'] for job in json.loads(response.text)['jobs']],
+            [job_ids[0], job_ids[2]])
+
+        for query, error in (
+                ('state=done', "invalid state 'done'"),
+                ('after=x', 'invalid cursor'),
+                ('limit=x', 'invalid limit'),
+                ('limit=0', 'limit must be between 1 and 1000')):
+            request, response = app.test_client.get('/jobs?' + query)
+            self.assertEqual(response.status, 400)
+            self.assertEqual(json.loads(response.text)['error'], error)
+
+    def test_results_compressed(self):
+        app = self.create_app()
+        self.job_server.job_manager.compress_threshold = 0
+        request, response = app.test_client.post('/execute', data={
+            'timeout': '0.01',
+            'msg': 'hello',
+        })
+        location = json.loads(response.text)['location']
+        request, response = app.test_client.get(location + '?wait=5')
+        self.assertEqual(json.loads(response.text)['keys'], ['out'])
+
+        request, response = app.test_client.get(
+            location + '/out', headers={'Accept-Encoding': 'gzip'})
+        self.assertEqual(response.headers['Content-Encoding'], 'gzip')
+        self.assertEqual(response.headers['Vary'], 'Accept-Encoding')
+        # the test client transparently decodes the content.
+        self.assertEqual(response.text, 'hello')
+        etag = response.headers['ETag']
+
+        request, response = app.test_client.get(
+            location + '/out', headers={'Accept-Encoding': 'identity'})
+        self.assertNotIn('Content-Encoding', response.headers)
+        self.assertNotEqual(response.headers['ETag'], etag)
+        self.assertEqual(response.text, 'hello')
+
+        # the cached copy is never listed.
+        request, response = app.test_client.get(location)
+        self.assertEqual(json.loads(response.text)['keys'], ['out'])
+
+    def test_archive(self):
+        app = self.create_app()
+        request, response = app.test_client.post('/execute', data={
+            'timeout': '0.2',
+            'msg': 'hello',
+        })
+        location = json.loads(response.text)['location']
+        archive_url = '/archive/' + location.split('/')[-1]
+
+        request, response = app.test_client.get(archive_url)
+        self.assertEqual(response.status, 409)
+
+        request, response = app.test_client.get(location + '?wait=5')
+        self.assertEqual(json.loads(response.text)['status'], 'success')
+
+        request, response = app.test_client.get(archive_url)
+        self.assertEqual(response.status, 200)
+        self.assertEqual(
+            response.headers['Content-Type'], 'application/gzip')
+        with tarfile.open(
+                fileobj=io.BytesIO(response.body), mode='r:gz') as tar:
+            self.assertEqual(tar.getnames(), ['out'])
+            self.assertEqual(tar.extractfile('out').read(), b'hello')
+
+        request, response = app.test_client.get(
+            archive_url + '?format=zip&glob=*.txt')
+        if 'zip' in FORMATS:
+            with zipfile.ZipFile(io.BytesIO(response.body)) as archive:
+                self.assertEqual(archive.namelist(), [])
+        else:
+            self.assertEqual(response.status, 400)
+
+        request, response = app.test_client.get(archive_url + '?format=rar')
+        self.assertEqual(response.status, 400)
+
+    def test_logs(self):
+        app = self.create_app()
+        request, response = app.test_client.post('/execute', data={
+            'timeout': '0.5',
+            'msg': 'hello',
+        })
+        job_id = json.loads(response.text)['location'].split('/')[-1]
+
+        # followed until the output is closed as the job finishes.
+        request, response = app.test_client.get(
+            '/logs/%s/stdout?follow=1' % job_id)
+        self.assertEqual(response.status, 200)
+        self.assertEqual(response.headers['X-Log-Offset'], '0')
+        self.assertEqual(response.text, 'hello')
+
+        request, response = app.test_client.get(
+            '/logs/%s/stdout?offset=-3' % job_id)
+        self.assertEqual(response.headers['X-Log-Offset'], '2')
+        self.assertEqual(response.headers['X-Log-Closed'], 'true')
+        self.assertEqual(response.text, 'llo')
+
+        request, response = app.test_client.get('/logs/%s/stdin' % job_id)
+        self.assertEqual(response.status, 404)
+        request, response = app.test_client.get(
+            '/logs/%s/stdout?offset=x' % job_id)
+        self.assertEqual(response.status, 400)
+        request, response = app.test_client.get('/logs/nosuchjob/stdout')
+        self.assertEqual(response.status, 404)
+
+    def test_execute_after(self):
+        app = self.create_app()
+        request, response = app.test_client.post('/execute', data={
+            'timeout': '0.3',
+            'msg': 'hello',
+        })
+        upstream = json.loads(response.text)['location'].split('/')[-1]
+        request, response = app.test_client.post(
+            '/execute?after=' + upstream, data={
+                'timeout': '0.01',
+                'msg': 'world',
+            })
+        self.assertEqual(response.status, 201)
+        location = json.loads(response.text)['location']
+
+        request, response = app.test_client.get(location)
+        self.assertEqual(json.loads(response.text), {
+            'status': 'queued',
+            'dag': {'upstream': {upstream: 'running'}},
+        })
+        request, response = app.test_client.get(location + '?wait=5')
+        request, response = app.test_client.get(location + '?wait=5')
+        result = json.loads(response.text)
+        self.assertEqual(result['status'], 'success')
+        self.assertEqual(result['dag'], {'upstream': {upstream: 'success'}})
+
+        # blocked by a failed upstream job.
+        request, response = app.test_client.post('/execute', data={
+            'timeout': '0',
+            'msg': 'fail',
+        })
+        failed = json.loads(response.text)['location'].split('/')[-1]
+        request, response = app.test_client.get('/poll/%s?wait=5' % failed)
+        request, response = app.test_client.post(
+            '/execute?after=%s,%s' % (upstream, failed), data={
+                'timeout': '0.01',
+                'msg': 'never',
+            })
+        location = json.loads(response.text)['location']
+        request, response = app.test_client.get(location)
+        self.assertEqual(response.status, 400)
+        self.assertEqual(json.loads(response.text)['dag'], {
+            'upstream': {upstream: 'success', failed: 'failure'},
+            'blocked_by': failed,
+        })
+
+        request, response = app.test_client.post(
+            '/execute?after=nosuchjob', data={
+                'timeout': '0.01',
+                'msg': 'never',
+            })
+        self.assertEqual(response.status, 400)
+
+    def test_remote_agent(self):
+        agent = Agent(DummyManager())
+        agent.start()
+        self.addCleanup(agent.stop)
+        job_server = JobServer(
+            RemoteDummyManager(agents=[agent.url], poll_interval=0.05),
+            hook_start_stop=False)
+        app = Sanic()
+        job_server.register(app)
+        job_server.start(None, None)
+        self.addCleanup(job_server.stop, None, None)
+
+        request, response = app.test_client.post('/execute', data={
+            'timeout': '0.01',
+            'msg': 'hello',
+        })
+        location = json.loads(response.text)['location']
+        request, response = app.test_client.get(location + '?wait=5')
+        self.assertEqual(json.loads(response.text), {
+            'status': 'success', 'keys': ['out']})
+
+        # served by the agent.
+        request, response = app.test_client.get(location + '/out')
+        self.assertEqual(response.status, 200)
+        self.assertEqual(response.text, 'hello')
+        request, response = app.test_client.get(location + '/nothing')
+        self.assertEqual(response.status, 404)
+
+        request, response = app.test_client.get(
+            '/archive/%s?format=tar' % location.split('/')[-1])
+        with tarfile.open(fileobj=io.BytesIO(response.body)) as tar:
+            self.assertEqual(tar.extractfile('out').read(), b'hello')
+
+    def test_admission(self):
+        job_server = JobServer(
+            DummyManager(), hook_start_stop=False,
+            admission=AdmissionControl(rate=0.01, burst=2, max_inflight=3))
+        app = Sanic()
+        job_server.register(app)
+        job_server.start(None, None)
+        self.addCleanup(job_server.stop, None, None)
+
+        request, response = app.test_client.post(
+            '/batch', data=json.dumps([{'timeout': 10, 'msg': 'hello'}] * 4))
+        self.assertEqual(response.status, 400)
+        request, response = app.test_client.post('/execute', data={
+            'timeout': '10',
+            'msg': 'hello',
+        })
+        self.assertEqual(response.status, 201)
+        request, response = app.test_client.post('/execute', data={
+            'timeout': 'xxxx',
+            'msg': 'hello',
+        })
+        self.assertEqual(response.status, 400)
+        request, response = app.test_client.post('/execute', data={
+            'timeout': '10',
+            'msg': 'hello',
+        })
+        self.assertEqual(response.status, 429)
+        self.assertEqual(
+            json.loads(response.text)['error'], 'rate limit exceeded')
+        self.assertEqual(response.headers['Retry-After'], '100')
+
+        # the invalid request was released, the other one is in flight.
+        self.assertEqual(
+            list(job_server.admission.clients.values()), [1])
+        request, response = app.test_client.get('/metrics')
+        self.assertIn(
+            'repodono_jobs_rejected_total{status="429"} 1', response.text)
+
+    def test_upload(self):
+        job_server = JobServer(
+            UploadManager(), hook_start_stop=False, max_upload_size=1024)
+        # written out as each of the chunks arrive.
+        job_server.upload_batch_size = 1
+        app = Sanic()
+        job_server.register(app)
+        job_server.start(None, None)
+        self.addCleanup(job_server.stop, None, None)
+
+        request, response = app.test_client.post(
+            '/upload', data=b'x' * 1000,
+            headers={'Content-Type': 'application/octet-stream'})
+        self.assertEqual(response.status, 201)
+        location = json.loads(response.text)['location']
+        request, response = app.test_client.get(location + '?wait=5')
+        # the inputs are not among the results.
+        self.assertEqual(json.loads(response.text), {
+            'status': 'success', 'keys': ['out']})
+        request, response = app.test_client.get(location + '/out')
+        self.assertEqual(response.body, b'x' * 1000)
+
+        body = b'\r\n'.join([
+            b'--boundary',
+            b'Content-Disposition: form-data; name="input"; filename="a"',
+            b'',
+            b'hello',
+            b'--boundary--',
+        ])
+        request, response = app.test_client.post(
+            '/upload', data=body, headers={
+                'Content-Type': 'multipart/form-data; boundary=boundary'})
+        self.assertEqual(response.status, 201)
+        location = json.loads(response.text)['location']
+        request, response = app.test_client.get(location + '?wait=5')
+        request, response = app.test_client.get(location + '/out')
+        self.assertEqual(response.text, 'hello')
+
+        request, response = app.test_client.post(
+            '/upload', data=b'x' * 1025,
+            headers={'Content-Type': 'application/octet-stream'})
+        self.assertEqual(response.status, 413)
+        request, response = app.test_client.post(
+            '/upload', data=body[:-4], headers={
+                'Content-Type': 'multipart/form-data; boundary=boundary'})
+        self.assertEqual(response.status, 400)
+        # the working directories of the rejected uploads are removed.
+        self.assertEqual(len(listdir(job_server.job_manager.root)), 2)
@@ -0,0 +1,131 @@
+# -*- coding: utf-8 -*-
+"""
+Admission control test case
+"""
+
+import unittest
+
+from repodono.jobs.admission import AdmissionControl
+from repodono.jobs.admission import TokenBucket
+from repodono.jobs.manager import JobStatus
+from repodono.jobs.manager import EVICTED
+from repodono.jobs.manager import QUEUED
+from repodono.jobs.manager import SUCCESS
+from repodono.jobs.metrics import JobMetrics
+
+
+class Clock(object):
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def status(state):
+    status = JobStatus()
+    status.state = state
+    return status
+
+
+class TokenBucketTestCase(unittest.TestCase):
+
+    def test_take(self):
+        bucket = TokenBucket(2, 4, 0)
+        self.assertEqual(bucket.take(4, 0), 0)
+        self.assertEqual(bucket.take(1, 0), 0.5)
+        self.assertEqual(bucket.take(1, 0.5), 0)
+        # never refilled beyond the burst.
+        self.assertEqual(bucket.take(4, 100), 0)
+        self.assertEqual(bucket.take(3, 100), 1.5)
+
+
+class AdmissionControlTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = Clock()
+
+    def test_rate(self):
+        admission = AdmissionControl(rate=1, burst=2, clock=self.clock)
+        self.assertIsNone(admission.admit('a', 0))
+        self.assertIsNone(admission.admit('a', 0))
+        self.assertEqual(
+            admission.admit('a', 0), (429, 1, 'rate limit exceeded'))
+        # the other clients have their own buckets.
+        self.assertIsNone(admission.admit('b', 0))
+        self.clock.now += 1
+        self.assertIsNone(admission.admit('a', 0))
+        self.assertEqual(admission.admit('b', 0, 3)[0], 400)
+        self.assertIsNone(admission.admit('b', 0, 2))
+        self.assertEqual(admission.admit('b', 0, 2).retry_after, 2)
+        self.assertEqual(admission.rejected, {429: 2})
+
+    def test_max_clients(self):
+        admission = AdmissionControl(rate=1, clock=self.clock)
+        admission.max_clients = 2
+        for key in 'abc':
+            self.assertIsNone(admission.admit(key, 0))
+        self.assertEqual(list(admission.buckets), ['b', 'c'])
+
+    def test_max_inflight(self):
+        admission = AdmissionControl(max_inflight=4, clock=self.clock)
+        self.assertIsNone(admission.admit('a', 0, 2))
+        self.assertEqual(admission.admit('a', 0, 5)[0], 400)
+        # the reserved jobs are counted until bound or released.
+        self.assertEqual(admission.admit('b', 2, 1), (
+            503, 1, 'server is over capacity'))
+        admission.bind('a', '/wd/1', status(QUEUED))
+        admission.release('a')
+        self.assertEqual(admission.clients, {'a': 1})
+        self.assertEqual(admission.reserved, 0)
+        self.assertEqual(admission.owners, {'/wd/1': 'a'})
+
+        # finished, and memoized jobs are not in flight.
+        self.assertIsNone(admission.admit('a', 1, 2))
+        admission.bind('a', '/wd/1', status(QUEUED))
+        admission.bind('a', '/wd/2', status(SUCCESS))
+        self.assertEqual(admission.clients, {'a': 1})
+        admission('/wd/1', status(SUCCESS))
+        self.assertEqual(admission.clients, {})
+        self.assertEqual(admission.owners, {})
+        admission('/wd/1', status(EVICTED))
+        self.assertEqual(len(admission.drained), 1)
+
+    def test_retry_after(self):
+        admission = AdmissionControl(max_inflight=2, clock=self.clock)
+        self.assertIsNone(admission.drain_rate())
+        # four jobs drained over two seconds.
+        for x in range(4):
+            admission('/wd/%d' % x, status(SUCCESS))
+            self.clock.now += 0.5
+        self.assertEqual(admission.drain_rate(), 2.0)
+        self.assertEqual(admission.admit('a', 8).retry_after, 4)
+        self.assertEqual(admission.admit('a', 2).retry_after, 1)
+        # the rate decays as no more jobs finish.
+        self.clock.now += 1000
+        self.assertEqual(admission.admit('a', 2).retry_after, 251)
+        admission.max_retry_after = 60
+        self.assertEqual(admission.admit('a', 2).retry_after, 60)
+
+    def test_fair_share(self):
+        admission = AdmissionControl(max_inflight=4, clock=self.clock)
+        for x in range(3):
+            self.assertIsNone(admission.admit('a', x))
+            admission.bind('a', '/wd/a%d' % x, status(QUEUED))
+        # a second client halves the share of the first.
+        self.assertIsNone(admission.admit('b', 3))
+        admission.bind('b', '/wd/b0', status(QUEUED))
+        admission('/wd/a0', status(SUCCESS))
+        self.assertEqual(admission.admit('a', 3), (
+            429, 1, 'too many jobs in flight for client'))
+        self.assertIsNone(admission.admit('b', 3))
+        self.assertEqual(admission.clients, {'a': 2, 'b': 2})
+
+    def test_metrics(self):
+        admission = AdmissionControl(rate=1, clock=self.clock)
+        admission.admit('a', 0)
+        admission.admit('a', 0)
+        self.assertIn(
+            'repodono_jobs_rejected_total{status="429"} 1',
+            JobMetrics().render(admission=admission))
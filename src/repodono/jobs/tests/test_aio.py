@@ -0,0 +1,10 @@
+# -*- coding: utf-8 -*-
+import sys
+
+if sys.version_info > (3, 5):  # pragma: no cover
+    from repodono.jobs.tests._test_aio import AsyncJobManagerTestCase
+else:  # pragma: no cover
+    AsyncJobManagerTestCase = None
+
+
+__all__ = ['AsyncJobManagerTestCase']
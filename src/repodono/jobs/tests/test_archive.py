@@ -0,0 +1,90 @@
+# -*- coding: utf-8 -*-
+"""
+Archive test case
+"""
+
+import io
+import sys
+import tarfile
+import unittest
+import zipfile
+from os import chmod
+from os import makedirs
+from os import utime
+from os.path import join
+from tempfile import TemporaryDirectory
+
+from repodono.jobs.archive import FORMATS
+from repodono.jobs.archive import iter_tar
+from repodono.jobs.archive import iter_tar_gz
+from repodono.jobs.archive import iter_zip
+
+
+class ArchiveTestCase(unittest.TestCase):
+
+    def setUp(self):
+        tempdir = TemporaryDirectory()
+        self.addCleanup(tempdir.cleanup)
+        self.root = tempdir.name
+        makedirs(join(self.root, 'sub'))
+        self.contents = {
+            'empty': b'',
+            'small': b'hello',
+            'sub/large': b'0123456789' * 1000,
+        }
+        self.entries = []
+        for name, data in sorted(self.contents.items()):
+            with open(join(self.root, name), 'wb') as fd:
+                fd.write(data)
+            self.entries.append((name, join(self.root, name)))
+
+    def test_tar(self):
+        chunks = list(iter_tar(self.entries, chunk_size=1024))
+        # the content is streamed in chunks of bounded size.
+        self.assertLessEqual(
+            max(len(chunk) for chunk in chunks), tarfile.RECORDSIZE)
+        with tarfile.open(fileobj=io.BytesIO(b''.join(chunks))) as tar:
+            self.assertEqual(tar.getnames(), ['empty', 'small', 'sub/large'])
+            for name, data in self.contents.items():
+                self.assertEqual(tar.extractfile(name).read(), data)
+
+    def test_tar_gz(self):
+        data = b''.join(iter_tar_gz(self.entries))
+        with tarfile.open(fileobj=io.BytesIO(data), mode='r:gz') as tar:
+            self.assertEqual(
+                tar.extractfile('sub/large').read(),
+                self.contents['sub/large'])
+
+    def test_tar_vanished(self):
+        entries = self.entries + [('missing', join(self.root, 'missing'))]
+        data = b''.join(iter_tar(entries))
+        with tarfile.open(fileobj=io.BytesIO(data)) as tar:
+            self.assertEqual(tar.getnames(), ['empty', 'small', 'sub/large'])
+
+    @unittest.skipIf('zip' not in FORMATS, 'zip requires Python 3.6')
+    def test_zip(self):
+        chunks = list(iter_zip(self.entries, chunk_size=1024))
+        self.assertGreater(len(chunks), 2)
+        with zipfile.ZipFile(io.BytesIO(b''.join(chunks))) as archive:
+            self.assertEqual(
+                archive.namelist(), ['empty', 'small', 'sub/large'])
+            self.assertIsNone(archive.testzip())
+            for name, data in self.contents.items():
+                self.assertEqual(archive.read(name), data)
+
+    @unittest.skipIf('zip' not in FORMATS, 'zip requires Python 3.6')
+    def test_zip_info(self):
+        path = join(self.root, 'small')
+        chmod(path, 0o640)
+        utime(path, (0, 0))
+        with zipfile.ZipFile(io.BytesIO(b''.join(
+                iter_zip([('small', path)])))) as archive:
+            info = archive.getinfo('small')
+        # as far back as the zip timestamps go.
+        self.assertEqual(info.date_time, (1980, 1, 1, 0, 0, 0))
+        self.assertEqual(info.external_attr >> 16, 0o100640)
+        self.assertEqual(info.file_size, 5)
+
+    def test_formats(self):
+        self.assertEqual(sorted(FORMATS), ['tar', 'tar.gz'] + (
+            ['zip'] if sys.version_info >= (3, 6) else []))
@@ -0,0 +1,50 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark harness test case
+"""
+
+import json
+import unittest
+from os.path import join
+from tempfile import TemporaryDirectory
+
+from repodono.jobs import bench
+
+
+class PercentileTestCase(unittest.TestCase):
+
+    def test_percentile(self):
+        values = list(range(1, 101))
+        self.assertIsNone(bench.percentile([], 50))
+        self.assertEqual(bench.percentile(values, 50), 50)
+        self.assertEqual(bench.percentile(values, 99), 99)
+        self.assertEqual(bench.percentile(values, 100), 100)
+        self.assertEqual(bench.percentile([3], 99), 3)
+
+
+class BenchManagerTestCase(unittest.TestCase):
+
+    def test_bench_manager(self):
+        manager = bench.NoopManager(max_concurrent=2)
+        manager.start()
+        self.addCleanup(manager.stop)
+        report = bench.bench_manager(manager, jobs=4)
+        self.assertTrue(report['completed'])
+        self.assertEqual(report['run_latency']['count'], 4)
+        self.assertEqual(report['turnaround']['count'], 4)
+        self.assertGreater(report['jobs_per_sec'], 0)
+
+    def test_bench_spawn(self):
+        reports = bench.bench_spawn('spawner', ballast=(0, 1 << 20), jobs=2)
+        self.assertEqual([r['ballast'] for r in reports], [0, 1 << 20])
+        self.assertEqual(reports[0]['count'], 2)
+
+    def test_main_output(self):
+        with TemporaryDirectory() as tmpdir:
+            target = join(tmpdir, 'bench.json')
+            bench.main([
+                '--manager', 'noop', '--jobs', '2', '--output', target])
+            with open(target) as fd:
+                results = json.load(fd)
+        self.assertEqual(list(results['benchmarks']), ['noop'])
+        self.assertEqual(results['benchmarks']['noop']['jobs'], 2)
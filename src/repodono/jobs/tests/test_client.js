@@ -112,7 +112,9 @@ describe('repodono/jobs/client test case with dummy', function() {
             'object': {},
         };
 
-        this.server.respondWith('GET', '/poll/1', function (xhr) {
+        var poll_url = /\/poll\/1(\?wait=\d+)?$/;
+        this.server.respondWith('GET', poll_url, function (xhr) {
+            response.last_url = xhr.url;
             xhr.respond(
                 response.status, response.headers,
                 JSON.stringify(response.object)
@@ -155,6 +157,24 @@ describe('repodono/jobs/client test case with dummy', function() {
         expect(cli.last_keys).to.deep.equal(['key1', 'key2']);
     });
 
+    it('test execute queued with wait', function() {
+        var cli = new DummyClient({'poll_wait': 30});
+        cli.execute();
+        this.clock.tick(100);
+        expect(logs[0]).to.deep.equal(['status', 'job created']);
+
+        response.object.status = 'queued';
+        this.clock.tick(100);
+        expect(logs[1]).to.deep.equal(['status', 'job queued']);
+        expect(response.last_url).to.equal('/poll/1?wait=30');
+
+        response.object.status = 'success';
+        response.object.keys = ['key1'];
+        this.clock.tick(100);
+        expect(logs[2]).to.deep.equal(['status', 'success']);
+        expect(cli.last_poll_url).to.equal('/poll/1');
+    });
+
     it('test execute default error', function() {
         var cli = new DummyClient({});
         cli.execute();
@@ -0,0 +1,62 @@
+# -*- coding: utf-8 -*-
+"""
+Content encoding test case
+"""
+
+import gzip
+import unittest
+from os import listdir
+from os.path import join
+from tempfile import TemporaryDirectory
+from unittest import mock
+
+from repodono.jobs import compress
+from repodono.jobs.compress import compress_file
+from repodono.jobs.compress import negotiate
+
+
+class NegotiateTestCase(unittest.TestCase):
+
+    def test_negotiate(self):
+        encodings = ['br', 'gzip']
+        self.assertIsNone(negotiate(None, encodings))
+        self.assertIsNone(negotiate('', encodings))
+        self.assertIsNone(negotiate('identity', encodings))
+        self.assertEqual(negotiate('gzip', encodings), 'gzip')
+        self.assertEqual(negotiate('gzip, deflate, br', encodings), 'br')
+        self.assertEqual(negotiate('gzip, br;q=0.5', encodings), 'gzip')
+        self.assertEqual(negotiate('*', encodings), 'br')
+        self.assertEqual(negotiate('*, br;q=0', encodings), 'gzip')
+        self.assertIsNone(negotiate('gzip;q=0', encodings))
+        self.assertIsNone(negotiate('gzip;q=bad', encodings))
+        self.assertEqual(negotiate('GZIP', encodings), 'gzip')
+
+    def test_negotiate_available(self):
+        self.assertEqual(negotiate('gzip'), 'gzip')
+        self.assertIsNone(negotiate('compress'))
+
+
+class CompressFileTestCase(unittest.TestCase):
+
+    def test_compress_file(self):
+        with TemporaryDirectory() as root:
+            source = join(root, 'source')
+            with open(source, 'wb') as fd:
+                fd.write(b'hello world' * 100)
+            compress_file(source, join(root, 'target.gz'), 'gzip')
+            with open(join(root, 'target.gz'), 'rb') as fd:
+                self.assertEqual(
+                    gzip.decompress(fd.read()), b'hello world' * 100)
+            self.assertEqual(sorted(listdir(root)), ['source', 'target.gz'])
+
+    def test_compress_file_failure(self):
+        def broken(src, dst):
+            raise OSError('broken')
+
+        with TemporaryDirectory() as root:
+            source = join(root, 'source')
+            open(source, 'wb').close()
+            with mock.patch.dict(compress.ENCODERS, {'gzip': ('', broken)}):
+                with self.assertRaises(OSError):
+                    compress_file(source, join(root, 'target.gz'), 'gzip')
+            self.assertEqual(listdir(root), ['source'])
@@ -3,21 +3,107 @@
 Simple lifecycles test cases
 """
 
+import gzip
 import io
 import logging
 import unittest
 from textwrap import dedent
 
+import os
+import signal
 import sys
 from os.path import exists
+from os.path import isdir
 from os.path import join
+from tempfile import TemporaryDirectory
+from threading import Event
+from threading import current_thread
+from threading import Timer
 from time import sleep
+from unittest import mock
 
+from repodono.jobs import watcher
 from repodono.jobs.manager import JobManager
+from repodono.jobs.manager import QUEUED
+from repodono.jobs.manager import RUNNING
+from repodono.jobs.manager import SUCCESS
+from repodono.jobs.manager import FAILURE
+from repodono.jobs.manager import EVICTED
+from repodono.jobs.manager import KILLED
+from repodono.jobs.manager import TIMEOUT
+from repodono.jobs.manager import CANCELLED
+from repodono.jobs.limits import ResourceLimits
+from repodono.jobs.output import RingLog
+from repodono.jobs.retention import RetentionPolicy
 from repodono.jobs.manager import logger as manager_logger
 
 
-class DummyManagerTestCase(unittest.TestCase):
+def wait_until(predicate, timeout=5.0, interval=0.02):
+    """
+    Poll the predicate until its result is true or the timeout has
+    passed; return its last result.
+    """
+
+    for x in range(int(timeout / interval)):
+        result = predicate()
+        if result:
+            return result
+        sleep(interval)
+    return predicate()
+
+
+class ProgManager(JobManager):
+    """
+    Runs the python code prog in the working_dir.
+    """
+
+    def get_args(self, working_dir, prog, **kw):
+        return (sys.executable, '-c', 'import os; os.chdir(%r)\n%s' % (
+            working_dir, dedent(prog)))
+
+    def get_limits(self, prog, **kw):
+        if 'getrlimit' in prog:
+            return self.limits.replace(open_files=16)
+        return self.limits
+
+
+class ManagerTestCase(unittest.TestCase):
+    """
+    Base for the test cases of a started DummyManager, created with the
+    manager_kw.
+    """
+
+    DummyManager = ProgManager
+    manager_kw = {}
+
+    def setUp(self):
+        self.manager = self.DummyManager(**self.manager_kw)
+        self.manager.start()
+        self.addCleanup(self.manager.stop)
+
+    def wait_for(self, working_dir, timeout=5.0):
+        # the state the job has finished in, or is still in.
+        wait_until(lambda: self.manager.poll(working_dir) not in (
+            QUEUED, RUNNING), timeout)
+        return self.manager.poll(working_dir)
+
+    def wait_evicted(self, working_dir, timeout=5.0):
+        wait_until(lambda: working_dir not in self.manager.status, timeout)
+        return not exists(working_dir)
+
+    def run_job(self, **kw):
+        working_dir = self.manager.run(**kw)
+        self.wait_for(working_dir)
+        return working_dir
+
+    def logs_size(self, working_dir):
+        # the size of the captured output, counted in that of the job.
+        return sum(
+            os.path.getsize(self.manager.log_path(working_dir, name))
+            for name in self.manager.log_names)
+
+
+class DummyManagerTestCase(ManagerTestCase):
 
     class DummyManager(JobManager):
         def get_args(self, working_dir, s, t, **kw):
@@ -39,15 +125,11 @@ class DummyManagerTestCase(unittest.TestCase):
             return (sys.executable, '-c', prog)
 
     def setUp(self):
-        self.manager = self.DummyManager()
-        self.manager.start()
+        super(DummyManagerTestCase, self).setUp()
         self.stream = io.StringIO()
         self.handler = logging.StreamHandler(self.stream)
         manager_logger.addHandler(self.handler)
-
-    def tearDown(self):
-        self.manager.stop()
-        manager_logger.removeHandler(self.handler)
+        self.addCleanup(manager_logger.removeHandler, self.handler)
 
     def test_execute(self):
         working_dir = self.manager.run(s='hello', t=0.1)
@@ -61,8 +143,771 @@ class DummyManagerTestCase(unittest.TestCase):
         self.assertEqual(self.manager.get_result_by_key(
             working_dir, 'out'), 'hello')
 
+    def test_results(self):
+        working_dir = self.manager.run(s='hello', t=0)
+        self.assertEqual(self.manager.list_result_keys(working_dir), [])
+        # not cached for jobs that are still running.
+        self.assertEqual(self.manager.listings, {})
+        self.assertEqual(self.wait_for(working_dir), SUCCESS)
+
+        self.assertEqual(self.manager.list_result_keys(working_dir), ['out'])
+        self.assertEqual(self.manager.listings, {working_dir: ('out',)})
+        with open(join(working_dir, 'extra'), 'w'):
+            pass
+        self.assertEqual(self.manager.list_result_keys(working_dir), ['out'])
+        self.manager.invalidate(working_dir)
+        self.assertEqual(sorted(self.manager.list_result_keys(working_dir)), [
+            'extra', 'out'])
+
+        with self.manager.open_result(working_dir, 'out') as fd:
+            self.assertEqual(fd.read(), b'hello')
+
+        view = self.manager.get_result_view(working_dir, 'out')
+        self.assertEqual(view.tobytes(), b'hello')
+        self.assertTrue(view.readonly)
+        self.assertEqual(
+            self.manager.get_result_view(working_dir, 'extra').tobytes(), b'')
+
+        self.manager.mmap_threshold = 2
+        view = self.manager.get_result_view(working_dir, 'out')
+        self.assertEqual(view[1:3].tobytes(), b'el')
+        self.assertTrue(view.readonly)
+        view.release()
+
+        with self.assertRaises(KeyError):
+            self.manager.open_result(working_dir, 'nothing')
+
+    def test_status(self):
+        finished = Event()
+        results = []
+
+        def callback(working_dir, status):
+            results.append((working_dir, status.state))
+            if status.state == SUCCESS:
+                finished.set()
+
+        self.manager.subscribe(callback)
+        working_dir = self.manager.run(s='hello', t=0)
+        status = self.manager.status[working_dir]
+        self.assertIsNotNone(status.submitted)
+        self.assertIsNotNone(status.started)
+        self.assertTrue(finished.wait(5))
+        self.assertEqual(results, [
+            (working_dir, RUNNING), (working_dir, SUCCESS)])
+        self.assertEqual(self.manager.poll(working_dir), SUCCESS)
+        self.assertEqual(status.returncode, 0)
+        self.assertGreaterEqual(status.finished, status.started)
+
+        self.manager.unsubscribe(callback)
+        self.assertEqual(self.manager.callbacks, [])
+
+    def test_status_accounting(self):
+        finished = Event()
+        self.manager.subscribe(
+            lambda wd, status: status.state == SUCCESS and finished.set())
+        working_dir = self.manager.run(s='hello', t=0)
+        self.assertTrue(finished.wait(5))
+        status = self.manager.status[working_dir]
+        self.assertGreaterEqual(status.queue_time, 0)
+        self.assertGreaterEqual(status.wall_time, 0)
+        self.assertEqual(status.size, 5 + self.logs_size(working_dir))
+        if hasattr(os, 'wait4'):
+            self.assertGreater(status.utime + status.stime, 0)
+            self.assertGreater(status.maxrss, 0)
+
+    def test_status_failure(self):
+        working_dir = self.manager.run(s='hello', t=-1)
+        self.assertEqual(self.wait_for(working_dir), FAILURE)
+        self.assertEqual(self.manager.status[working_dir].returncode, 1)
+
+    def test_callback_error(self):
+        finished = Event()
+
+        def callback(working_dir, status):
+            finished.set()
+            raise Exception('broken')
+
+        self.manager.subscribe(callback)
+        self.manager.run(s='hello', t=0)
+        self.assertTrue(finished.wait(5))
+        sleep(0.05)
+        self.assertIn('error in completion callback', self.stream.getvalue())
+
     def test_stray_process(self):
         self.manager.run(s='hello', t=0.05)
         self.manager.stop()
         self.assertIn('is still running', self.stream.getvalue())
         sleep(0.2)  # to actually let it terminate
+
+    def test_stop_finishing_without_pidfd(self):
+        finished = []
+
+        def cleanup(working_dir, process):
+            # the job finishes while the processes are being cleaned up.
+            process.wait()
+            finished.append(wait_until(
+                lambda: working_dir not in self.manager.mapping))
+
+        self.manager._cleanup_subprocess = cleanup
+        with mock.patch.object(watcher, 'pidfd_open', None):
+            working_dir = self.manager.run(s='hello', t=0.2)
+        self.manager.stop()
+        self.assertEqual(finished, [True])
+        self.assertEqual(self.manager.poll(working_dir), SUCCESS)
+
+
+class CompressTestCase(ManagerTestCase):
+
+    DummyManager = DummyManagerTestCase.DummyManager
+
+    def test_compressed_result(self):
+        working_dir = self.run_job(s='x' * 2000, t=0)
+        path = self.manager.get_compressed_result(working_dir, 'out', 'gzip')
+        self.assertEqual(path, join(working_dir, '.compressed', 'out.gz'))
+        mtime = os.stat(path).st_mtime_ns
+        with self.manager.open_compressed_result(
+                working_dir, 'out', 'gzip') as fd:
+            self.assertEqual(gzip.decompress(fd.read()), b'x' * 2000)
+        # cached.
+        self.assertEqual(os.stat(path).st_mtime_ns, mtime)
+
+        self.manager.invalidate(working_dir)
+        self.assertEqual(self.manager.list_result_keys(working_dir), ['out'])
+        self.assertIsNone(
+            self.manager.lookup_path(working_dir, '.compressed/out.gz'))
+        with self.assertRaises(KeyError):
+            self.manager.get_compressed_result(working_dir, 'nothing', 'gzip')
+
+    def test_compressed_result_small(self):
+        working_dir = self.run_job(s='hello', t=0)
+        self.assertIsNone(
+            self.manager.get_compressed_result(working_dir, 'out', 'gzip'))
+        self.assertIsNone(
+            self.manager.open_compressed_result(working_dir, 'out', 'gzip'))
+
+    def test_compressed_result_running(self):
+        working_dir = self.manager.run(s='x' * 2000, t=0.2)
+        self.assertIsNone(
+            self.manager.get_compressed_result(working_dir, 'out', 'gzip'))
+
+    def test_precompress(self):
+        self.manager.precompress = ('gzip',)
+        working_dir = self.run_job(s='x' * 2000, t=0)
+        path = join(working_dir, '.compressed', 'out.gz')
+        self.assertTrue(wait_until(lambda: exists(path)))
+        with open(path, 'rb') as fd:
+            self.assertEqual(gzip.decompress(fd.read()), b'x' * 2000)
+
+    def test_precompress_stop(self):
+        started = Event()
+        release = Event()
+        compressed = []
+
+        def precompress(working_dir):
+            started.set()
+            release.wait(5)
+            compressed.append(working_dir)
+
+        self.manager._precompress = precompress
+        self.manager.precompress = ('gzip',)
+        first = self.run_job(s='first', t=0)
+        self.run_job(s='second', t=0)
+        self.assertTrue(started.wait(5))
+        # the one being compressed is waited on, the other cancelled.
+        Timer(0.1, release.set).start()
+        self.manager.stop()
+        self.assertEqual(compressed, [first])
+        self.assertEqual(self.manager.compressing, set())
+
+
+class SchedulerTestCase(ManagerTestCase):
+
+    class DummyManager(DummyManagerTestCase.DummyManager):
+        def get_priority(self, s, t, **kw):
+            return -t
+
+    manager_kw = {'max_concurrent': 1}
+
+    def test_queued(self):
+        wd1 = self.manager.run(s='first', t=0.1)
+        wd2 = self.manager.run(s='second', t=0.0)
+        self.assertEqual(self.manager.poll(wd1), RUNNING)
+        self.assertEqual(self.manager.poll(wd2), QUEUED)
+        self.assertNotIn(wd2, self.manager.mapping)
+
+        # the queued job is started without being polled.
+        sleep(0.5)
+        self.assertEqual(self.manager.status[wd1].state, SUCCESS)
+        self.assertIsNotNone(self.manager.status[wd2].started)
+        self.assertEqual(self.wait_for(wd2), SUCCESS)
+        self.assertEqual(self.manager.get_result_by_key(wd2, 'out'), 'second')
+
+    def test_priority(self):
+        wd1 = self.manager.run(s='first', t=0.1)
+        wd2 = self.manager.run(s='second', t=0.0)
+        wd3 = self.manager.run(s='third', t=0.05)
+        self.assertEqual(self.wait_for(wd1), SUCCESS)
+        # the third job has the higher priority.
+        self.assertEqual(self.manager.poll(wd3), RUNNING)
+        self.assertEqual(self.manager.poll(wd2), QUEUED)
+        self.assertEqual(self.wait_for(wd2), SUCCESS)
+
+    def test_run_batch(self):
+        wd1, wd2, wd3 = self.manager.run_batch([
+            {'s': 'first', 't': 0.0},
+            {'s': 'second', 't': 0.1},
+            {'s': 'third', 't': 0.05},
+        ])
+        # all were queued before any was started, so the one with the
+        # highest priority was started first.
+        self.assertEqual(self.manager.poll(wd2), RUNNING)
+        self.assertEqual(self.manager.poll(wd1), QUEUED)
+        self.assertEqual(self.manager.poll(wd3), QUEUED)
+        self.assertEqual(self.wait_for(wd1), SUCCESS)
+        self.assertEqual(self.manager.status[wd3].state, SUCCESS)
+        self.assertLess(
+            self.manager.status[wd3].started,
+            self.manager.status[wd1].started)
+
+    def test_stop_discard_queued(self):
+        stream = io.StringIO()
+        handler = logging.StreamHandler(stream)
+        manager_logger.addHandler(handler)
+        self.addCleanup(manager_logger.removeHandler, handler)
+        self.manager.run(s='first', t=0.05)
+        self.manager.run(s='second', t=0.05)
+        self.manager.stop()
+        self.assertIn('discarding 1 queued job(s)', stream.getvalue())
+        self.assertEqual(self.manager.queued, {})
+        sleep(0.2)  # to actually let it terminate
+
+
+class LimitsTestCase(ManagerTestCase):
+
+    manager_kw = {'limits': ResourceLimits(
+        timeout=0.5, kill_timeout=0.2, output_size=1000,
+        check_interval=0.05)}
+
+    def test_within_limits(self):
+        working_dir = self.manager.run(prog="""
+        import resource
+        with open('out', 'w') as fd:
+            fd.write('%d' % resource.getrlimit(resource.RLIMIT_NOFILE)[0])
+        """)
+        self.assertEqual(self.wait_for(working_dir), SUCCESS)
+        self.assertEqual(
+            self.manager.get_result_by_key(working_dir, 'out'), '16')
+        self.assertNotIn(working_dir, self.manager.job_limits)
+
+    def test_timeout(self):
+        working_dir = self.manager.run(prog='import time; time.sleep(10)')
+        self.assertEqual(self.wait_for(working_dir), TIMEOUT)
+        self.assertEqual(
+            self.manager.status[working_dir].returncode, -signal.SIGTERM)
+
+    def test_timeout_kill(self):
+        working_dir = self.manager.run(prog="""
+        import signal
+        import time
+        signal.signal(signal.SIGTERM, signal.SIG_IGN)
+        time.sleep(10)
+        """)
+        self.assertEqual(self.wait_for(working_dir), TIMEOUT)
+        self.assertEqual(
+            self.manager.status[working_dir].returncode, -signal.SIGKILL)
+
+    def test_file_size(self):
+        # python ignores SIGXFSZ; restore the default as for any other
+        # program.
+        working_dir = self.manager.run(prog="""
+        import signal
+        signal.signal(signal.SIGXFSZ, signal.SIG_DFL)
+        with open('out', 'wb') as fd:
+            fd.write(b'x' * 2000)
+        """)
+        self.assertEqual(self.wait_for(working_dir), KILLED)
+
+    def test_output_size(self):
+        working_dir = self.manager.run(prog="""
+        import time
+        for name in ('a', 'b'):
+            with open(name, 'wb') as fd:
+                fd.write(b'x' * 600)
+        time.sleep(10)
+        """)
+        self.assertEqual(self.wait_for(working_dir), KILLED)
+        self.assertEqual(self.manager.status[working_dir].violation, KILLED)
+
+    def test_memoize_skips_killed(self):
+        self.manager.memoize = True
+        prog = 'import time; time.sleep(10)'
+        working_dir = self.manager.run(prog=prog)
+        self.assertEqual(self.wait_for(working_dir), TIMEOUT)
+        self.assertNotEqual(self.manager.run(prog=prog), working_dir)
+
+
+class CancelTestCase(ManagerTestCase):
+
+    manager_kw = {'max_concurrent': 1}
+
+    def test_cancel_running(self):
+        wd1 = self.manager.run(prog='import time; time.sleep(10)')
+        wd2 = self.manager.run(prog='pass')
+        self.assertEqual(self.manager.poll(wd2), QUEUED)
+        self.assertTrue(self.manager.cancel(wd1))
+        # the slot is given to the queued job right away.
+        self.assertNotEqual(self.manager.poll(wd2), QUEUED)
+        self.assertTrue(self.wait_evicted(wd1))
+
+    def test_cancel_queued(self):
+        states = []
+        self.manager.subscribe(
+            lambda working_dir, status: states.append(status.state))
+        self.manager.run(prog='import time; time.sleep(0.2)')
+        working_dir = self.manager.run(prog='pass')
+        self.assertTrue(self.manager.cancel(working_dir))
+        self.assertTrue(self.wait_evicted(working_dir))
+        self.assertEqual(states[-2:], [CANCELLED, EVICTED])
+
+    def test_cancel_evicted_off_watchdog(self):
+        threads = []
+        self.manager.subscribe(lambda working_dir, status: (
+            status.state == EVICTED and threads.append(current_thread())))
+        working_dir = self.manager.run(prog='import time; time.sleep(10)')
+        self.assertTrue(self.manager.cancel(working_dir))
+        self.assertTrue(wait_until(lambda: threads))
+        self.assertEqual(len(threads), 1)
+        self.assertIsNot(threads[0], self.manager.watchdog.thread)
+        self.manager.stop()
+        self.assertIsNone(self.manager.evictor)
+
+    def test_cancel_finished(self):
+        working_dir = self.manager.run(prog='pass')
+        self.assertEqual(self.wait_for(working_dir), SUCCESS)
+        self.assertFalse(self.manager.cancel(working_dir))
+        self.assertTrue(self.wait_evicted(working_dir))
+        with self.assertRaises(KeyError):
+            self.manager.cancel(working_dir)
+
+    def test_cancel_process_group(self):
+        working_dir = self.manager.run(prog="""
+        import subprocess
+        import sys
+        import time
+        child = subprocess.Popen(
+            [sys.executable, '-c', 'import time; time.sleep(10)'])
+        with open('pid', 'w') as fd:
+            fd.write(str(child.pid))
+        time.sleep(10)
+        """)
+        target = join(working_dir, 'pid')
+        self.assertTrue(wait_until(
+            lambda: exists(target) and os.path.getsize(target)))
+        with open(target) as fd:
+            pid = int(fd.read())
+        self.assertTrue(self.manager.cancel(working_dir))
+        self.assertTrue(self.wait_evicted(working_dir))
+
+        def terminated():
+            try:
+                with open('/proc/%d/stat' % pid) as fd:
+                    return fd.read().rsplit(')', 1)[1].split()[0] == 'Z'
+            except OSError:
+                return True
+
+        self.assertTrue(
+            wait_until(terminated), 'child process was not terminated')
+
+
+class ResultFilesTestCase(ManagerTestCase):
+
+    def test_list_result_files(self):
+        working_dir = self.manager.run(prog="""
+        import os
+        os.makedirs('sub/deeper')
+        os.makedirs('.compressed')
+        for name in ('b.txt', 'a.log', 'sub/c.txt', 'sub/deeper/d.txt',
+                     '.compressed/b.txt.gz'):
+            with open(name, 'w') as fd:
+                fd.write(name)
+        os.symlink('/etc/passwd', 'link.txt')
+        """)
+        with self.assertRaises(KeyError):
+            self.manager.list_result_files(working_dir)
+        self.assertEqual(self.wait_for(working_dir), SUCCESS)
+
+        results = self.manager.list_result_files(working_dir)
+        self.assertEqual([key for key, path in results], [
+            'a.log', 'b.txt', 'sub/c.txt', 'sub/deeper/d.txt'])
+        self.assertEqual(results[2][1], join(working_dir, 'sub', 'c.txt'))
+        self.assertEqual([
+            key for key, path in self.manager.list_result_files(
+                working_dir, '*.txt')
+        ], ['b.txt', 'sub/c.txt', 'sub/deeper/d.txt'])
+        self.assertEqual([
+            key for key, path in self.manager.list_result_files(
+                working_dir, 'sub/*/*')
+        ], ['sub/deeper/d.txt'])
+        with self.assertRaises(KeyError):
+            self.manager.list_result_files('/no/such/dir')
+
+
+class ResultIndexTestCase(ManagerTestCase):
+
+    def test_index(self):
+        working_dir = self.run_job(prog="""
+        import os
+        os.makedirs('sub')
+        for name in ('out', 'sub/nested'):
+            with open(name, 'w') as fd:
+                fd.write(name)
+        os.symlink('/etc/passwd', 'link')
+        """)
+        index = self.manager.indexes[working_dir]
+        self.assertEqual(list(index), ['out', 'sub/nested'])
+        self.assertEqual(index['out'].size, 3)
+        self.assertEqual(index['out'].inode, os.stat(index['out'].path).st_ino)
+        # along with the link itself, though it is no result.
+        self.assertEqual(
+            self.manager.status[working_dir].size,
+            13 + len('/etc/passwd') + self.logs_size(working_dir))
+
+        self.assertEqual(
+            self.manager.lookup_path(working_dir, 'sub/nested'),
+            join(working_dir, 'sub', 'nested'))
+        for key in ('link', 'sub', '../out', 'sub/../out', ''):
+            self.assertIsNone(self.manager.lookup_path(working_dir, key))
+
+        # restored jobs are indexed on demand.
+        self.manager.invalidate(working_dir)
+        self.assertNotIn(working_dir, self.manager.indexes)
+        self.assertEqual(
+            self.manager.lookup_path(working_dir, 'out'),
+            join(working_dir, 'out'))
+        self.assertIn(working_dir, self.manager.indexes)
+
+        self.manager.evict(working_dir)
+        self.assertNotIn(working_dir, self.manager.indexes)
+
+    def test_lookup_running(self):
+        sibling = self.manager.create_working_dir() + '_sibling'
+        os.mkdir(sibling)
+        self.addCleanup(os.rmdir, sibling)
+        with open(join(sibling, 'secret'), 'w'):
+            pass
+        self.addCleanup(os.unlink, join(sibling, 'secret'))
+
+        working_dir = self.manager.run(prog="""
+        import os
+        import time
+        with open('out', 'w') as fd:
+            fd.write('out')
+        os.symlink('/etc/passwd', 'link')
+        time.sleep(10)
+        """)
+        self.addCleanup(self.manager.cancel, working_dir)
+        self.assertTrue(wait_until(lambda: exists(join(working_dir, 'link'))))
+        self.assertEqual(
+            self.manager.lookup_path(working_dir, 'out'),
+            join(working_dir, 'out'))
+        self.assertIsNone(self.manager.lookup_path(working_dir, 'link'))
+        # the sibling shares the working_dir as the prefix.
+        self.assertIsNone(self.manager.lookup_path(
+            working_dir, '../%s/secret' % os.path.basename(sibling)))
+        self.assertIsNone(self.manager.lookup_path(working_dir, '.'))
+
+    def test_open_dir_fd(self):
+        self.manager.use_dir_fd = True
+        working_dir = self.run_job(prog="""
+        with open('out', 'w') as fd:
+            fd.write('hello')
+        """)
+        with self.manager.open_result(working_dir, 'out') as fd:
+            self.assertEqual(fd.read(), b'hello')
+        self.assertIn(working_dir, self.manager.dir_fds)
+        with self.assertRaises(KeyError):
+            self.manager.open_result(working_dir, 'nothing')
+
+        # replaced since it was indexed.
+        with open(join(working_dir, 'out.new'), 'w') as fd:
+            fd.write('other')
+        os.rename(join(working_dir, 'out.new'), join(working_dir, 'out'))
+        with self.assertRaises(KeyError):
+            self.manager.open_result(working_dir, 'out')
+
+        self.manager.evict(working_dir)
+        self.assertEqual(self.manager.dir_fds, {})
+
+
+class DependencyTestCase(ManagerTestCase):
+
+    def test_pipeline(self):
+        wd1 = self.manager.run(prog="""
+        import time
+        time.sleep(0.2)
+        with open('out', 'w') as fd:
+            fd.write('hello')
+        """)
+        wd2 = self.manager.run(prog="""
+        with open('out', 'w') as fd:
+            fd.write('world')
+        """)
+        wd3 = self.manager.run_after([wd1, wd2], prog="""
+        with open('.upstream/0/out') as a, open('.upstream/1/out') as b:
+            with open('out', 'w') as fd:
+                fd.write(a.read() + ' ' + b.read())
+        """)
+        self.assertEqual(self.manager.poll(wd3), QUEUED)
+        self.assertEqual(self.manager.status[wd3].upstream, (wd1, wd2))
+        self.assertEqual(self.wait_for(wd3), SUCCESS)
+        self.assertEqual(
+            self.manager.get_result_by_key(wd3, 'out'), 'hello world')
+        # the upstream results are neither copied nor listed.
+        linked = join(wd3, '.upstream', '0', 'out')
+        self.assertEqual(
+            os.stat(linked).st_ino, os.stat(join(wd1, 'out')).st_ino)
+        self.assertFalse(os.stat(linked).st_mode & 0o222)
+        self.assertEqual(self.manager.list_result_keys(wd3), ['out'])
+
+        # available even after the upstream job is evicted.
+        self.manager.evict(wd1)
+        wd4 = self.manager.run_after([wd2, wd3], prog="""
+        with open('.upstream/1/out') as src, open('out', 'w') as fd:
+            fd.write(src.read())
+        """)
+        self.assertEqual(self.wait_for(wd4), SUCCESS)
+        self.assertEqual(
+            self.manager.get_result_by_key(wd4, 'out'), 'hello world')
+
+        with self.assertRaises(KeyError):
+            self.manager.run_after([wd1], prog='pass')
+        self.assertEqual(len(os.listdir(self.manager.root)), 3)
+
+    def test_blocked(self):
+        wd1 = self.manager.run(prog="""
+        import sys
+        import time
+        time.sleep(0.1)
+        sys.exit(1)
+        """)
+        wd2 = self.manager.run_after([wd1], prog='pass')
+        wd3 = self.manager.run_after([wd2], prog='pass')
+        self.assertEqual(self.wait_for(wd3), FAILURE)
+        self.assertEqual(self.manager.poll(wd2), FAILURE)
+        self.assertEqual(self.manager.status[wd2].blocked_by, wd1)
+        self.assertEqual(self.manager.status[wd3].blocked_by, wd2)
+        self.assertIsNone(self.manager.status[wd3].started)
+
+        # blocked right away by a failed upstream.
+        wd4 = self.manager.run_after([wd1], prog='pass')
+        self.assertEqual(self.manager.poll(wd4), FAILURE)
+        self.assertEqual(self.manager.waiting, {})
+        self.assertEqual(self.manager.downstream, {})
+
+    def test_cancel_waiting(self):
+        wd1 = self.manager.run(prog='import time; time.sleep(0.2)')
+        wd2 = self.manager.run_after([wd1], prog='pass')
+        wd3 = self.manager.run_after([wd2], prog='pass')
+        self.assertTrue(self.manager.cancel(wd2))
+        self.assertEqual(self.manager.poll(wd3), FAILURE)
+        self.assertEqual(self.manager.status[wd3].blocked_by, wd2)
+        self.assertEqual(self.wait_for(wd1), SUCCESS)
+        self.assertEqual(self.manager.waiting, {})
+
+
+class OutputTestCase(ManagerTestCase):
+
+    manager_kw = {'log_size': 64}
+
+    def wait_closed(self, working_dir, name):
+        def read():
+            data, start, closed = self.manager.read_log(working_dir, name)
+            return (data, start) if closed else None
+
+        result = wait_until(read)
+        self.assertIsNotNone(result, 'log was not closed')
+        return result
+
+    def test_capture(self):
+        working_dir = self.manager.run(prog="""
+        import sys
+        sys.stdout.write('x' * 100 + 'done')
+        sys.stderr.write('oops')
+        """)
+        self.assertEqual(
+            self.wait_closed(working_dir, 'stdout'), (b'x' * 60 + b'done', 40))
+        self.assertEqual(self.wait_closed(working_dir, 'stderr'), (b'oops', 0))
+        self.assertEqual(
+            self.manager.read_log(working_dir, 'stdout', -4),
+            (b'done', 100, True))
+        self.assertEqual(self.wait_for(working_dir), SUCCESS)
+        # the logs are never results, but are counted in the size.
+        self.assertEqual(self.manager.list_result_keys(working_dir), [])
+        self.assertEqual(self.manager.list_result_files(working_dir), [])
+        self.assertIsNone(
+            self.manager.lookup_path(working_dir, '.logs/stdout.log'))
+        self.assertEqual(
+            self.manager.status[working_dir].size,
+            self.logs_size(working_dir))
+
+        with self.assertRaises(KeyError):
+            self.manager.read_log(working_dir, 'stdin')
+        with self.assertRaises(KeyError):
+            self.manager.read_log('/no/such/dir', 'stdout')
+
+    def test_capture_stop_running(self):
+        root = TemporaryDirectory()
+        self.addCleanup(root.cleanup)
+        manager = self.DummyManager(root=root.name)
+        manager.start()
+        working_dir = manager.run(prog="""
+        import sys
+        from time import sleep
+        sleep(0.2)
+        sys.stdout.write('late')
+        sys.stdout.flush()
+        with open('out', 'w') as fd:
+            fd.write('done')
+        """)
+        manager.stop()
+        # the output of the job left running is still collected.
+        self.assertTrue(wait_until(lambda: exists(join(working_dir, 'out'))))
+        path = manager.log_path(working_dir, 'stdout')
+        self.assertEqual(
+            wait_until(lambda: RingLog.read(path)[2] and RingLog.read(path)),
+            (b'late', 0, True))
+        self.assertTrue(wait_until(
+            lambda: manager.output_collector.thread is None))
+
+    def test_capture_disabled(self):
+        self.manager.capture_output = False
+        working_dir = self.manager.run(prog='pass')
+        self.assertEqual(self.wait_for(working_dir), SUCCESS)
+        with self.assertRaises(KeyError):
+            self.manager.read_log(working_dir, 'stdout')
+
+
+class RetentionTestCase(ManagerTestCase):
+
+    class DummyManager(DummyManagerTestCase.DummyManager):
+        def get_ttl(self, s, t, **kw):
+            return 100 if s == 'keep' else None
+
+    manager_kw = {'retention': RetentionPolicy(
+        ttl=1, max_job_size=1000, interval=None)}
+
+    def test_collect_ttl(self):
+        evicted = []
+
+        def callback(working_dir, status):
+            if status.state == EVICTED:
+                evicted.append(working_dir)
+
+        self.manager.subscribe(callback)
+        wd1 = self.manager.run(s='hello', t=0)
+        wd2 = self.manager.run(s='keep', t=0)
+        self.assertEqual(self.wait_for(wd1), SUCCESS)
+        self.assertEqual(self.wait_for(wd2), SUCCESS)
+        self.assertEqual(self.manager.collect(), [])
+
+        finished = self.manager.status[wd1].finished
+        self.assertEqual(self.manager.collect(now=finished + 2), [wd1])
+        self.assertEqual(evicted, [wd1])
+        self.assertFalse(isdir(wd1))
+        self.assertTrue(isdir(wd2))
+        with self.assertRaises(KeyError):
+            self.manager.poll(wd1)
+        self.assertNotIn(wd1, self.manager.mapping)
+        self.assertFalse(self.manager.evict(wd1))
+
+    def test_collect_oversized_inputs(self):
+        working_dir = self.manager.create_working_dir()
+        os.makedirs(join(working_dir, '.inputs'))
+        with open(join(working_dir, '.inputs', 'upload'), 'w') as fd:
+            fd.write('x' * 2000)
+        self.manager.execute(working_dir, s='hello', t=0)
+        self.assertEqual(self.wait_for(working_dir), SUCCESS)
+        # the uploaded inputs are counted, though they are no results.
+        self.assertGreater(self.manager.status[working_dir].size, 2000)
+        self.assertEqual(self.manager.list_result_keys(working_dir), ['out'])
+        self.assertEqual(self.manager.collect(), [working_dir])
+
+    def test_collect_terminate_oversized(self):
+        working_dir = self.manager.run(s='hello', t=10)
+        with open(join(working_dir, 'big'), 'wb') as fd:
+            fd.write(b'x' * 1001)
+        self.assertEqual(self.manager.collect(), [])
+        self.assertEqual(self.wait_for(working_dir), FAILURE)
+        # evicted once it is finished.
+        self.assertEqual(self.manager.collect(), [working_dir])
+
+    def test_collector_started(self):
+        manager = self.DummyManager(retention=RetentionPolicy(interval=10))
+        manager.start()
+        self.assertTrue(manager.collector.is_alive())
+        collector = manager.collector
+        manager.stop()
+        self.assertFalse(collector.is_alive())
+        self.assertIsNone(manager.collector)
+
+
+class MemoizeTestCase(ManagerTestCase):
+
+    DummyManager = DummyManagerTestCase.DummyManager
+    manager_kw = {
+        'memoize': True, 'retention': RetentionPolicy(interval=None)}
+
+    def test_memoize(self):
+        wd1 = self.manager.run(s='hello', t=0.05)
+        # coalesced while still running
+        self.assertEqual(self.manager.run(s='hello', t=0.05), wd1)
+        self.assertEqual(len(self.manager.mapping), 1)
+        wd2 = self.manager.run(s='world', t=0.05)
+        self.assertNotEqual(wd1, wd2)
+
+        self.assertEqual(self.wait_for(wd1), SUCCESS)
+        # also for finished jobs
+        self.assertEqual(self.manager.run(t=0.05, s='hello'), wd1)
+
+        self.manager.evict(wd1)
+        self.assertEqual(self.manager.memo_keys, {
+            wd2: self.manager.get_cache_key(s='world', t=0.05)})
+        wd3 = self.manager.run(s='hello', t=0.05)
+        self.assertNotEqual(wd1, wd3)
+
+    def test_memoize_failure(self):
+        wd1 = self.manager.run(s='hello', t=-1)
+        self.assertEqual(self.wait_for(wd1), FAILURE)
+        wd2 = self.manager.run(s='hello', t=-1)
+        self.assertNotEqual(wd1, wd2)
+        self.assertEqual(list(self.manager.memo.values()), [wd2])
+
+    def test_cache_key(self):
+        key = self.manager.get_cache_key(s='hello', t=1)
+        self.assertEqual(key, self.manager.get_cache_key(t=1, s='hello'))
+        self.assertNotEqual(key, self.manager.get_cache_key(s='hello', t=2))
+        self.manager.cache_version = '2'
+        self.assertNotEqual(key, self.manager.get_cache_key(s='hello', t=1))
+
+    def test_memoize_batch(self):
+        wd1, wd2, wd3 = self.manager.run_batch([
+            {'s': 'hello', 't': 0},
+            {'s': 'world', 't': 0},
+            {'s': 'hello', 't': 0},
+        ])
+        self.assertEqual(wd1, wd3)
+        self.assertNotEqual(wd1, wd2)
+        self.assertEqual(self.manager.run(s='world', t=0), wd2)
+
+    def test_memoize_disabled(self):
+        manager = self.DummyManager()
+        manager.start()
+        self.addCleanup(manager.stop)
+        wd1 = manager.run(s='hello', t=0)
+        wd2 = manager.run(s='hello', t=0)
+        self.assertNotEqual(wd1, wd2)
+        self.assertEqual(manager.memo, {})
+        # finished before the manager is stopped.
+        for working_dir in (wd1, wd2):
+            self.assertTrue(wait_until(
+                lambda: manager.poll(working_dir) == SUCCESS))
@@ -0,0 +1,89 @@
+# -*- coding: utf-8 -*-
+"""
+Resource limits test case
+"""
+
+import resource
+import unittest
+from os import mkdir
+from os.path import join
+from tempfile import TemporaryDirectory
+from threading import Event
+
+from repodono.jobs.limits import ResourceLimits
+from repodono.jobs.limits import Watchdog
+from repodono.jobs.limits import cgroup_available
+
+
+class ResourceLimitsTestCase(unittest.TestCase):
+
+    def test_rlimits(self):
+        self.assertEqual(ResourceLimits().rlimits(), [])
+        self.assertIsNone(ResourceLimits(timeout=1).preexec())
+        limits = ResourceLimits(cpu_time=2, open_files=64, output_size=1024)
+        self.assertEqual(limits.rlimits(), [
+            (resource.RLIMIT_CPU, (2, 3)),
+            (resource.RLIMIT_NOFILE, (64, 64)),
+            (resource.RLIMIT_FSIZE, (1024, 1024)),
+        ])
+        self.assertTrue(callable(limits.preexec()))
+
+    def test_replace(self):
+        limits = ResourceLimits(timeout=1, open_files=64)
+        replaced = limits.replace(timeout=2)
+        self.assertEqual(replaced.timeout, 2)
+        self.assertEqual(replaced.open_files, 64)
+        self.assertEqual(limits.timeout, 1)
+        with self.assertRaises(TypeError):
+            limits.replace(no_such_limit=1)
+
+    def test_cgroup_unavailable(self):
+        with TemporaryDirectory() as root:
+            self.assertFalse(cgroup_available(root))
+            self.assertFalse(cgroup_available(None))
+            limits = ResourceLimits(cgroup=root, memory=1 << 20)
+            self.assertIsNone(limits.create_cgroup('job'))
+            # not needed without memory or pids limits.
+            self.assertIsNone(ResourceLimits(cgroup=root).create_cgroup('j'))
+
+    def test_cgroup(self):
+        with TemporaryDirectory() as root:
+            # emulate a delegated cgroup directory.
+            open(join(root, 'cgroup.subtree_control'), 'w').close()
+            self.assertTrue(cgroup_available(root))
+            limits = ResourceLimits(cgroup=root, memory=1 << 20, pids=8)
+            path = limits.create_cgroup('job')
+            self.assertEqual(path, join(root, 'job'))
+            with open(join(path, 'memory.max')) as fd:
+                self.assertEqual(fd.read(), '1048576')
+            with open(join(path, 'pids.max')) as fd:
+                self.assertEqual(fd.read(), '8')
+
+    def test_remove_cgroup(self):
+        with TemporaryDirectory() as root:
+            path = join(root, 'job')
+            mkdir(path)
+            limits = ResourceLimits()
+            limits.remove_cgroup(path)
+            # missing is fine.
+            limits.remove_cgroup(path)
+
+
+class WatchdogTestCase(unittest.TestCase):
+
+    def test_call_later(self):
+        watchdog = Watchdog()
+        self.addCleanup(watchdog.close)
+        results = []
+        done = Event()
+        watchdog.call_later(0.1, lambda: (results.append(2), done.set()))
+        watchdog.call_later(0.05, lambda: results.append(1))
+        watchdog.call_later(10, lambda: results.append(3))
+        self.assertTrue(done.wait(5))
+        self.assertEqual(results, [1, 2])
+        watchdog.close()
+        self.assertIsNone(watchdog.thread)
+        self.assertEqual(watchdog.timers, [])
+
+    def test_close_unstarted(self):
+        Watchdog().close()
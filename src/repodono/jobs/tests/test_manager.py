@@ -6,9 +6,13 @@ Manager test case
 import unittest
 
 from os.path import isdir
+from os.path import join
+from tempfile import TemporaryDirectory
 
 from repodono.jobs.manager import WDManager
 from repodono.jobs.manager import JobManager
+from repodono.jobs.manager import JobStatus
+from repodono.jobs.manager import SUCCESS
 from repodono.jobs.exc import ManagerRuntimeError
 
 
@@ -22,6 +26,17 @@ class WDManagerTestCase(unittest.TestCase):
         manager.stop()
         self.assertFalse(isdir(root))
 
+    def test_base_manager_persistent_root(self):
+        with TemporaryDirectory() as tempdir:
+            root = join(tempdir, 'root')
+            manager = WDManager(root=root)
+            manager.start()
+            self.assertEqual(manager.root, root)
+            wd = manager.create_working_dir()
+            manager.stop()
+            self.assertIs(manager.root, NotImplemented)
+            self.assertTrue(isdir(wd))
+
     def test_base_manager_stop(self):
         manager = WDManager()
         manager.stop()  # should not error even when not started.
@@ -87,5 +102,28 @@ class JobManagerTestCase(unittest.TestCase):
         with self.assertRaises(KeyError):
             self.manager.get_result_by_key(wd, 'nothing')
 
+    def test_poll_unknown(self):
+        self.manager.start()
+        with self.assertRaises(KeyError):
+            self.manager.poll('some_dir')
+
+    def test_get_priority(self):
+        self.assertEqual(self.manager.get_priority(some='kwargs'), 0)
+
+    def test_has_capacity(self):
+        self.assertTrue(self.manager.has_capacity())
+        manager = JobManager(max_concurrent=0)
+        self.assertFalse(manager.has_capacity())
+
+    def test_restore(self):
+        self.manager.start()
+        wd = self.manager.create_working_dir()
+        with self.assertRaises(ValueError):
+            self.manager.restore(wd, JobStatus())
+        status = JobStatus()
+        status.state = SUCCESS
+        self.manager.restore(wd, status)
+        self.assertEqual(self.manager.poll(wd), SUCCESS)
+
     # rest of the tests will be done under lifecycle for the successful
     # runs require an actual get_args implementation
@@ -0,0 +1,80 @@
+# -*- coding: utf-8 -*-
+"""
+Metrics test case
+"""
+
+import unittest
+from collections import namedtuple
+
+from repodono.jobs.manager import FAILURE
+from repodono.jobs.manager import JobStatus
+from repodono.jobs.manager import RUNNING
+from repodono.jobs.manager import SUCCESS
+from repodono.jobs.metrics import Histogram
+from repodono.jobs.metrics import JobMetrics
+
+rusage = namedtuple('rusage', ['ru_utime', 'ru_stime', 'ru_maxrss'])
+
+
+def make_status(state, job_type=None):
+    status = JobStatus(submitted=100)
+    status.job_type = job_type
+    status.started = 101
+    status.state = state
+    if state != RUNNING:
+        status.finished = 103
+        status.size = 2048
+        status.account(rusage(0.5, 0.25, 1024))
+    return status
+
+
+class HistogramTestCase(unittest.TestCase):
+
+    def test_samples(self):
+        histogram = Histogram((1, 10))
+        for value in (0.5, 1, 5, 50):
+            histogram.observe(value)
+        self.assertEqual(list(histogram.samples('h', (('type', 'a'),))), [
+            'h_bucket{type="a",le="1"} 2',
+            'h_bucket{type="a",le="10"} 3',
+            'h_bucket{type="a",le="+Inf"} 4',
+            'h_sum{type="a"} 56.5',
+            'h_count{type="a"} 4',
+        ])
+
+
+class JobMetricsTestCase(unittest.TestCase):
+
+    def test_render(self):
+        metrics = JobMetrics()
+        metrics('wd1', make_status(RUNNING, 'slow'))
+        metrics('wd1', make_status(SUCCESS, 'slow'))
+        metrics('wd2', make_status(FAILURE))
+        text = metrics.render()
+        self.assertIn(
+            'repodono_jobs_started_total{type="slow"} 1\n', text)
+        self.assertIn(
+            'repodono_jobs_finished_total{type="slow",state="success"} 1\n',
+            text)
+        self.assertIn(
+            'repodono_jobs_finished_total{type="default",state="failure"} '
+            '1\n', text)
+        self.assertIn(
+            'repodono_job_wall_seconds_sum{type="slow"} 2\n', text)
+        self.assertIn(
+            'repodono_job_queue_seconds_count{type="default"} 1\n', text)
+        self.assertIn('# TYPE repodono_job_max_rss_bytes histogram\n', text)
+        self.assertNotIn('repodono_jobs_queued', text)
+
+    def test_render_gauges(self):
+        class Manager(object):
+            queued = {'a': {}}
+            running = {'b', 'c'}
+            waiting = {'d': ({}, {'a'}), 'e': ({}, {'d'})}
+            status = {'a': None, 'b': None, 'c': None, 'd': None, 'e': None}
+
+        text = JobMetrics(prefix='x').render(Manager())
+        self.assertIn('x_jobs_queued 1\n', text)
+        self.assertIn('x_jobs_running 2\n', text)
+        self.assertIn('x_jobs_waiting 2\n', text)
+        self.assertIn('x_jobs_tracked 5\n', text)
@@ -0,0 +1,93 @@
+# -*- coding: utf-8 -*-
+"""
+Output capture test case
+"""
+
+import os
+import unittest
+from os.path import join
+from tempfile import TemporaryDirectory
+from time import sleep
+
+from repodono.jobs.output import OutputCollector
+from repodono.jobs.output import RingLog
+
+
+class RingLogTestCase(unittest.TestCase):
+
+    def setUp(self):
+        tempdir = TemporaryDirectory()
+        self.addCleanup(tempdir.cleanup)
+        self.path = join(tempdir.name, 'stdout.log')
+
+    def test_read(self):
+        log = RingLog(self.path, 16)
+        self.assertEqual(RingLog.read(self.path), (b'', 0, False))
+        log.write(b'hello ')
+        log.write(b'world')
+        self.assertEqual(RingLog.read(self.path), (b'hello world', 0, False))
+        self.assertEqual(RingLog.read(self.path, 6), (b'world', 6, False))
+        self.assertEqual(RingLog.read(self.path, 0, 5), (b'hello', 0, False))
+        self.assertEqual(RingLog.read(self.path, -3), (b'rld', 8, False))
+        log.close()
+        self.assertEqual(RingLog.read(self.path, 6), (b'world', 6, True))
+        # not at the end, so the reader is not done yet.
+        self.assertEqual(RingLog.read(self.path, 0, 5), (b'hello', 0, False))
+        self.assertEqual(RingLog.read(self.path, 11), (b'', 11, True))
+
+    def test_wraparound(self):
+        log = RingLog(self.path, 8)
+        log.write(b'0123456')
+        log.write(b'789ab')
+        # the oldest bytes were overwritten.
+        self.assertEqual(RingLog.read(self.path), (b'456789ab', 4, False))
+        self.assertEqual(RingLog.read(self.path, 6), (b'6789ab', 6, False))
+        self.assertEqual(RingLog.read(self.path, -2), (b'ab', 10, False))
+        log.write(b'cdefghijklmnopqrstuvwxyz')
+        self.assertEqual(RingLog.read(self.path), (b'stuvwxyz', 28, False))
+        # the file never grows beyond its capacity.
+        self.assertEqual(
+            os.stat(self.path).st_size, RingLog.header.size + 8)
+        log.close()
+        log.close()
+
+
+class OutputCollectorTestCase(unittest.TestCase):
+
+    def setUp(self):
+        tempdir = TemporaryDirectory()
+        self.addCleanup(tempdir.cleanup)
+        self.root = tempdir.name
+        self.collector = OutputCollector()
+        self.addCleanup(self.collector.close)
+
+    def test_collect(self):
+        paths = []
+        pipes = []
+        for idx in range(3):
+            r, w = os.pipe()
+            path = join(self.root, '%d.log' % idx)
+            paths.append(path)
+            pipes.append(w)
+            self.collector.add(os.fdopen(r, 'rb'), RingLog(path, 1024))
+
+        for idx, w in enumerate(pipes):
+            os.write(w, ('output %d\n' % idx).encode())
+        os.close(pipes[0])
+
+        for x in range(50):
+            if RingLog.read(paths[0])[2]:
+                break
+            sleep(0.05)
+        self.assertEqual(RingLog.read(paths[0]), (b'output 0\n', 0, True))
+        for x in range(50):
+            if RingLog.read(paths[1])[0]:
+                break
+            sleep(0.05)
+        self.assertEqual(RingLog.read(paths[1]), (b'output 1\n', 0, False))
+
+        # the remaining logs are closed along with the collector.
+        self.collector.close()
+        self.assertTrue(RingLog.read(paths[2])[2])
+        for w in pipes[1:]:
+            os.close(w)
@@ -0,0 +1,197 @@
+# -*- coding: utf-8 -*-
+"""
+Worker pool test case
+"""
+
+import sys
+import unittest
+from os.path import join
+from os.path import realpath
+from tempfile import TemporaryDirectory
+from textwrap import dedent
+from threading import Event
+from time import sleep
+
+from repodono.jobs.manager import QUEUED
+from repodono.jobs.manager import RUNNING
+from repodono.jobs.manager import SUCCESS
+from repodono.jobs.manager import FAILURE
+from repodono.jobs.limits import ResourceLimits
+from repodono.jobs.pool import WorkerPool
+from repodono.jobs.pool import WorkerPoolJobManager
+
+
+def wait_idle(pool, count, timeout=5.0):
+    for x in range(int(timeout / 0.02)):
+        if len(pool.idle) >= count:
+            break
+        sleep(0.02)
+    return len(pool.idle)
+
+
+class DummyPoolManager(WorkerPoolJobManager):
+
+    def get_args(self, working_dir, prog, args=(), **kw):
+        return (sys.executable, '-c', dedent(prog)) + tuple(args)
+
+
+class WorkerPoolTestCase(unittest.TestCase):
+
+    def test_accepts(self):
+        pool = WorkerPool()
+        self.assertTrue(pool.accepts((sys.executable, '-c', 'pass')))
+        self.assertTrue(pool.accepts((sys.executable, '-m', 'json.tool')))
+        self.assertTrue(pool.accepts((sys.executable, 'script.py')))
+        self.assertFalse(pool.accepts((sys.executable, '-c')))
+        self.assertFalse(pool.accepts((sys.executable, '-u', 'script.py')))
+        self.assertFalse(pool.accepts((sys.executable,)))
+        self.assertFalse(pool.accepts(('/bin/true', 'script.py')))
+
+    def test_start_stop(self):
+        pool = WorkerPool(size=2)
+        pool.start()
+        workers = list(pool.idle)
+        self.assertEqual(len(workers), 2)
+        pool.stop()
+        self.assertEqual(pool.idle, [])
+        self.assertEqual([worker.returncode for worker in workers], [0, 0])
+
+    def test_dispatch_dead_worker(self):
+        pool = WorkerPool(size=1)
+        pool.start()
+        self.addCleanup(pool.stop)
+        pool.idle[0].kill()
+        pool.idle[0].wait()
+        with TemporaryDirectory() as working_dir:
+            worker = pool.dispatch(
+                (sys.executable, '-c', 'import sys; sys.exit(2)'),
+                working_dir)
+            self.assertEqual(worker.wait(), 2)
+        self.assertEqual(wait_idle(pool, 1), 1)
+
+    def test_dispatch_replenish(self):
+        pool = WorkerPool(size=1)
+        pool.start()
+        self.addCleanup(pool.stop)
+        spawn_worker = pool._spawn_worker
+        release = Event()
+
+        def slow_spawn_worker():
+            release.wait(5)
+            return spawn_worker()
+
+        pool._spawn_worker = slow_spawn_worker
+        with TemporaryDirectory() as working_dir:
+            worker = pool.dispatch((sys.executable, '-c', 'pass'), working_dir)
+            # returned without waiting for the replacement.
+            self.assertEqual(pool.idle, [])
+            release.set()
+            self.assertEqual(worker.wait(), 0)
+        self.assertEqual(wait_idle(pool, 1), 1)
+
+    def test_stop_replenishing(self):
+        pool = WorkerPool(size=1)
+        pool.start()
+        with TemporaryDirectory() as working_dir:
+            worker = pool.dispatch((sys.executable, '-c', 'pass'), working_dir)
+            self.assertEqual(worker.wait(), 0)
+        pool.stop()
+        self.assertIsNone(pool.replenisher)
+        self.assertEqual(pool.idle, [])
+
+
+class WorkerPoolJobManagerTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.manager = DummyPoolManager(pool_size=2, preload=('json',))
+        self.manager.start()
+
+    def tearDown(self):
+        self.manager.stop()
+
+    def wait_for(self, working_dir, timeout=5.0):
+        for x in range(int(timeout / 0.02)):
+            if self.manager.poll(working_dir) not in (QUEUED, RUNNING):
+                break
+            sleep(0.02)
+        return self.manager.poll(working_dir)
+
+    def test_run(self):
+        working_dir = self.manager.run(prog="""
+        import os
+        import sys
+        with open('out', 'w') as fd:
+            fd.write(' '.join([__name__, os.getcwd()] + sys.argv))
+        """, args=('a', 'b'))
+        self.assertEqual(self.wait_for(working_dir), SUCCESS)
+        self.assertEqual(
+            self.manager.get_result_by_key(working_dir, 'out'),
+            '__main__ %s -c a b' % realpath(working_dir))
+        self.assertEqual(wait_idle(self.manager.pool, 2), 2)
+
+    def test_capture_output(self):
+        working_dir = self.manager.run(prog="""
+        import sys
+        print('hello')
+        sys.stderr.write('world')
+        """)
+        self.assertEqual(self.wait_for(working_dir), SUCCESS)
+        for x in range(250):
+            if all(self.manager.read_log(working_dir, name)[2]
+                   for name in ('stdout', 'stderr')):
+                break
+            sleep(0.02)
+        self.assertEqual(
+            self.manager.read_log(working_dir, 'stdout')[0], b'hello\n')
+        self.assertEqual(
+            self.manager.read_log(working_dir, 'stderr')[0], b'world')
+
+    def test_exit_status(self):
+        wd1 = self.manager.run(prog='import sys; sys.exit(3)')
+        wd2 = self.manager.run(prog='raise ValueError("failure")')
+        self.assertEqual(self.wait_for(wd1), FAILURE)
+        self.assertEqual(self.wait_for(wd2), FAILURE)
+        self.assertEqual(self.manager.status[wd1].returncode, 3)
+        self.assertEqual(self.manager.status[wd2].returncode, 1)
+
+    def test_terminate(self):
+        working_dir = self.manager.run(prog='import time; time.sleep(10)')
+        sleep(0.1)
+        self.manager.mapping[working_dir].terminate()
+        self.assertEqual(self.wait_for(working_dir), FAILURE)
+        self.assertEqual(self.manager.status[working_dir].returncode, -15)
+
+    def test_fallback(self):
+        with TemporaryDirectory() as root:
+            script = join(root, 'script.py')
+            with open(script, 'w') as fd:
+                fd.write('import sys; sys.exit(4)')
+            process = self.manager.create_process(
+                (sys.executable, '-u', script), root)
+            self.assertNotIn(process, self.manager.pool.idle)
+            self.assertEqual(process.wait(), 4)
+            self.assertEqual(len(self.manager.pool.idle), 2)
+
+    def test_run_module_and_script(self):
+        with TemporaryDirectory() as root:
+            with open(join(root, 'script.py'), 'w') as fd:
+                fd.write('import sys; sys.exit(int(sys.argv[1]))')
+            process = self.manager.create_process(
+                (sys.executable, join(root, 'script.py'), '5'), root)
+            self.assertEqual(process.wait(), 5)
+            with open(join(root, 'mod.py'), 'w') as fd:
+                fd.write('import sys; sys.exit(len(sys.argv))')
+            process = self.manager.create_process(
+                (sys.executable, '-m', 'mod', 'x', 'y'), root)
+            self.assertEqual(process.wait(), 3)
+
+    def test_limits(self):
+        self.manager.limits = ResourceLimits(open_files=32)
+        working_dir = self.manager.run(prog="""
+        import resource
+        with open('out', 'w') as fd:
+            fd.write(str(resource.getrlimit(resource.RLIMIT_NOFILE)[0]))
+        """)
+        self.assertEqual(self.wait_for(working_dir), SUCCESS)
+        self.assertEqual(
+            self.manager.get_result_by_key(working_dir, 'out'), '32')
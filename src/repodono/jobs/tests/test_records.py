@@ -0,0 +1,162 @@
+# -*- coding: utf-8 -*-
+"""
+Job records test case
+"""
+
+import unittest
+
+from repodono.jobs.manager import JobStatus
+from repodono.jobs.manager import QUEUED
+from repodono.jobs.manager import RUNNING
+from repodono.jobs.manager import SUCCESS
+from repodono.jobs.manager import FAILURE
+from repodono.jobs.records import JobIndex
+from repodono.jobs.records import JobRecord
+from repodono.jobs.records import SequenceList
+
+
+def status(state, submitted=1.0):
+    result = JobStatus(submitted=submitted)
+    result.state = state
+    return result
+
+
+def ids(page):
+    records, cursor = page
+    return [record.job_id for record in records], cursor
+
+
+class JobIndexTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.index = JobIndex()
+        for idx in range(10):
+            self.index.add('job%d' % idx, '/wd%d' % idx, status(QUEUED))
+
+    def test_record(self):
+        record = self.index.get('job0')
+        self.assertEqual(record.as_dict(), {
+            'id': 'job0', 'status': QUEUED, 'submitted': 1.0,
+            'started': None, 'finished': None, 'returncode': None,
+        })
+        self.assertEqual(record.working_dir, '/wd0')
+        with self.assertRaises(AttributeError):
+            record.extra = True
+        self.assertFalse(hasattr(record, '__dict__'))
+        # only the listed fields of the status are kept.
+        self.assertNotIn('status', JobRecord.__slots__)
+        with self.assertRaises(AttributeError):
+            JobStatus().extra = True
+
+    def test_page(self):
+        self.assertEqual(ids(self.index.page(limit=4)), (
+            ['job0', 'job1', 'job2', 'job3'], 3))
+        self.assertEqual(ids(self.index.page(after=3, limit=4)), (
+            ['job4', 'job5', 'job6', 'job7'], 7))
+        self.assertEqual(ids(self.index.page(after=7, limit=4)), (
+            ['job8', 'job9'], None))
+        # an exact fit is the last page.
+        self.assertEqual(ids(self.index.page(after=5, limit=4)), (
+            ['job6', 'job7', 'job8', 'job9'], None))
+
+    def test_states(self):
+        self.index.update('job7', status(RUNNING))
+        self.index.update('job2', status(RUNNING))
+        self.index.update('job5', status(FAILURE))
+        self.index.update('job2', status(SUCCESS))
+        self.index.update('nothing', status(SUCCESS))
+        self.assertEqual(ids(self.index.page([RUNNING])), (['job7'], None))
+        self.assertEqual(ids(self.index.page([SUCCESS, FAILURE])), (
+            ['job2', 'job5'], None))
+        self.assertEqual(ids(self.index.page(
+            [SUCCESS, FAILURE, SUCCESS], limit=1)), (['job2'], 2))
+        self.assertEqual(ids(self.index.page(
+            [SUCCESS, FAILURE], after=2, limit=1)), (['job5'], None))
+        self.assertEqual(ids(self.index.page([QUEUED], after=6)), (
+            ['job8', 'job9'], None))
+        self.assertEqual(self.index.page(['timeout']), ([], None))
+
+    def test_remove(self):
+        self.assertEqual(self.index.remove('job3').job_id, 'job3')
+        self.assertIsNone(self.index.remove('job3'))
+        self.index.update('job4', status(SUCCESS))
+        self.assertEqual(len(self.index), 9)
+        self.assertEqual(ids(self.index.page(after=1, limit=2)), (
+            ['job2', 'job4'], 4))
+        self.assertEqual(ids(self.index.page([QUEUED], after=1, limit=2)), (
+            ['job2', 'job5'], 5))
+
+        # re-added as the most recent.
+        self.index.add('job0', '/wd0', status(SUCCESS))
+        self.assertEqual(ids(self.index.page([SUCCESS])), (
+            ['job4', 'job0'], None))
+
+    def test_live(self):
+        for idx in range(8):
+            self.index.update('job%d' % idx, status(RUNNING))
+        for idx in range(6):
+            self.index.remove('job%d' % idx)
+        # only the records that remain are indexed, in their state.
+        self.assertEqual(list(self.index.ordered), [6, 7, 8, 9])
+        self.assertEqual({
+            state: list(sequences)
+            for state, sequences in self.index.states.items()
+        }, {RUNNING: [6, 7], QUEUED: [8, 9]})
+        self.assertEqual(sorted(self.index.sequences), [6, 7, 8, 9])
+        self.assertEqual(ids(self.index.page([RUNNING])), (
+            ['job6', 'job7'], None))
+
+        # the fields are copied on every update.
+        finished = status(SUCCESS)
+        finished.returncode = 0
+        finished.finished = 2.0
+        record = self.index.update('job6', finished)
+        self.assertEqual(record.as_dict()['finished'], 2.0)
+        finished.finished = 3.0
+        self.index.update('job6', finished)
+        self.assertEqual(record.as_dict()['finished'], 3.0)
+        self.assertEqual(record.returncode, 0)
+
+        self.index.clear()
+        self.assertEqual(self.index.page(), ([], None))
+
+
+class SequenceListTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.sequences = SequenceList()
+        self.sequences.load = 2
+
+    def test_add_remove(self):
+        for sequence in range(10):
+            self.sequences.add(sequence)
+        self.assertEqual(list(self.sequences), list(range(10)))
+        self.assertEqual(len(self.sequences), 10)
+        # split into buckets of bounded size.
+        self.assertGreater(len(self.sequences.buckets), 1)
+        self.assertTrue(all(
+            len(bucket) < 4 for bucket in self.sequences.buckets))
+        self.assertEqual(self.sequences.maxes, [
+            bucket[-1] for bucket in self.sequences.buckets])
+
+        for sequence in (0, 1, 3, 9):
+            self.sequences.remove(sequence)
+        self.sequences.add(1)
+        self.assertEqual(list(self.sequences), [1, 2, 4, 5, 6, 7, 8])
+        self.assertEqual(len(self.sequences), 7)
+        self.assertEqual(self.sequences.maxes, [
+            bucket[-1] for bucket in self.sequences.buckets])
+
+        for sequence in list(self.sequences):
+            self.sequences.remove(sequence)
+        self.assertEqual(self.sequences.buckets, [])
+        self.assertEqual(len(self.sequences), 0)
+
+    def test_after(self):
+        for sequence in range(0, 20, 2):
+            self.sequences.add(sequence)
+        self.assertEqual(
+            list(self.sequences.after(7)), [8, 10, 12, 14, 16, 18])
+        self.assertEqual(list(self.sequences.after(8)), [10, 12, 14, 16, 18])
+        self.assertEqual(list(self.sequences.after(18)), [])
+        self.assertEqual(list(self.sequences.after(-1)), list(range(0, 20, 2)))
@@ -0,0 +1,221 @@
+# -*- coding: utf-8 -*-
+"""
+Remote agents test case
+"""
+
+import os
+import socket
+import sys
+import unittest
+from os.path import dirname
+from os.path import exists
+from os.path import join
+from subprocess import PIPE
+from subprocess import Popen
+from time import sleep
+from time import time
+
+import repodono.jobs
+from repodono.jobs.agent import Agent
+from repodono.jobs.exc import ManagerRuntimeError
+from repodono.jobs.manager import JobManager
+from repodono.jobs.manager import QUEUED
+from repodono.jobs.manager import RUNNING
+from repodono.jobs.manager import SUCCESS
+from repodono.jobs.manager import FAILURE
+from repodono.jobs.manager import CANCELLED
+from repodono.jobs.remote import AgentClient
+from repodono.jobs.remote import AgentError
+from repodono.jobs.remote import RemoteJobManager
+
+
+class EchoManager(JobManager):
+
+    def get_args(self, working_dir, msg, t=0, **kw):
+        return (sys.executable, '-c', '\n'.join([
+            'import os, sys, time',
+            'os.chdir(%r)' % working_dir,
+            'time.sleep(%f)' % t,
+            'sys.exit(1) if %r == "fail" else None' % msg,
+            'open("out", "w").write(%r)' % msg,
+        ]))
+
+
+class RemoteJobManagerTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.agents = []
+        for x in range(3):
+            agent = Agent(EchoManager(max_concurrent=1))
+            agent.start()
+            self.addCleanup(agent.stop)
+            self.agents.append(agent)
+        self.manager = RemoteJobManager(
+            agents=[agent.url for agent in self.agents], poll_interval=0.05)
+        self.manager.start()
+        self.addCleanup(self.manager.stop)
+
+    def wait_for(self, working_dir, timeout=5.0):
+        for x in range(int(timeout / 0.02)):
+            if self.manager.poll(working_dir) not in (QUEUED, RUNNING):
+                break
+            sleep(0.02)
+        return self.manager.poll(working_dir)
+
+    def placed(self, working_dir):
+        process = self.manager.placements[working_dir]
+        self.assertTrue(process.placed.wait(5))
+        return process
+
+    def agent_dir(self, working_dir):
+        process = self.placed(working_dir)
+        agent = self.agents[[
+            agent.url for agent in self.agents].index(process.agent.url)]
+        return join(agent.manager.root, process.job_id)
+
+    def test_not_configured(self):
+        with self.assertRaises(ManagerRuntimeError):
+            RemoteJobManager().start()
+
+    def test_placement(self):
+        working_dirs = [
+            self.manager.run(msg='job %d' % x, t=0.2) for x in range(3)]
+        # each of the agents has a job, as the least utilized.
+        self.assertEqual(len(set(
+            self.manager.placements[wd].agent for wd in working_dirs)), 3)
+        for working_dir in working_dirs:
+            self.assertIsNotNone(self.placed(working_dir).job_id)
+        for x, working_dir in enumerate(working_dirs):
+            self.assertEqual(self.wait_for(working_dir), SUCCESS)
+            self.assertEqual(os.listdir(working_dir), [])
+            self.assertEqual(
+                self.manager.list_result_keys(working_dir), ['out'])
+            self.assertEqual(
+                self.manager.get_result_by_key(working_dir, 'out'),
+                'job %d' % x)
+            self.assertEqual(self.manager.status[working_dir].size, 5)
+            self.assertIsNone(self.manager.lookup_path(working_dir, 'out'))
+
+        with self.manager.open_result(working_dirs[0], 'out') as fd:
+            self.assertEqual(fd.read(), b'job 0')
+        with self.assertRaises(KeyError):
+            self.manager.open_result(working_dirs[0], 'nothing')
+        self.assertEqual(
+            self.manager.get_result_view(working_dirs[0], 'out').tobytes(),
+            b'job 0')
+        url = self.manager.remote_url(working_dirs[0], '/results/out')
+        self.assertTrue(url.startswith(
+            self.manager.placements[working_dirs[0]].agent.url))
+
+        # evicted from the agent along with the job.
+        agent_dir = self.agent_dir(working_dirs[0])
+        self.assertTrue(exists(agent_dir))
+        self.assertTrue(self.manager.evict(working_dirs[0]))
+        for x in range(50):
+            if not exists(agent_dir):
+                break
+            sleep(0.02)
+        self.assertFalse(exists(agent_dir))
+
+    def test_failure(self):
+        working_dir = self.manager.run(msg='fail')
+        self.assertEqual(self.wait_for(working_dir), FAILURE)
+        self.assertEqual(self.manager.status[working_dir].returncode, 1)
+
+    def test_cancel(self):
+        working_dir = self.manager.run(msg='cancel', t=10)
+        agent_dir = self.agent_dir(working_dir)
+        states = []
+        self.manager.subscribe(lambda wd, status: states.append(status.state))
+        self.assertTrue(self.manager.cancel(working_dir))
+        for x in range(250):
+            if not exists(agent_dir) and working_dir not in (
+                    self.manager.status):
+                break
+            sleep(0.02)
+        self.assertEqual(states, [CANCELLED, 'evicted'])
+        self.assertFalse(exists(agent_dir))
+
+    def test_unavailable_agent(self):
+        self.agents[0].stop()
+        self.manager.agents[0].load = -1
+        working_dir = self.manager.run(msg='hello')
+        self.assertNotEqual(
+            self.placed(working_dir).agent, self.manager.agents[0])
+        self.assertEqual(self.wait_for(working_dir), SUCCESS)
+
+    def test_no_agents(self):
+        for agent in self.agents:
+            agent.stop()
+        working_dir = self.manager.run(msg='hello')
+        self.assertIsNone(self.placed(working_dir).job_id)
+        self.assertEqual(self.wait_for(working_dir), FAILURE)
+        self.assertIsNone(self.manager.status[working_dir].returncode)
+        self.assertEqual(self.manager.list_result_keys(working_dir), [])
+        self.assertIsNone(self.manager.remote_url(working_dir))
+
+    def test_unresponsive_agent(self):
+        # accepts the connections but never responds.
+        server = socket.socket()
+        self.addCleanup(server.close)
+        server.bind(('127.0.0.1', 0))
+        server.listen(8)
+        manager = RemoteJobManager(
+            agents=['http://127.0.0.1:%d' % server.getsockname()[1]])
+        manager.agents[0].timeout = 0.5
+        manager.start()
+        self.addCleanup(manager.stop)
+
+        started = time()
+        working_dir = manager.run(msg='hello')
+        cancelled = manager.run(msg='cancelled')
+        self.assertTrue(manager.cancel(cancelled))
+        # neither waited on the agent.
+        self.assertLess(time() - started, 0.25)
+        self.assertEqual(manager.poll(working_dir), RUNNING)
+        self.assertTrue(manager.placements[working_dir].placed.wait(5))
+        for x in range(50):
+            if manager.poll(working_dir) == FAILURE:
+                break
+            sleep(0.02)
+        self.assertEqual(manager.poll(working_dir), FAILURE)
+
+
+class AgentTestCase(unittest.TestCase):
+
+    def test_agent_process(self):
+        env = dict(os.environ)
+        env['PYTHONPATH'] = os.pathsep.join(
+            [dirname(dirname(dirname(repodono.jobs.__file__)))]
+            + env.get('PYTHONPATH', '').split(os.pathsep))
+        process = Popen([
+            sys.executable, '-m', 'repodono.jobs.agent',
+            'repodono.jobs.tests.test_remote:EchoManager',
+            '--max-concurrent', '2',
+        ], stdout=PIPE, env=env)
+        self.addCleanup(process.wait)
+        self.addCleanup(process.stdout.close)
+        self.addCleanup(process.terminate)
+        client = AgentClient(process.stdout.readline().decode().strip())
+        client.refresh()
+        self.assertEqual((client.load, client.capacity), (0, 2))
+
+        job_id = client.submit({'msg': 'hello'})
+        for x in range(250):
+            if client.poll([job_id])[job_id]['state'] == SUCCESS:
+                break
+            sleep(0.02)
+        self.assertEqual(client.describe(job_id), {
+            'state': SUCCESS, 'returncode': 0, 'keys': ['out']})
+        self.assertEqual(client.index(job_id)[0][:2], ['out', 5])
+        with client.open_result(job_id, 'out') as response:
+            self.assertEqual(response.read(), b'hello')
+
+        with self.assertRaises(AgentError) as e:
+            client.describe('nosuchjob')
+        self.assertEqual(e.exception.status, 404)
+        with self.assertRaises(AgentError) as e:
+            client.open_result(job_id, '../out')
+        self.assertEqual(e.exception.status, 404)
+        self.assertEqual(client.poll(['nosuchjob']), {
+            'nosuchjob': {'state': 'evicted', 'returncode': None}})
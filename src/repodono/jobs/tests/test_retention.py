@@ -0,0 +1,108 @@
+# -*- coding: utf-8 -*-
+"""
+Retention test case
+"""
+
+import unittest
+from os import mkdir
+from os.path import join
+from tempfile import TemporaryDirectory
+from threading import Event
+
+from repodono.jobs.manager import JobStatus
+from repodono.jobs.manager import SUCCESS
+from repodono.jobs.retention import GarbageCollector
+from repodono.jobs.retention import RetentionPolicy
+from repodono.jobs.retention import disk_usage
+
+
+def finished_status(finished, accessed=None, size=0, ttl=None):
+    status = JobStatus(submitted=finished)
+    status.state = SUCCESS
+    status.finished = finished
+    status.accessed = finished if accessed is None else accessed
+    status.size = size
+    status.ttl = ttl
+    return status
+
+
+class DiskUsageTestCase(unittest.TestCase):
+
+    def test_disk_usage(self):
+        with TemporaryDirectory() as root:
+            self.assertEqual(disk_usage(root), 0)
+            with open(join(root, 'a'), 'wb') as fd:
+                fd.write(b'x' * 10)
+            mkdir(join(root, 'nested'))
+            with open(join(root, 'nested', 'b'), 'wb') as fd:
+                fd.write(b'x' * 5)
+            self.assertEqual(disk_usage(root), 15)
+
+    def test_disk_usage_missing(self):
+        with TemporaryDirectory() as root:
+            self.assertEqual(disk_usage(join(root, 'missing')), 0)
+
+
+class RetentionPolicyTestCase(unittest.TestCase):
+
+    def test_default(self):
+        policy = RetentionPolicy()
+        finished = [('a', finished_status(0, size=100))]
+        self.assertEqual(policy.select(finished, 100, 1e9), [])
+
+    def test_ttl(self):
+        policy = RetentionPolicy(ttl=10)
+        finished = [
+            ('a', finished_status(0)),
+            ('b', finished_status(5)),
+            ('c', finished_status(5, ttl=2)),
+            ('d', finished_status(0, ttl=100)),
+        ]
+        self.assertEqual(policy.select(finished, 0, 12), ['a', 'c'])
+
+    def test_max_job_size(self):
+        policy = RetentionPolicy(max_job_size=10)
+        finished = [
+            ('a', finished_status(0, size=11)),
+            ('b', finished_status(0, size=10)),
+        ]
+        self.assertEqual(policy.select(finished, 21, 0), ['a'])
+
+    def test_max_total_size_lru(self):
+        policy = RetentionPolicy(max_total_size=25)
+        finished = [
+            ('a', finished_status(0, accessed=3, size=10)),
+            ('b', finished_status(0, accessed=1, size=10)),
+            ('c', finished_status(0, accessed=2, size=10)),
+        ]
+        self.assertEqual(policy.select(finished, 30, 0), ['b'])
+        # running jobs count towards the total.
+        self.assertEqual(policy.select(finished, 40, 0), ['b', 'c'])
+
+    def test_max_jobs(self):
+        policy = RetentionPolicy(max_jobs=1)
+        finished = [
+            ('a', finished_status(0, accessed=3)),
+            ('b', finished_status(0, accessed=1)),
+            ('c', finished_status(0, accessed=2)),
+        ]
+        self.assertEqual(policy.select(finished, 0, 0), ['b', 'c'])
+
+
+class GarbageCollectorTestCase(unittest.TestCase):
+
+    def test_collect(self):
+        called = Event()
+
+        class Manager(object):
+            def collect(self):
+                called.set()
+                raise Exception('failure should not stop the collector')
+
+        collector = GarbageCollector(Manager(), 0.01)
+        collector.start()
+        self.assertTrue(called.wait(5))
+        called.clear()
+        self.assertTrue(called.wait(5))
+        collector.stop()
+        self.assertFalse(collector.is_alive())
@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+"""
+Selector thread test case
+"""
+
+import os
+import unittest
+from threading import Event
+
+from repodono.jobs.selector import SelectorThread
+
+
+class PipeReader(SelectorThread):
+
+    name = 'PipeReader'
+
+    def __init__(self):
+        super(PipeReader, self).__init__()
+        self.data = []
+        self.released = []
+        self.event = Event()
+
+    def ready(self, key):
+        data = os.read(key.fd, 4096)
+        if data:
+            self.data.append((key.data, data))
+        else:
+            self.selector.unregister(key.fd)
+            self.release(key.fd, key.data)
+        self.event.set()
+
+    def release(self, fd, data):
+        os.close(fd)
+        self.released.append(data)
+
+
+class SelectorThreadTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.reader = PipeReader()
+        self.addCleanup(self.reader.close)
+
+    def pipe(self):
+        r, w = os.pipe()
+        self.addCleanup(os.close, w)
+        return r, w
+
+    def test_close_unstarted(self):
+        self.reader.close()
+        self.assertIsNone(self.reader.thread)
+
+    def test_ready(self):
+        r, w = self.pipe()
+        self.reader.watch(r, 'first')
+        self.assertEqual(self.reader.thread.name, 'PipeReader')
+        os.write(w, b'hello')
+        self.assertTrue(self.reader.event.wait(5))
+        self.assertEqual(self.reader.data, [('first', b'hello')])
+
+    def test_close_releases(self):
+        r1, w1 = self.pipe()
+        r2, w2 = self.pipe()
+        self.reader.watch(r1, 'first')
+        self.reader.watch(r2, 'second')
+        self.reader.close()
+        self.assertEqual(sorted(self.reader.released), ['first', 'second'])
+        self.assertIsNone(self.reader.thread)
+        self.assertIsNone(self.reader.selector)
+
+        # started again on demand.
+        r3, w3 = os.pipe()
+        self.reader.watch(r3, 'third')
+        os.close(w3)
+        self.assertTrue(self.reader.event.wait(5))
+        self.assertEqual(self.reader.released[-1], 'third')
+
+    def test_drain(self):
+        r, w = os.pipe()
+        self.reader.watch(r, 'first')
+        self.reader.drain()
+        # still watched until released.
+        os.write(w, b'hello')
+        self.assertTrue(self.reader.event.wait(5))
+        self.assertEqual(self.reader.data, [('first', b'hello')])
+        thread = self.reader.thread
+        self.assertTrue(thread.is_alive())
+        os.close(w)
+        thread.join(5)
+        self.assertFalse(thread.is_alive())
+        self.assertEqual(self.reader.released, ['first'])
+        self.assertIsNone(self.reader.thread)
+        self.assertIsNone(self.reader.selector)
+
+    def test_drain_unstarted(self):
+        self.reader.drain()
+        self.assertIsNone(self.reader.thread)
@@ -0,0 +1,175 @@
+# -*- coding: utf-8 -*-
+"""
+Spawn strategies test case
+"""
+
+import sys
+import unittest
+from subprocess import TimeoutExpired
+from time import sleep
+from unittest import mock
+
+from repodono.jobs.limits import ResourceLimits
+from repodono.jobs.manager import JobManager
+from repodono.jobs.manager import QUEUED
+from repodono.jobs.manager import RUNNING
+from repodono.jobs.manager import SUCCESS
+from repodono.jobs.manager import FAILURE
+from repodono.jobs.manager import CANCELLED
+from repodono.jobs.spawn import HELPER
+from repodono.jobs.spawn import POSIX_SPAWN
+from repodono.jobs.spawn import STRATEGIES
+from repodono.jobs.spawn import Spawner
+from repodono.jobs.spawn import posix_spawn
+from repodono.jobs.spawn import posix_spawnp
+from repodono.jobs.spawn import unsupported
+
+SLEEP = 'import time; time.sleep(60)'
+PRINT_NOFILE = (
+    'import resource; print(resource.getrlimit(resource.RLIMIT_NOFILE)[0])')
+
+
+class EchoManager(JobManager):
+
+    def get_args(self, working_dir, code='pass', **kw):
+        return (sys.executable, '-c', code)
+
+
+@unittest.skipIf(posix_spawnp is None, 'posix_spawn is not available')
+class PosixSpawnTestCase(unittest.TestCase):
+
+    def test_spawn(self):
+        process = posix_spawn(
+            (sys.executable, '-c', 'print("hello"); exit(3)'), capture=True)
+        self.addCleanup(process.stderr.close)
+        self.addCleanup(process.stdout.close)
+        self.assertEqual(process.stdout.read(), b'hello\n')
+        self.assertEqual(process.wait(), 3)
+        self.assertEqual(process.poll(), 3)
+
+    def test_terminate(self):
+        process = posix_spawn((sys.executable, '-c', SLEEP))
+        with self.assertRaises(TimeoutExpired):
+            process.wait(timeout=0.01)
+        process.terminate()
+        self.assertEqual(process.wait(), -15)
+
+    def test_missing(self):
+        with self.assertRaises(OSError):
+            posix_spawn(('/nonexistent/executable',), capture=True)
+
+
+@unittest.skipIf(unsupported(HELPER), 'spawner is not supported')
+class SpawnerTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.spawner = Spawner()
+        self.spawner.start()
+        self.addCleanup(self.spawner.stop)
+
+    def test_spawn(self):
+        process = self.spawner.spawn(
+            (sys.executable, '-c', PRINT_NOFILE + '; exit(3)'),
+            rlimits=ResourceLimits(open_files=42).rlimits(), capture=True)
+        self.addCleanup(process.stderr.close)
+        self.addCleanup(process.stdout.close)
+        self.assertEqual(process.stdout.read(), b'42\n')
+        self.assertEqual(process.wait(timeout=5), 3)
+        self.assertIsNotNone(process.rusage.ru_maxrss)
+        self.assertEqual(self.spawner.processes, {})
+
+    def test_missing(self):
+        with self.assertRaises(OSError) as e:
+            self.spawner.spawn(('/nonexistent/executable',), capture=True)
+        self.assertEqual(e.exception.errno, 2)
+        self.assertEqual(self.spawner.requests, {})
+
+    def test_stop(self):
+        process = self.spawner.spawn((sys.executable, '-c', SLEEP))
+        with self.assertRaises(TimeoutExpired):
+            process.wait(timeout=0.01)
+        # the subprocesses left running are killed.
+        self.spawner.stop()
+        self.assertEqual(process.wait(timeout=5), -9)
+        with self.assertRaises(OSError):
+            self.spawner.spawn((sys.executable, '-c', 'pass'))
+
+
+class SpawnStrategyTestCase(unittest.TestCase):
+
+    def run_jobs(self, strategy):
+        manager = EchoManager(
+            spawn_strategy=strategy, limits=ResourceLimits(open_files=42))
+        manager.start()
+        self.addCleanup(manager.stop)
+        states = {}
+        manager.subscribe(
+            lambda wd, status: states.setdefault(wd, status.state)
+            if status.state not in (QUEUED, RUNNING) else None)
+        working_dirs = [
+            manager.run(code=PRINT_NOFILE),
+            manager.run(code='exit(1)'),
+            manager.run(code=SLEEP),
+        ]
+        self.assertTrue(manager.cancel(working_dirs[2]))
+        for x in range(250):
+            if len(states) == 3:
+                break
+            sleep(0.02)
+        self.assertEqual(
+            [states.get(wd) for wd in working_dirs],
+            [SUCCESS, FAILURE, CANCELLED])
+        status = manager.status[working_dirs[0]]
+        self.assertIsNotNone(status.maxrss)
+        for x in range(50):
+            if manager.read_log(working_dirs[0], 'stdout')[2]:
+                break
+            sleep(0.02)
+        self.assertEqual(
+            manager.read_log(working_dirs[0], 'stdout')[0], b'42\n')
+
+    def test_strategies(self):
+        for strategy in STRATEGIES:
+            if unsupported(strategy):
+                continue
+            with self.subTest(strategy=strategy):
+                self.run_jobs(strategy)
+
+    def test_posix_spawn_without_limits(self):
+        if posix_spawnp is None:
+            self.skipTest('posix_spawn is not available')
+        manager = EchoManager(spawn_strategy=POSIX_SPAWN)
+        manager.start()
+        self.addCleanup(manager.stop)
+        working_dir = manager.create_working_dir()
+        process = manager.create_process(
+            manager.get_args(working_dir), working_dir)
+        self.addCleanup(process.stderr.close)
+        self.addCleanup(process.stdout.close)
+        self.assertTrue(process.child)
+        self.assertEqual(process.wait(timeout=5), 0)
+
+    def test_spawner_lifecycle(self):
+        if unsupported(HELPER):
+            self.skipTest('spawner is not supported')
+        manager = EchoManager(spawn_strategy=HELPER)
+        self.assertIsNone(manager.spawner.process)
+        manager.start()
+        self.assertIsNotNone(manager.spawner.process)
+        manager.stop()
+        self.assertIsNone(manager.spawner.process)
+
+    def test_unknown(self):
+        with self.assertRaises(ValueError) as e:
+            EchoManager(spawn_strategy='fork')
+        self.assertEqual(str(e.exception), "unknown spawn_strategy 'fork'")
+
+    def test_unsupported(self):
+        with mock.patch('repodono.jobs.spawn.posix_spawnp', None):
+            with self.assertRaises(ValueError) as e:
+                EchoManager(spawn_strategy=POSIX_SPAWN)
+        self.assertIn('posix_spawnp', str(e.exception))
+        with mock.patch('socket.socketpair', side_effect=OSError):
+            with self.assertRaises(ValueError) as e:
+                EchoManager(spawn_strategy=HELPER)
+        self.assertIn('SOCK_SEQPACKET', str(e.exception))
@@ -0,0 +1,109 @@
+# -*- coding: utf-8 -*-
+"""
+Job store test case
+"""
+
+import sqlite3
+import unittest
+from os.path import join
+from tempfile import TemporaryDirectory
+
+from repodono.jobs.manager import JobStatus
+from repodono.jobs.manager import SUCCESS
+from repodono.jobs.store import JobStore
+from repodono.jobs.store import SQLiteJobStore
+
+
+class JobStoreTestCase(unittest.TestCase):
+
+    def test_interface(self):
+        store = JobStore()
+        store.open()
+        with self.assertRaises(NotImplementedError):
+            store.put('job', 'wd', JobStatus())
+        with self.assertRaises(NotImplementedError):
+            store.delete('job')
+        with self.assertRaises(NotImplementedError):
+            store.get('job')
+        with self.assertRaises(NotImplementedError):
+            store.load()
+        store.close()
+
+
+class SQLiteJobStoreTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.tempdir = TemporaryDirectory()
+        self.addCleanup(self.tempdir.cleanup)
+        self.path = join(self.tempdir.name, 'jobs.db')
+
+    def make_store(self, **kw):
+        store = SQLiteJobStore(self.path, **kw)
+        store.open()
+        self.addCleanup(store.close)
+        return store
+
+    def count_rows(self):
+        conn = sqlite3.connect(self.path)
+        try:
+            return conn.execute('SELECT COUNT(*) FROM jobs').fetchone()[0]
+        finally:
+            conn.close()
+
+    def test_wal(self):
+        store = self.make_store(flush_interval=None)
+        self.assertEqual(store.conn.execute(
+            'PRAGMA journal_mode').fetchone()[0], 'wal')
+
+    def test_put_get_delete(self):
+        store = self.make_store(flush_interval=None)
+        status = JobStatus(submitted=1.0)
+        status.state = SUCCESS
+        status.returncode = 0
+        status.started = 2.0
+        status.finished = 3.0
+        status.pid = 123
+        store.put('job', '/tmp/wd', status)
+
+        working_dir, restored = store.get('job')
+        self.assertEqual(working_dir, '/tmp/wd')
+        self.assertEqual(restored.state, SUCCESS)
+        self.assertEqual(restored.returncode, 0)
+        self.assertEqual(restored.submitted, 1.0)
+        self.assertEqual(restored.started, 2.0)
+        self.assertEqual(restored.finished, 3.0)
+        self.assertEqual(restored.accessed, 3.0)
+        self.assertEqual(restored.pid, 123)
+
+        store.flush()
+        self.assertEqual(store.get('job')[0], '/tmp/wd')
+
+        store.delete('job')
+        self.assertIsNone(store.get('job'))
+        store.flush()
+        self.assertIsNone(store.get('job'))
+        self.assertIsNone(store.get('no_such_job'))
+
+    def test_batched(self):
+        store = self.make_store(batch_size=3, flush_interval=None)
+        store.put('job1', '/tmp/wd1', JobStatus())
+        store.put('job2', '/tmp/wd2', JobStatus())
+        self.assertEqual(self.count_rows(), 0)
+        # the same job is coalesced.
+        store.put('job2', '/tmp/wd2', JobStatus())
+        self.assertEqual(self.count_rows(), 0)
+        store.put('job3', '/tmp/wd3', JobStatus())
+        self.assertEqual(self.count_rows(), 3)
+
+    def test_close_reopen(self):
+        store = SQLiteJobStore(self.path, flush_interval=0.01)
+        store.open()
+        store.put('job1', '/tmp/wd1', JobStatus())
+        store.put('job2', '/tmp/wd2', JobStatus())
+        store.close()
+        store.close()
+
+        store = self.make_store()
+        self.assertEqual(
+            sorted((job_id, wd) for job_id, wd, status in store.load()),
+            [('job1', '/tmp/wd1'), ('job2', '/tmp/wd2')])
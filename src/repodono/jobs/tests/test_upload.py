@@ -0,0 +1,112 @@
+# -*- coding: utf-8 -*-
+"""
+Upload test case
+"""
+
+import hashlib
+import unittest
+from os import listdir
+from os.path import join
+from tempfile import TemporaryDirectory
+
+from repodono.jobs.upload import MultipartUpload
+from repodono.jobs.upload import RawUpload
+from repodono.jobs.upload import Upload
+from repodono.jobs.upload import UploadError
+from repodono.jobs.upload import create_reader
+from repodono.jobs.upload import safe_filename
+
+BOUNDARY = b'----boundary'
+
+BODY = b'\r\n'.join([
+    b'preamble',
+    b'------boundary',
+    b'Content-Disposition: form-data; name="msg"',
+    b'',
+    b'hello',
+    b'------boundary',
+    b'Content-Disposition: form-data; name="data"; filename="../in.bin"',
+    b'Content-Type: application/octet-stream',
+    b'',
+    b'\r\n------bound\r\n' + bytes(range(256)) * 64,
+    b'------boundary',
+    b'Content-Disposition: form-data; name="msg"',
+    b'',
+    b'world',
+    b'------boundary--',
+    b'epilogue',
+])
+
+DATA = b'\r\n------bound\r\n' + bytes(range(256)) * 64
+
+
+def feed(reader, body, size):
+    for idx in range(0, len(body), size):
+        reader.feed(body[idx:idx + size])
+    return reader.close()
+
+
+class UploadTestCase(unittest.TestCase):
+
+    def setUp(self):
+        tempdir = TemporaryDirectory()
+        self.addCleanup(tempdir.cleanup)
+        self.directory = join(tempdir.name, '.inputs')
+
+    def test_safe_filename(self):
+        self.assertEqual(safe_filename('../in.bin'), 'in.bin')
+        self.assertEqual(safe_filename('C:\\x\\a b.txt'), 'a_b.txt')
+        self.assertEqual(safe_filename('..'), 'upload')
+
+    def test_multipart(self):
+        # every chunk size, such that the delimiters are split at every
+        # possible position.
+        for size in (1, 2, 3, 7, 16, 17, 1000, len(BODY)):
+            with TemporaryDirectory() as directory:
+                reader = MultipartUpload(directory, BOUNDARY)
+                fields = feed(reader, BODY, size)
+                self.assertEqual(fields['msg'], ['hello', 'world'])
+                path = join(directory, '0-in.bin')
+                self.assertEqual(fields['data'], [Upload(
+                    path, '../in.bin', len(DATA),
+                    hashlib.sha256(DATA).hexdigest())])
+                with open(path, 'rb') as fd:
+                    self.assertEqual(fd.read(), DATA)
+
+    def test_multipart_errors(self):
+        reader = MultipartUpload(self.directory, BOUNDARY)
+        reader.feed(BODY[:-30])
+        with self.assertRaises(UploadError) as e:
+            reader.close()
+        self.assertEqual(e.exception.status, 400)
+        reader.abort()
+        self.assertEqual(listdir(self.directory), [])
+
+        reader = MultipartUpload(self.directory, BOUNDARY)
+        with self.assertRaises(UploadError):
+            reader.feed(b'------boundary\r\n\r\nnameless\r\n')
+        with self.assertRaises(UploadError):
+            MultipartUpload(self.directory, BOUNDARY).feed(
+                b'------boundaryxx')
+
+        reader = MultipartUpload(self.directory, BOUNDARY)
+        reader.max_field_size = 4
+        with self.assertRaises(UploadError) as e:
+            feed(reader, BODY, 100)
+        self.assertEqual(e.exception.status, 413)
+
+    def test_raw(self):
+        reader = RawUpload(self.directory, 'input', {'msg': ['hello']})
+        fields = feed(reader, DATA, 100)
+        self.assertEqual(fields['msg'], ['hello'])
+        self.assertEqual(fields['input'][0].size, len(DATA))
+        self.assertEqual(listdir(self.directory), ['0-input'])
+
+    def test_create_reader(self):
+        self.assertIsInstance(create_reader(
+            'multipart/form-data; boundary="--boundary"', self.directory,
+            'input'), MultipartUpload)
+        self.assertIsInstance(create_reader(
+            None, self.directory, 'input'), RawUpload)
+        with self.assertRaises(UploadError):
+            create_reader('multipart/form-data', self.directory, 'input')
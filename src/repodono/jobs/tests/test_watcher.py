@@ -0,0 +1,80 @@
+# -*- coding: utf-8 -*-
+"""
+Child watcher test case
+"""
+
+import sys
+import unittest
+from subprocess import Popen
+from threading import Event
+from time import sleep
+from unittest import mock
+
+from repodono.jobs import watcher
+from repodono.jobs.watcher import ChildWatcher
+
+
+class ChildWatcherTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.watcher = ChildWatcher()
+        self.addCleanup(self.watcher.close)
+        self.results = []
+        self.rusage = []
+        self.event = Event()
+
+    def callback(self, returncode, rusage):
+        self.results.append(returncode)
+        self.rusage.append(rusage)
+        self.event.set()
+
+    def spawn(self, code):
+        return Popen((sys.executable, '-c', code))
+
+    def test_close_unstarted(self):
+        self.watcher.close()
+
+    def test_watch(self):
+        self.watcher.add(self.spawn('import sys; sys.exit(3)'), self.callback)
+        self.assertTrue(self.event.wait(5))
+        self.assertEqual(self.results, [3])
+        if watcher.wait4 is not None:
+            self.assertGreaterEqual(self.rusage[0].ru_utime, 0)
+
+    def test_watch_multiple(self):
+        processes = [self.spawn('pass') for x in range(3)]
+        for process in processes:
+            self.watcher.add(process, self.callback)
+        for x in range(50):
+            if len(self.results) == 3:
+                break
+            sleep(0.1)
+        self.assertEqual(self.results, [0, 0, 0])
+
+    def test_close_pending(self):
+        process = self.spawn('import time; time.sleep(10)')
+        self.addCleanup(process.wait)
+        self.addCleanup(process.kill)
+        self.watcher.add(process, self.callback)
+        self.watcher.close()
+        self.assertIsNone(self.watcher.thread)
+        self.assertEqual(self.results, [])
+
+    def test_watch_fallback(self):
+        with mock.patch.object(watcher, 'pidfd_open', None):
+            self.watcher.add(self.spawn('pass'), self.callback)
+        self.assertTrue(self.event.wait(5))
+        self.assertEqual(self.results, [0])
+        self.assertIsNone(self.watcher.thread)
+
+    def test_reap_not_child(self):
+        process = mock.Mock(pid=0x7fffffff)
+        process.wait.return_value = 0
+        self.assertEqual(watcher.reap(process), (0, None))
+
+    def test_watch_signalled(self):
+        process = self.spawn('import os; os.kill(os.getpid(), 9)')
+        self.watcher.add(process, self.callback)
+        self.assertTrue(self.event.wait(5))
+        self.assertEqual(self.results, [-9])
+        self.assertEqual(process.returncode, -9)
@@ -0,0 +1,274 @@
+# -*- coding: utf-8 -*-
+"""
+Streamed uploads of the inputs of the jobs into their working_dirs
+"""
+
+import hashlib
+import re
+
+from collections import namedtuple
+from email.message import Message
+from email.utils import collapse_rfc2231_value
+from os import makedirs
+from os import unlink
+from os.path import basename
+from os.path import join
+
+# an uploaded file, as passed to verify_run_kwargs.
+Upload = namedtuple('Upload', ['path', 'filename', 'size', 'digest'])
+
+PREAMBLE = 'preamble'
+DELIMITER = 'delimiter'
+HEADERS = 'headers'
+BODY = 'body'
+DONE = 'done'
+
+
+class UploadError(ValueError):
+    """
+    The upload is malformed (status 400) or too large (413).
+    """
+
+    def __init__(self, message, status=400):
+        super(UploadError, self).__init__(message)
+        self.status = status
+
+
+def safe_filename(filename):
+    """
+    Return the filename reduced to a safe name for a file, which keeps
+    its extension.
+    """
+
+    name = re.sub(r'[^A-Za-z0-9._-]', '_', basename(
+        filename.replace('\\', '/'))).lstrip('.')
+    return name[-100:] or 'upload'
+
+
+def parse_header(value, header='content-disposition'):
+    message = Message()
+    message[header] = value
+    return message
+
+
+class InputFile(object):
+    """
+    Write an uploaded file to path as its chunks arrive, hashing it on
+    the fly.
+    """
+
+    # the hash algorithm for the digest of the uploads.
+    algorithm = 'sha256'
+
+    def __init__(self, path, filename):
+        self.path = path
+        self.filename = filename
+        self.size = 0
+        self.hash = hashlib.new(self.algorithm)
+        self.fd = open(path, 'xb')
+
+    def write(self, data):
+        self.fd.write(data)
+        self.hash.update(data)
+        self.size += len(data)
+
+    def close(self):
+        self.fd.close()
+        return Upload(
+            self.path, self.filename, self.size, self.hash.hexdigest())
+
+    def abort(self):
+        if not self.fd.closed:
+            self.fd.close()
+        try:
+            unlink(self.path)
+        except OSError:
+            pass
+
+
+class UploadReader(object):
+    """
+    The base reader of a request body fed to it in chunks; the files
+    are written into the directory as they are read.  The fields are
+    a dict of lists of the values, with the Upload of each file as the
+    value for those.
+    """
+
+    def __init__(self, directory, fields=None):
+        self.directory = directory
+        self.fields = {} if fields is None else fields
+        self.files = []
+
+    def create_file(self, filename):
+        makedirs(self.directory, exist_ok=True)
+        input_file = InputFile(join(self.directory, '%d-%s' % (
+            len(self.files), safe_filename(filename))), filename)
+        self.files.append(input_file)
+        return input_file
+
+    def feed(self, data):
+        raise NotImplementedError
+
+    def close(self):
+        """
+        Return the fields once the whole body has been fed.
+        """
+
+        return self.fields
+
+    def abort(self):
+        """
+        Remove the files written so far.
+        """
+
+        for input_file in self.files:
+            input_file.abort()
+
+
+class RawUpload(UploadReader):
+    """
+    Read a raw request body as a single file uploaded as the field name.
+    """
+
+    def __init__(self, directory, name, fields=None):
+        super(RawUpload, self).__init__(directory, fields)
+        self.name = name
+        self.file = self.create_file(name)
+
+    def feed(self, data):
+        self.file.write(data)
+
+    def close(self):
+        self.fields[self.name] = [self.file.close()]
+        return self.fields
+
+
+class MultipartUpload(UploadReader):
+    """
+    Read a multipart/form-data request body incrementally, such that
+    only the chunk being fed and a few bytes that may be the start of
+    the delimiter are held in memory, along with the values of the
+    fields that are not files, up to max_field_size bytes each.
+    """
+
+    # the most bytes of the headers of a part.
+    max_header_size = 16384
+    # the most bytes of the value of a field that is not a file.
+    max_field_size = 65536
+
+    def __init__(self, directory, boundary, fields=None):
+        super(MultipartUpload, self).__init__(directory, fields)
+        self.delimiter = b'\r\n--' + boundary
+        # the delimiter at the very start is not preceded by a newline.
+        self.buffer = b'\r\n'
+        self.state = PREAMBLE
+        self.part = None
+
+    def feed(self, data):
+        buffer = self.buffer + data if self.buffer else data
+        view = memoryview(buffer)
+        pos = 0
+        while True:
+            state = self.state
+            if state in (PREAMBLE, BODY):
+                idx = buffer.find(self.delimiter, pos)
+                if idx < 0:
+                    # keep the bytes that may start the delimiter.
+                    keep = max(len(buffer) - len(self.delimiter) + 1, pos)
+                    if state == BODY and keep > pos:
+                        self.part_data(view[pos:keep])
+                    pos = keep
+                    break
+                if state == BODY:
+                    if idx > pos:
+                        self.part_data(view[pos:idx])
+                    self.part_end()
+                pos = idx + len(self.delimiter)
+                self.state = DELIMITER
+            elif state == DELIMITER:
+                if len(buffer) - pos < 2:
+                    break
+                tail = buffer[pos:pos + 2]
+                if tail == b'--':
+                    self.state = DONE
+                elif tail == b'\r\n':
+                    # the newline is left for finding the empty line
+                    # that ends the headers.
+                    self.state = HEADERS
+                else:
+                    raise UploadError('malformed multipart body')
+            elif state == HEADERS:
+                idx = buffer.find(b'\r\n\r\n', pos)
+                if idx < 0:
+                    if len(buffer) - pos > self.max_header_size:
+                        raise UploadError('multipart headers too large')
+                    break
+                self.part_begin(buffer[pos + 2:idx])
+                pos = idx + 4
+                self.state = BODY
+            else:
+                # the epilogue is discarded.
+                pos = len(buffer)
+                break
+        self.buffer = buffer[pos:]
+
+    def part_begin(self, raw):
+        headers = {}
+        for line in raw.decode('utf8', 'replace').split('\r\n'):
+            name, sep, value = line.partition(':')
+            if sep:
+                headers[name.strip().lower()] = value.strip()
+        disposition = parse_header(headers.get('content-disposition', ''))
+        name = disposition.get_param('name', header='content-disposition')
+        if name is not None:
+            name = collapse_rfc2231_value(name)
+        if not name:
+            raise UploadError('multipart part without a name')
+        filename = disposition.get_filename()
+        if filename is None:
+            self.part = (name, bytearray())
+        else:
+            self.part = (name, self.create_file(filename))
+
+    def part_data(self, data):
+        name, part = self.part
+        if isinstance(part, InputFile):
+            part.write(data)
+            return
+        if len(part) + len(data) > self.max_field_size:
+            raise UploadError('field %s too large' % name, 413)
+        part += data
+
+    def part_end(self):
+        name, part = self.part
+        if isinstance(part, InputFile):
+            value = part.close()
+        else:
+            try:
+                value = part.decode('utf8')
+            except UnicodeDecodeError:
+                raise UploadError('field %s is not valid utf-8' % name)
+        self.fields.setdefault(name, []).append(value)
+        self.part = None
+
+    def close(self):
+        if self.state != DONE:
+            raise UploadError('incomplete multipart body')
+        return self.fields
+
+
+def create_reader(content_type, directory, name, fields=None):
+    """
+    Return the UploadReader for a request body of the content_type, to
+    write its files into the directory; a body that is not multipart
+    is a single file uploaded as the field name.
+    """
+
+    message = parse_header(content_type or '', header='content-type')
+    if message.get_content_type() != 'multipart/form-data':
+        return RawUpload(directory, name, fields)
+    boundary = message.get_param('boundary', header='content-type')
+    if not boundary or len(boundary) > 70:
+        raise UploadError('invalid multipart boundary')
+    return MultipartUpload(
+        directory, boundary.encode('latin-1', 'replace'), fields)
@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+"""
+Watcher for the termination of subprocesses
+"""
+
+import logging
+import os
+
+from threading import Thread
+
+from .selector import SelectorThread
+from .spawn import SpawnedProcess
+from .spawn import exitcode
+
+logger = logging.getLogger(__name__)
+
+pidfd_open = getattr(os, 'pidfd_open', None)
+wait4 = getattr(os, 'wait4', None)
+
+
+def reap(process):
+    """
+    Wait for the process to terminate, return its returncode and its
+    resource usage (from wait4), or None where that is unavailable.
+    """
+
+    if wait4 is None:
+        return process.wait(), None
+    try:
+        pid, status, rusage = wait4(process.pid, 0)
+    except ChildProcessError:
+        # not our child, or already reaped through the Popen instance;
+        # the resource usage of a subprocess of the Spawner is reported
+        # to it instead.
+        returncode = process.wait()
+        if isinstance(process, SpawnedProcess):
+            return returncode, process.rusage
+        return returncode, None
+    process.returncode = exitcode(status)
+    return process.returncode, rusage
+
+
+class ChildWatcher(SelectorThread):
+    """
+    Collect the exit statuses of subprocesses as they terminate, and
+    invoke the callback registered with each of them with the
+    returncode and the resource usage of the subprocess.
+
+    Where pidfd is available, all subprocesses are watched by a single
+    background thread; otherwise a thread will be started to wait on
+    each of the watched subprocesses.  The callbacks are invoked from
+    those threads.
+    """
+
+    name = 'ChildWatcher'
+
+    def add(self, process, callback):
+        """
+        Watch the process (a Popen instance), the callback will be
+        called with the returncode and the resource usage (or None)
+        once it has terminated.
+        """
+
+        pidfd = None
+        if pidfd_open is not None:
+            try:
+                pidfd = pidfd_open(process.pid)
+            except OSError:
+                pass
+
+        if pidfd is None:
+            # no pidfd support; fall back to a dedicated thread.
+            thread = Thread(
+                target=self._notify, args=(process, callback),
+                name='ChildWatcher-%d' % process.pid)
+            thread.daemon = True
+            thread.start()
+            return
+
+        self.watch(pidfd, (process, callback))
+
+    def _notify(self, process, callback):
+        try:
+            callback(*reap(process))
+        except Exception:
+            logger.exception(
+                'error in callback for subprocess %d', process.pid)
+
+    def ready(self, key):
+        self.selector.unregister(key.fd)
+        os.close(key.fd)
+        self._notify(*key.data)
+
+    def release(self, pidfd, data):
+        # the callbacks for the remaining subprocesses are not invoked.
+        os.close(pidfd)
@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+"""
+Warm worker for the WorkerPool
+
+This module is executed directly as a script by the pool, so it must
+only depend on the standard library.  Once started it imports the
+modules named by its arguments, then waits for a single job to be
+written to its stdin as a line of JSON with the Python command line
+arguments, the working directory and the resource limits, and runs it
+as the Python interpreter would have.
+"""
+
+import json
+import os
+import runpy
+import sys
+import types
+
+
+def run(argv):
+    """
+    Run the Python command line arguments (excluding the executable).
+    """
+
+    if argv[0] == '-c':
+        sys.argv = ['-c'] + argv[2:]
+        sys.path[0] = ''
+        module = types.ModuleType('__main__')
+        sys.modules['__main__'] = module
+        exec(compile(argv[1], '<string>', 'exec'), module.__dict__)
+    elif argv[0] == '-m':
+        sys.argv = argv[1:]
+        sys.path[0] = os.getcwd()
+        runpy.run_module(argv[1], run_name='__main__', alter_sys=True)
+    else:
+        sys.argv = argv
+        sys.path[0] = os.path.dirname(os.path.abspath(argv[0]))
+        runpy.run_path(argv[0], run_name='__main__')
+
+
+def limit(rlimits, cgroup):
+    """
+    Apply the resource limits and join the cgroup, as for the preexec_fn
+    of the subprocesses spawned by the manager.
+    """
+
+    if cgroup:
+        with open(os.path.join(cgroup, 'cgroup.procs'), 'w') as fd:
+            fd.write('0')
+    if rlimits:
+        import resource
+        for rlimit, value in rlimits:
+            resource.setrlimit(rlimit, tuple(value))
+
+
+def main(preload):
+    for name in preload:
+        __import__(name)
+
+    line = sys.stdin.readline()
+    if not line:
+        # pool has shut down.
+        return
+
+    job = json.loads(line)
+    devnull = os.open(os.devnull, os.O_RDONLY)
+    os.dup2(devnull, 0)
+    os.close(devnull)
+    os.chdir(job['cwd'])
+    limit(job.get('rlimits'), job.get('cgroup'))
+    run(job['args'][1:])
+
+
+if __name__ == '__main__':
+    # the directory of this script must not shadow anything.
+    sys.path[0] = ''
+    main(sys.argv[1:])